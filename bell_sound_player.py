@@ -5,8 +5,16 @@ import pygame
 import pygame.mixer as mixer
 import logging
 import datetime
+import threading
+import time
 from time import sleep
 
+from pibells.core import latency_stats
+from pibells.audio.audio_dispatcher import audio_dispatcher
+from pibells.audio.sound_bank import sound_bank
+from pibells.audio.channel_allocator import channel_allocator
+from pibells.audio.peals import map_bell_to_peal_index
+
 class bell_sound:
     """ Class (structure) to hold the bell sounds and file names
         This is to make setting up of the different peals more flexible
@@ -60,27 +68,54 @@ class valid_peal:
 class bell_sound_player:
     """ Class to handle playing the bell sounds
     """
-    def __init__( self ):
-        """ Create the class with the device name
+    def __init__( self, audio_backend = "pygame" ):
+        """ Create the class with the audio backend to use
+            "pygame" plays each bell on its own mixer channel as soon as it is asked for (the default)
+            "numpy" mixes the bells in software, so they can be scheduled to the exact sample with play_bell_at
+            "null" plays as pygame does, but to SDL's dummy audio driver so no sound card is needed (e.g. testing)
         """
+        if audio_backend == "null":
+            os.environ.setdefault( "SDL_AUDIODRIVER", "dummy" )
+        
         #Start the sounds
         pygame.mixer.pre_init(22050, -16, 1, 64)
         pygame.mixer.init()
         pygame.init() #Is this needed?
         
-        #expect a maximum of 12 bells, allow 24 concurrent channels, after which the old sounds will be stopped and the channel reused
-        pygame.mixer.set_num_channels(24)
+        self.logger = logging.getLogger("PiBells")
+        
+        #The software mixer is only imported when used, so NumPy isn't needed for the pygame backend
+        self.software_mixer = None
+        if audio_backend == "numpy":
+            #The software mixer mixes mono signed 16 bit samples, which the mixer may not have been given
+            frequency, sample_format, channels = pygame.mixer.get_init()
+            if sample_format != -16 or channels != 1:
+                self.logger.error("The numpy audio backend needs a mono signed 16 bit mixer, not format %d with %d channels, using pygame", sample_format, channels)
+            else:
+                from pibells.audio.software_mixer import software_mixer
+                self.software_mixer = software_mixer( frequency )
+        elif audio_backend not in ( "pygame", "null" ):
+            self.logger.error("Unknown audio backend %s, using pygame", audio_backend)
         
         #Delay to wait after playing the sound - this helps keep the sound stable
+        #Only used when playing on the calling thread, the dispatcher thread doesn't need it
         self.post_sound_wait_s = 0.01;
         
-        self.logger = logging.getLogger("PiBells")
-        
         #Store all the loaded bell sounds
         self.all_bell_sounds = list()
+        self.loaded_sound_names = set()
+        #The sounds can be loaded by a background thread while bells are being played
+        self.sound_lock = threading.Lock()
+        
+        #Where the sounds are loaded from
+        self.sound_path = None
+        self.bank = None
+        #The sound bank file, kept alongside the sound files it is built from
+        self.sound_bank_file_name = "sound_bank.bin"
         
-        #Store the valid peals
+        #Store the valid peals, and a flag for each set once its sounds are ready
         self.valid_peals = list()
+        self.peals_loaded = list()
         
         #Store the currently selected valid_peal for ease of access
         self.current_bell_sounds = None
@@ -89,6 +124,20 @@ class bell_sound_player:
         #Set the tenor
         self.tenor = None
         
+        #Optional latency_stats to record how long each stage of playing a bell takes
+        self.latency = None
+        
+        #All mixer playing goes through the dispatcher, which plays on its own thread once started
+        self.dispatcher = audio_dispatcher()
+        
+        #Time between successive bells, used with the number of bells to size the channel pools
+        #0.2s is about peal speed, and matches the demo
+        self.bell_gap_s = 0.2
+        
+        #expect a maximum of 12 bells, with 2 voices each, until the tenor and key are selected
+        if self.software_mixer is None:
+            self.dispatcher.configure_channels( range( 1, 13 ), 2 )
+        
     def load_sound_files( self, path, sound_file_names ):
         """ Load all the given sound files and store them in an array of `bell_sounds`
             path - the path to load the files from
@@ -96,11 +145,44 @@ class bell_sound_player:
         """
         self.logger.info("Loading bell sounds")
         self.all_bell_sounds = list() #clear any old sounds
+        self.loaded_sound_names = set()
         
+        self.open_sound_source( path, sound_file_names )
         for name in sound_file_names:
-            full_file_name = path + os.path.sep + name + '.wav'
-            sound = pygame.mixer.Sound( full_file_name )
+            self.load_sound( name )
+    
+    def open_sound_source( self, path, sound_file_names ):
+        """ Prepare the precompiled sound bank to load the sounds from, it is rebuilt if any of the files have changed
+            If the bank can't be used, the sound files are decoded instead
+        """
+        self.sound_path = path
+        self.bank = sound_bank( path + os.path.sep + self.sound_bank_file_name )
+        try:
+            self.bank.prepare( path, sound_file_names )
+        except Exception:
+            self.logger.exception("Unable to load the sound bank, decoding the sound files instead")
+            self.bank = None
+    
+    def load_sound( self, name ):
+        """ Load a single sound and add it to the `bell_sounds`, unless it is already loaded
+            This is safe to call from the background loading thread and a caller at the same time
+        """
+        with self.sound_lock:
+            if name in self.loaded_sound_names:
+                return
+            
+            sound = None
+            if self.bank is not None:
+                try:
+                    sound = self.bank.load_sound( name )
+                except Exception:
+                    self.logger.exception("Unable to load " + name + " from the sound bank, decoding the sound file instead")
+            if sound is None:
+                full_file_name = self.sound_path + os.path.sep + name + '.wav'
+                sound = pygame.mixer.Sound( full_file_name )
+            
             self.all_bell_sounds.append( bell_sound( name, sound ) )
+            self.loaded_sound_names.add( name )
     
     def load_valid_peals( self, valid_peals ):
         """ Load an array of valid_peal objects in the order they can be selected
@@ -108,8 +190,64 @@ class bell_sound_player:
         """
         self.logger.info("Configuring valid peal sounds for %d valid peals", len( valid_peals ) );
         self.valid_peals = valid_peals
+        self.peals_loaded = list()
         for peal in self.valid_peals:
             peal.configure_sounds( self.all_bell_sounds )
+            loaded = threading.Event()
+            loaded.set()
+            self.peals_loaded.append( loaded )
+    
+    def load_sounds_in_background( self, path, sound_file_names, valid_peals, first_valid_peal_index ):
+        """ Load the sounds for the first valid peal straight away, so bells can ring, then the rest on a background thread
+            Until a valid peal has been loaded, selecting it waits for just its own sounds to be loaded
+            path - the path to load the files from
+            sound_file_names - the list of sound file names to load (without the `.wav` extension)
+            valid_peals - the valid_peal objects in the order they can be selected, as load_valid_peals
+            first_valid_peal_index - the valid peal to load first, normally the configured key
+        """
+        self.all_bell_sounds = list() #clear any old sounds
+        self.loaded_sound_names = set()
+        self.valid_peals = valid_peals
+        self.peals_loaded = [ threading.Event() for peal in valid_peals ]
+        
+        first_valid_peal_index = self.limit_valid_peal_index( first_valid_peal_index )
+        self.logger.info("Loading bell sounds for %s first", self.valid_peals[ first_valid_peal_index ].key )
+        
+        self.open_sound_source( path, sound_file_names )
+        self.load_valid_peal( first_valid_peal_index )
+        
+        #The key is changed one step at a time, so load the nearest peals first
+        load_order = sorted( range( 0, len( valid_peals ) ), key = lambda idx: abs( idx - first_valid_peal_index ) )
+        thread = threading.Thread( target = self.load_remaining_sounds, args = ( load_order, sound_file_names ), name = "sound_loader", daemon = True )
+        thread.start()
+    
+    def load_remaining_sounds( self, load_order, sound_file_names ):
+        """ The background thread body, load the valid peals in the given order, then any other sounds
+        """
+        try:
+            for valid_peal_index in load_order:
+                self.load_valid_peal( valid_peal_index )
+            for name in sound_file_names:
+                self.load_sound( name )
+        except Exception:
+            self.logger.exception("Error loading bell sounds in the background")
+            return
+        self.logger.info("All bell sounds loaded")
+    
+    def load_valid_peal( self, valid_peal_index ):
+        """ Make sure the sounds for the valid peal are loaded and configured, loading them now if not
+        """
+        loaded = self.peals_loaded[ valid_peal_index ]
+        if loaded.is_set():
+            return
+        
+        peal = self.valid_peals[ valid_peal_index ]
+        for name in peal.file_names:
+            self.load_sound( name )
+        
+        with self.sound_lock:
+            peal.configure_sounds( self.all_bell_sounds )
+        loaded.set()
     
     def limit_valid_peal_index( self, valid_peal_index ):
         """ Take the new valid peal index and make sure it is limited to the range of possible valid peals
@@ -127,9 +265,13 @@ class bell_sound_player:
             self.logger.error("Invalid key (valid peal) index (%d) for number of valid peals (%d). Sounds unmodified", valid_peal_index, len( self.valid_peals ) );
             return
         
+        #Wait for the sounds if the background loading hasn't got to them yet
+        self.load_valid_peal( valid_peal_index )
+        
         self.logger.info("Setting key to %s with index %d", self.valid_peals[ valid_peal_index ].key, valid_peal_index )
         self.valid_peal_index = valid_peal_index
         self.current_bell_sounds = self.valid_peals[ valid_peal_index ].bell_sounds
+        self.configure_channels()
     
     def get_valid_peal_index( self ):
         """ Get the current valid peal index
@@ -141,10 +283,38 @@ class bell_sound_player:
             tenor - the tenor to use in the range 1 - 12
         """
         self.tenor = tenor
+        self.configure_channels()
         
         #Play the sound to indicate the selection
         self.play_bell( tenor )
     
+    def set_bell_gap( self, bell_gap_s ):
+        """ Set the expected time between successive bells (the tempo), resizing the channel pools to suit
+        """
+        self.bell_gap_s = bell_gap_s
+        self.configure_channels()
+    
+    def configure_channels( self ):
+        """ Size the mixer channel pools for the bells that can currently ring
+            Each bell gets enough voices for its longest sample to keep sounding at the current tempo
+        """
+        if self.tenor is None or self.current_bell_sounds is None:
+            return
+        
+        if self.software_mixer is not None:
+            #All the bells are mixed into one stream
+            return
+        
+        #The bells that ring are the tenor and those below it, down to the number of sounds in the peal
+        stage = min( self.tenor, len( self.current_bell_sounds ) )
+        bells = range( self.tenor - stage + 1, self.tenor + 1 )
+        lengths = [ sound.get_length() for sound in self.current_bell_sounds[ -stage: ] if sound is not None ]
+        if not lengths:
+            return
+        
+        voices_per_bell = channel_allocator.voices_needed( max( lengths ), stage, self.bell_gap_s )
+        self.dispatcher.configure_channels( bells, voices_per_bell )
+    
     def get_tenor( self ):
         """ Get the currently set tenor
         """
@@ -156,33 +326,80 @@ class bell_sound_player:
             Prevents any bell below the currently selected peal ringing
             Returns the converted bell index in the bell_sounds vector, returning None if the bell should not ring
         """
-        if bell > self.tenor:
-            #Then can't play this
-            return None
-        
         curr_num_bells = len( self.current_bell_sounds )
         
-        offset_from_tenor = self.tenor - bell #this should be >= 0 based on the check above
-        bell_sound_index = curr_num_bells - offset_from_tenor - 1
-
-        # prevent any bells below the current sound index from ringing
-        if bell_sound_index < 0:
+        bell_sound_index = map_bell_to_peal_index( bell, self.tenor, curr_num_bells )
+        if bell_sound_index is None:
             return None
         self.logger.debug("Mapping bell %d to index %d with %d bell sounds",bell,bell_sound_index,curr_num_bells )
         return bell_sound_index
     
-    def play_bell( self, bell ):
+    def set_latency_stats( self, latency ):
+        """ Set the latency_stats to record how long each stage of playing a bell takes
+        """
+        self.latency = latency
+        self.dispatcher.latency = latency
+        if self.software_mixer is not None:
+            self.software_mixer.latency = latency
+    
+    def start_dispatcher( self ):
+        """ Start the dispatcher thread, after which playing a bell returns straight away
+            For the numpy backend this starts the software mixer instead
+        """
+        if self.software_mixer is not None:
+            self.software_mixer.start()
+            return
+        self.dispatcher.start()
+    
+    def stop_dispatcher( self ):
+        """ Stop the dispatcher thread, sounds are then played on the calling thread again
+            For the numpy backend this stops the software mixer
+        """
+        if self.software_mixer is not None:
+            self.software_mixer.stop()
+            return
+        self.dispatcher.stop()
+    
+    def play_bell( self, bell, strike_time_ns = None ):
         """ Play the given bell index
             bell should be an integer as read from the input device (no mapping), in the range 1-12
+            strike_time_ns is the time.monotonic_ns() the bell was struck, if known, to record the total latency
+            Returns the index of the sound played in the current bell sounds, None if the bell doesn't ring
         """
-        #Map the bell to the current peal
-        bell_index = self.map_bell_to_selected_peal( bell )
+        if self.latency is not None and bell > 0:
+            #Map the bell to the current peal, timing how long it takes
+            start_ns = time.monotonic_ns()
+            bell_index = self.map_bell_to_selected_peal( bell )
+            self.latency.record( latency_stats.MAPPING, bell, time.monotonic_ns() - start_ns )
+        else:
+            #Map the bell to the current peal
+            bell_index = self.map_bell_to_selected_peal( bell )
         
         if bell_index is None:
-            return
+            return None
         self.logger.debug("Playing sound index %d",bell_index)
-        pygame.mixer.find_channel(True).play( self.current_bell_sounds[bell_index] )
-        sleep( self.post_sound_wait_s ) #a tiny wait to give the system time to sync up
+        self.play_sound( self.current_bell_sounds[bell_index], bell, strike_time_ns )
+        return bell_index
+    
+    def play_bell_at( self, bell, time_ns ):
+        """ Play the given bell at the time.monotonic_ns() time_ns
+            With the numpy backend the bell lands on the exact sample for that time, as long as it is scheduled
+            at least get_scheduling_lead_ns() ahead. With the pygame backend it is played straight away,
+            so should be called at the time it is wanted
+            Returns the index of the sound played in the current bell sounds, None if the bell doesn't ring
+        """
+        bell_index = self.map_bell_to_selected_peal( bell )
+        if bell_index is None:
+            return None
+        self.play_sound( self.current_bell_sounds[bell_index], bell, None, time_ns )
+        return bell_index
+    
+    def get_scheduling_lead_ns( self ):
+        """ Get how far ahead play_bell_at needs to be called, 0 if it plays straight away
+        """
+        if self.software_mixer is not None:
+            return self.software_mixer.lead_time_ns()
+        return 0
     
     def play_reference_bell( self, bell ):
         """ Play the given bell index as one of the 12, used to indicate an acceptance of a command
@@ -192,6 +409,21 @@ class bell_sound_player:
             return
         #Convert from a bell to an index
         bell_index = bell - 1
+        self.load_valid_peal( 0 )
         self.logger.debug("Playing reference sound index %d",bell_index)
-        pygame.mixer.find_channel(True).play( self.valid_peals[ 0 ].bell_sounds[ bell_index ] )
-        sleep( self.post_sound_wait_s ) #a tiny wait to give the system time to sync up
+        self.play_sound( self.valid_peals[ 0 ].bell_sounds[ bell_index ] )
+    
+    def play_sound( self, sound, bell = None, strike_time_ns = None, time_ns = None ):
+        """ Hand the sound to the dispatcher to be played
+            If the dispatcher thread isn't running, it is played here followed by the post sound wait
+            For the numpy backend it is scheduled on the software mixer for time_ns (None for as soon as possible)
+        """
+        if sound is None:
+            #Sound missing from the peal
+            return
+        if self.software_mixer is not None:
+            self.software_mixer.play_at( sound, time_ns, bell, strike_time_ns )
+            return
+        self.dispatcher.play( sound, bell, strike_time_ns )
+        if not self.dispatcher.running:
+            sleep( self.post_sound_wait_s ) #a tiny wait to give the system time to sync up
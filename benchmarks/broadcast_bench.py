@@ -0,0 +1,157 @@
+# Benchmark of the cost the strike broadcast adds to each strike, with subscribers on loopback
+#
+# Run from the repository root with: python3 benchmarks/broadcast_bench.py
+# The multicast datagrams stay on this machine (sent from 127.0.0.1), the WebSocket subscribers connect to 127.0.0.1
+
+import os
+import sys
+import time
+import base64
+import socket
+import struct
+import asyncio
+import argparse
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+from pibells.core.strike_broadcast import strike_broadcast, message_struct
+
+class websocket_subscriber:
+    """ Class to connect to the WebSocket server and count the strikes received
+    """
+    def __init__( self ):
+        self.received = 0
+        self.writer = None
+        self.task = None
+
+    async def connect( self, port ):
+        """ Connect and do the opening handshake, then count the strikes on a task
+        """
+        reader, self.writer = await asyncio.open_connection( "127.0.0.1", port )
+        key = base64.b64encode( os.urandom( 16 ) )
+        self.writer.write( b"GET / HTTP/1.1\r\nHost: 127.0.0.1\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            b"Sec-WebSocket-Key: " + key + b"\r\nSec-WebSocket-Version: 13\r\n\r\n" )
+        await reader.readuntil( b"\r\n\r\n" )
+        self.task = asyncio.get_running_loop().create_task( self.count( reader ) )
+
+    async def count( self, reader ):
+        """ Count the frames, each is the 2 byte header and a message
+        """
+        frame_size = 2 + message_struct.size
+        while True:
+            await reader.readexactly( frame_size )
+            self.received += 1
+
+    def close( self ):
+        self.task.cancel()
+        self.writer.close()
+
+def multicast_listener( group, port ):
+    """ Open a socket joined to the multicast group on loopback, to count the datagrams
+    """
+    sock = socket.socket( socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP )
+    sock.setsockopt( socket.SOL_SOCKET, socket.SO_REUSEADDR, 1 )
+    sock.bind( ( "", port ) )
+    sock.setsockopt( socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, struct.pack( "4s4s", socket.inet_aton( group ), socket.inet_aton( "127.0.0.1" ) ) )
+    sock.setblocking( False )
+    return sock
+
+class datagram_counter:
+    """ Class to count the datagrams arriving on a socket, read as they arrive by the loop
+    """
+    def __init__( self, sock ):
+        self.sock = sock
+        self.received = 0
+        asyncio.get_running_loop().add_reader( sock, self.read )
+
+    def read( self ):
+        while True:
+            try:
+                self.sock.recv( 64 )
+            except BlockingIOError:
+                return
+            self.received += 1
+
+    def take( self ):
+        """ Get the count so far and start again
+        """
+        received = self.received
+        self.received = 0
+        return received
+
+    def close( self ):
+        asyncio.get_running_loop().remove_reader( self.sock )
+        self.sock.close()
+
+async def publish_strikes( broadcast, strikes, stage ):
+    """ Publish the strikes a row at a time, letting the subscribers' tasks run between rows as the loop would
+        Returns the ns spent in publish per strike
+    """
+    publish_ns = 0
+    for idx in range( 0, strikes // stage ):
+        for place in range( 0, stage ):
+            start_ns = time.perf_counter_ns()
+            broadcast.publish( place + 1, time.monotonic_ns() )
+            publish_ns += time.perf_counter_ns() - start_ns
+        await asyncio.sleep( 0 )
+    #Let the subscribers catch up
+    await asyncio.sleep( 0.2 )
+    return publish_ns / ( ( strikes // stage ) * stage )
+
+async def run( args ):
+    loop = asyncio.get_running_loop()
+    broadcast = strike_broadcast( loop, subscriber_queue_size = args.strikes )
+
+    print( "%-40s %12s %10s" % ( "configuration", "us/strike", "received" ) )
+
+    cost_ns = await publish_strikes( broadcast, args.strikes, args.stage )
+    print( "%-40s %12.2f %10s" % ( "nothing started", cost_ns / 1000, "-" ) )
+
+    listener = None
+    try:
+        await broadcast.start_multicast( args.group, args.port, interface = "127.0.0.1" )
+        listener = datagram_counter( multicast_listener( args.group, args.port ) )
+    except OSError as e:
+        print( "Multicast not available here: " + str(e) )
+    if listener is not None:
+        cost_ns = await publish_strikes( broadcast, args.strikes, args.stage )
+        print( "%-40s %12.2f %10d" % ( "multicast", cost_ns / 1000, listener.take() ) )
+
+    port = await broadcast.start_websocket( "127.0.0.1", 0 )
+    subscribers = [ websocket_subscriber() for idx in range( 0, args.subscribers ) ]
+    for subscriber in subscribers:
+        await subscriber.connect( port )
+    #Wait for the server to register them all
+    while len( broadcast.subscribers ) < len( subscribers ):
+        await asyncio.sleep( 0.01 )
+
+    cost_ns = await publish_strikes( broadcast, args.strikes, args.stage )
+    received = min( subscriber.received for subscriber in subscribers )
+    name = "%d WebSocket subscribers%s" % ( len( subscribers ), " + multicast" if listener is not None else "" )
+    print( "%-40s %12.2f %10d" % ( name, cost_ns / 1000, received ) )
+    if listener is not None:
+        listener.close()
+
+    for subscriber in subscribers:
+        subscriber.close()
+    broadcast.close()
+    #Let the server's subscriber tasks finish
+    while broadcast.subscribers:
+        await asyncio.sleep( 0.01 )
+    return 0 if received == args.strikes // args.stage * args.stage else 1
+
+def main( argv ):
+    """ Run the benchmark from the command line
+        Returns 1 if a subscriber missed a strike
+    """
+    parser = argparse.ArgumentParser( description = "Measure the per strike cost of broadcasting strikes to subscribers" )
+    parser.add_argument( "--strikes", type = int, default = 12000, help = "the number of strikes to publish in each run" )
+    parser.add_argument( "--stage", type = int, default = 12, help = "the strikes published between letting the loop run" )
+    parser.add_argument( "--subscribers", type = int, default = 10, help = "the number of WebSocket subscribers" )
+    parser.add_argument( "--group", default = "239.255.42.1", help = "the multicast group" )
+    parser.add_argument( "--port", type = int, default = 5007, help = "the multicast port" )
+    args = parser.parse_args( argv )
+    return asyncio.run( run( args ) )
+
+if __name__ == '__main__':
+    sys.exit( main( sys.argv[1:] ) )
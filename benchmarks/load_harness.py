@@ -0,0 +1,134 @@
+# Load harness, running the real PiBells main loop against the photohead simulator at increasing strike rates
+#
+# Run from the repository root with: python3 benchmarks/load_harness.py
+# No tower, photohead box, keyboard or sound card is needed
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import importlib.util
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+from pibells.configuration import Configuration
+from pibells.core import latency_stats
+from pibells.photohead.simulator import photohead_simulator
+
+def load_pibells_main( repo_dir ):
+    """ Load pibells.py as a module, it can't be imported by name as the pibells package takes precedence
+    """
+    spec = importlib.util.spec_from_file_location( "pibells_main", os.path.join( repo_dir, "pibells.py" ) )
+    module = importlib.util.module_from_spec( spec )
+    spec.loader.exec_module( module )
+    return module
+
+def write_config( file_name, device_name ):
+    """ Write a config using the simulator's pty and the headless audio backend
+    """
+    config = Configuration( file_name )
+    config.device_name = device_name
+    config.audio_backend = "null"
+    config.WriteConfigFile()
+
+def run_step( pibells_main, simulator, changes_per_minute, duration_s ):
+    """ Ring at changes_per_minute for duration_s and measure how PiBells kept up
+        Returns a dict of the results
+    """
+    simulator.set_rate( changes_per_minute )
+    time.sleep( 0.5 )
+
+    #The stats are only touched on the event loop, so reset them there and start counting once it is done
+    reset_done = threading.Event()
+    def reset_stats():
+        pibells_main.latency.reset()
+        sent_before.append( simulator.strikes_sent )
+        reset_done.set()
+    sent_before = []
+    pibells_main.runtime.submit( reset_stats )
+    reset_done.wait()
+    sent_before = sent_before[0]
+
+    wall_before = time.monotonic()
+    cpu_before = time.process_time()
+
+    time.sleep( duration_s )
+
+    wall_s = time.monotonic() - wall_before
+    cpu_s = time.process_time() - cpu_before
+
+    #Count on the loop too, so only bells still in the pty when counting could be missed
+    counted = threading.Event()
+    def count_stats():
+        counts.append( simulator.strikes_sent )
+        counts.append( pibells_main.latency.stage_histogram( latency_stats.SERIAL_READ ).count )
+        counted.set()
+    counts = []
+    pibells_main.runtime.submit( count_stats )
+    counted.wait()
+    sent = counts[0] - sent_before
+    handled = counts[1]
+
+    latency = pibells_main.latency
+    dispatch = latency.stage_histogram( latency_stats.DISPATCH )
+    total = latency.stage_histogram( latency_stats.TOTAL )
+    return {
+        "changes_per_minute": changes_per_minute,
+        "strikes_per_second": sent / wall_s,
+        "sent": sent,
+        "handled": handled,
+        "lost": max( 0, sent - handled ),
+        "dispatch_p50_ms": dispatch.percentile( 50 ) / 1e6,
+        "dispatch_p99_ms": dispatch.percentile( 99 ) / 1e6,
+        "total_p99_ms": total.percentile( 99 ) / 1e6,
+        "cpu_percent": 100.0 * cpu_s / wall_s,
+    }
+
+def main( argv ):
+    """ Run the harness from the command line
+    """
+    parser = argparse.ArgumentParser( description = "Drive PiBells from a simulated photohead at increasing strike rates" )
+    parser.add_argument( "--stage", type = int, default = 12, help = "the number of bells ringing" )
+    parser.add_argument( "--rates", default = "30,60,120,240,480,960", help = "comma separated changes per minute to step through" )
+    parser.add_argument( "--duration", type = float, default = 10.0, help = "seconds at each rate" )
+    parser.add_argument( "--jitter", type = float, default = 5.0, help = "standard deviation of each strike in ms" )
+    args = parser.parse_args( argv )
+
+    repo_dir = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+    work_dir = tempfile.mkdtemp( prefix = "pibells_load_" )
+    config_file = os.path.join( work_dir, "pibells.ini" )
+    log_file = os.path.join( work_dir, "pibells.log" )
+
+    simulator = photohead_simulator( args.stage, 30, args.jitter )
+    write_config( config_file, simulator.device_name )
+    simulator.start()
+
+    pibells_main = load_pibells_main( repo_dir )
+    thread = threading.Thread( target = pibells_main.main, args = ( config_file, log_file, False ), name = "pibells_main", daemon = True )
+    thread.start()
+
+    #Wait for the main loop to be running
+    while pibells_main.runtime is None or not pibells_main.runtime.loop.is_running():
+        if not thread.is_alive():
+            print( "PiBells stopped while starting, see " + log_file )
+            return 1
+        time.sleep( 0.1 )
+
+    print( "%8s %10s %8s %8s %6s %12s %12s %10s %6s" % ( "rows/min", "strikes/s", "sent", "handled", "lost",
+        "dispatch p50", "dispatch p99", "total p99", "cpu%" ) )
+    for rate in [ int( rate ) for rate in args.rates.split( "," ) ]:
+        result = run_step( pibells_main, simulator, rate, args.duration )
+        print( "%8d %10.1f %8d %8d %6d %10.2fms %10.2fms %8.2fms %6.1f" % ( result["changes_per_minute"],
+            result["strikes_per_second"], result["sent"], result["handled"], result["lost"],
+            result["dispatch_p50_ms"], result["dispatch_p99_ms"], result["total_p99_ms"], result["cpu_percent"] ) )
+
+    pibells_main.runtime.stop()
+    thread.join( 5 )
+    simulator.stop()
+    print( "Log written to " + log_file )
+    return 0
+
+if __name__ == '__main__':
+    sys.exit( main( sys.argv[1:] ) )
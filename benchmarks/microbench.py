@@ -0,0 +1,242 @@
+# Microbenchmarks for the strike hot path and the place notation engine
+#
+# Run from the repository root with: python3 benchmarks/microbench.py
+# No tower, photohead box or sound card is needed. The results are written as JSON and compared to
+# benchmarks/baseline.json if it exists - create it on the Pi with --save-baseline so the comparison
+# is against the same hardware
+
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import tempfile
+import platform
+import importlib.util
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+from pibells.configuration import Configuration
+from pibells.core.compiled_method import compile_method
+from pibells.core.place_notation_processor import place_notation_processor
+from pibells.photohead.photohead_interface import photohead_interface
+from pibells.core import strike_journal
+from bell_sound_player import bell_sound
+
+repo_dir = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+default_baseline = os.path.join( repo_dir, "benchmarks", "baseline.json" )
+
+class fake_serial:
+    """ Class to stand in for the serial connection, endlessly returning rounds on 12
+    """
+    def __init__( self ):
+        self.data = b"1234567890ET"
+        self.index = 0
+
+    def inWaiting( self ):
+        return 1
+
+    def read( self, size = 1 ):
+        byte = self.data[ self.index:self.index+1 ]
+        self.index = ( self.index + 1 ) % len( self.data )
+        return byte
+
+    def write( self, data ):
+        return len( data )
+
+def load_pibells_main():
+    """ Load pibells.py as a module, it can't be imported by name as the pibells package takes precedence
+    """
+    spec = importlib.util.spec_from_file_location( "pibells_main", os.path.join( repo_dir, "pibells.py" ) )
+    module = importlib.util.module_from_spec( spec )
+    spec.loader.exec_module( module )
+    return module
+
+def measure( function, ops_per_call, min_time_s ):
+    """ Time function, which does ops_per_call operations, returning the best ns per operation
+        The calls are repeated in rounds of at least min_time_s and the fastest round is kept,
+        as the slower ones are interrupted by something else
+    """
+    #Warm up, and find how many calls make a round
+    calls = 1
+    while True:
+        start_ns = time.perf_counter_ns()
+        for idx in range( 0, calls ):
+            function()
+        elapsed_ns = time.perf_counter_ns() - start_ns
+        if elapsed_ns >= min_time_s * 1e9 / 5:
+            break
+        calls *= 2
+
+    best_ns = None
+    gc.disable()
+    try:
+        for repeat in range( 0, 5 ):
+            start_ns = time.perf_counter_ns()
+            for idx in range( 0, calls ):
+                function()
+            elapsed_ns = time.perf_counter_ns() - start_ns
+            if best_ns is None or elapsed_ns < best_ns:
+                best_ns = elapsed_ns
+    finally:
+        gc.enable()
+    return best_ns / ( calls * ops_per_call )
+
+def build_benchmarks( work_dir ):
+    """ Build the benchmarks as a list of ( name, function, operations per call )
+    """
+    benchmarks = list()
+
+    #Photohead decoding
+    photohead = photohead_interface( "/dev/null" )
+    photohead.con = fake_serial()
+    codes = b"1234567890ET" * 100
+    def ascii_to_bell():
+        convert = photohead.ascii_code_to_bell_number
+        for code in codes:
+            convert( code )
+    benchmarks.append( ( "photohead.ascii_code_to_bell_number", ascii_to_bell, len( codes ) ) )
+
+    def get_bell():
+        for idx in range( 0, 1000 ):
+            photohead.get_bell()
+    benchmarks.append( ( "photohead.get_bell", get_bell, 1000 ) )
+
+    def decode_bytes():
+        photohead.decode_bytes( codes, 0 )
+    benchmarks.append( ( "photohead.decode_bytes", decode_bytes, len( codes ) ) )
+
+    #Muting, using the globals of the main script
+    pibells_main = load_pibells_main()
+    pibells_main.muted_bells = [0]*12
+    pibells_main.muted_bells[ 3 ] = 1
+    def check_muting():
+        check = pibells_main.CheckBellForMuting
+        for bell in range( 1, 13 ):
+            check( bell )
+    benchmarks.append( ( "CheckBellForMuting", check_muting, 12 ) )
+
+    #Bell mapping and peal configuration, on the headless backend
+    player = pibells_main.bell_sound_player( "null" )
+    player.current_bell_sounds = [ object() ]*12
+    player.tenor = 8
+    def map_bells():
+        map_bell = player.map_bell_to_selected_peal
+        for bell in range( 1, 13 ):
+            map_bell( bell )
+    benchmarks.append( ( "bell_sound_player.map_bell_to_selected_peal", map_bells, 12 ) )
+
+    peals = pibells_main.define_valid_peals()
+    sounds = [ bell_sound( name, object() ) for name in pibells_main.all_bell_file_names ]
+    def configure_sounds():
+        for peal in peals:
+            peal.configure_sounds( sounds )
+    benchmarks.append( ( "valid_peal.configure_sounds", configure_sounds, len( peals ) ) )
+
+    #Journaling each bell, to a file in the work directory
+    journal = strike_journal.strike_journal( os.path.join( work_dir, "journal" ) )
+    journal.open()
+    def journal_add():
+        add = journal.add
+        for idx in range( 0, 1000 ):
+            add( strike_journal.PHOTOHEAD, 1, 0, False, idx + 1 )
+    benchmarks.append( ( "strike_journal.add", journal_add, 1000 ) )
+
+    #Place notation
+    yorkshire = "X30X14X50X16X1270X38X14X50X16X90-12"
+    def process_to_array():
+        place_notation_processor( yorkshire, False )
+    benchmarks.append( ( "place_notation_processor.process_to_array (cached)", process_to_array, 1 ) )
+
+    def compile_uncached():
+        compile_method.__wrapped__( yorkshire, False )
+    benchmarks.append( ( "compiled_method (uncached)", compile_uncached, 1 ) )
+
+    pnp = place_notation_processor( yorkshire, False )
+    def get_next_bell():
+        next_bell = pnp.get_next_bell
+        for idx in range( 0, 10000 ):
+            next_bell()
+    benchmarks.append( ( "place_notation_processor.get_next_bell", get_next_bell, 10000 ) )
+
+    def seek():
+        pnp.seek( 123457 )
+    benchmarks.append( ( "place_notation_processor.seek", seek, 1 ) )
+
+    #Loading the config, from a file written with the defaults
+    config_file = os.path.join( work_dir, "pibells.ini" )
+    Configuration( config_file ).WriteConfigFile()
+    def load_config():
+        config = Configuration( config_file )
+        config.ReadConfigFile()
+        config.LoadConfigFile()
+    benchmarks.append( ( "Configuration.LoadConfigFile", load_config, 1 ) )
+
+    return benchmarks
+
+def compare( results, baseline, threshold_percent ):
+    """ Print each result against the baseline, returning the names that are slower by more than threshold_percent
+    """
+    regressions = list()
+    print( "%-55s %12s %12s %8s" % ( "benchmark", "ns/op", "baseline", "change" ) )
+    for name, result in results.items():
+        base = baseline.get( name )
+        if base is None:
+            print( "%-55s %12.1f %12s %8s" % ( name, result["ns_per_op"], "-", "" ) )
+            continue
+        change = 100.0 * ( result["ns_per_op"] / base["ns_per_op"] - 1 )
+        flag = ""
+        if change > threshold_percent:
+            flag = " REGRESSION"
+            regressions.append( name )
+        print( "%-55s %12.1f %12.1f %+7.1f%%%s" % ( name, result["ns_per_op"], base["ns_per_op"], change, flag ) )
+    return regressions
+
+def main( argv ):
+    """ Run the benchmarks from the command line
+        Returns 1 if any benchmark regressed against the baseline
+    """
+    parser = argparse.ArgumentParser( description = "Microbenchmarks for the strike hot path and place notation engine" )
+    parser.add_argument( "--output", default = "microbench_results.json", help = "the JSON file to write the results to" )
+    parser.add_argument( "--baseline", default = default_baseline, help = "the JSON results to compare against" )
+    parser.add_argument( "--save-baseline", action = "store_true", help = "also save the results as the baseline" )
+    parser.add_argument( "--threshold", type = float, default = 25.0, help = "percent slower than the baseline counted as a regression" )
+    parser.add_argument( "--min-time", type = float, default = 0.2, help = "seconds per timing round" )
+    parser.add_argument( "--filter", default = None, help = "only run benchmarks containing this text" )
+    args = parser.parse_args( argv )
+
+    work_dir = tempfile.mkdtemp( prefix = "pibells_bench_" )
+    results = dict()
+    for name, function, ops in build_benchmarks( work_dir ):
+        if args.filter is not None and args.filter not in name:
+            continue
+        results[ name ] = { "ns_per_op": measure( function, ops, args.min_time ) }
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "node": platform.node(),
+        "results": results,
+    }
+    with open( args.output, "w" ) as output:
+        json.dump( report, output, indent = 2, sort_keys = True )
+
+    baseline = dict()
+    if os.path.exists( args.baseline ):
+        with open( args.baseline ) as baseline_file:
+            baseline = json.load( baseline_file )["results"]
+    regressions = compare( results, baseline, args.threshold )
+
+    if args.save_baseline:
+        with open( args.baseline, "w" ) as baseline_file:
+            json.dump( report, baseline_file, indent = 2, sort_keys = True )
+        print( "Saved the baseline to " + args.baseline )
+
+    if regressions:
+        print( "%d benchmarks are more than %.0f%% slower than the baseline" % ( len( regressions ), args.threshold ) )
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit( main( sys.argv[1:] ) )
@@ -1,16 +1,20 @@
-from time import sleep
-
 #Logging and file name establishment
 import inspect
+import sys
+import argparse
 import os
+import time
 import logging
 import logging.handlers
 
 #Shutting down
 import datetime
 
-#Keyboard interaction
-import keyboard
+#Keyboard interaction, not available when running headless (e.g. the load harness)
+try:
+    import keyboard
+except ImportError:
+    keyboard = None
 
 # Photohead interface
 from pibells.configuration import Configuration
@@ -18,14 +22,46 @@ from pibells.photohead.photohead_interface import photohead_interface
 
 # Bell sounds
 from bell_sound_player import bell_sound_player, valid_peal
+from pibells.audio.peals import all_bell_file_names, valid_peal_definitions
 
 # Demo playing
 from pibells_demo import pibells_demo
 
+# Event loop
+from pibells.core.runtime import pibells_runtime
+
+# Keyboard dispatch, and the worker for slow commands
+from pibells.core.keyboard_commands import keyboard_commands
+from pibells.core.command_worker import command_worker
+
+# Latency measurement
+from pibells.core import latency_stats
+
+#Logging is written to the file on a background thread
+from pibells.core.log_queue import log_writer
+
+#Every bell is journaled to disk, for analysis and replay
+from pibells.core import strike_journal
+
+#Strikes are published to other machines
+from pibells.core.strike_broadcast import strike_broadcast
+
+#The status and metrics are served over HTTP
+from pibells.core import status_http
+
+# Striking analysis
+from pibells.core.striking_analysis import striking_analysis
+
+# Photohead delay calibration
+from pibells.photohead.calibration import delay_calibration
+
 __config = None
 
 logger = logging.getLogger("PiBells") 
 
+#Setup the background writer for the log file
+logging_writer = None
+
 #Define the globals so the keyboard hooks can use them
 all_bell_sounds =[] #All the loaded bell sounds
 bell_sounds = [] #The currently selected bell sounds
@@ -35,45 +71,53 @@ muted_bells = [] #toggle to 1 to mute
 #Timers
 power_down_time_s = 3
 restart_time_s = 3
-
-keep_looping_flag = 1
+#Extra time allowed before checking a timeout has expired, so the check isn't made a fraction too early
+timeout_check_margin_s = 0.1
 
 photohead_response_time_s = 5
 awaiting_photohead_delays = False
 awaiting_photohead_time = 0
 
-#Setup the global reference to the photohead class object
+#Setup the global reference to the photohead class object, and all the photoheads when there is more than one
 photohead = None
+photoheads = []
 
 #Setup the bell sounds player class object
 bell_sounds = None
 
 pb_demo = None
 
+#Setup the event loop that runs everything
+runtime = None
+
+#Setup the worker that runs commands writing to the SD card or photohead
+worker = None
+
+#Setup the strike to sound latency measurement, and how often to log it
+latency = None
+latency_log_interval_s = 600
+
+#How often to check the config file for edits, which are applied without restarting
+config_check_interval_s = 2
+
+#Setup the analysis of the striking against a method
+striking = None
 
+#Setup the calibration of the photohead delays from rounds
+calibration = None
+
+#Setup the journal of every bell, None if not journaling
+journal = None
+
+#Setup the replay of a journal in place of the photohead, None if not replaying
+replay = None
+
+#Setup the publishing of strikes to the network, None if not configured
+broadcast = None
+
+#Setup the status and metrics server, None if not configured
+status_server = None
 
-all_bell_file_names = [
-    "twx0",
-    "twx1",
-    "twx1b",
-    "twx1s",
-    "twx2",
-    "twx3",
-    "twx3b",
-    "twx4",
-    "twx4b",
-    "twx5",
-    "twx6",
-    "twx6b",
-    "twx7",
-    "twx7b",
-    "twx8",
-    "twx8b",
-    "twx9",
-    "twx10",
-    "twx11",
-    "twx12",
-    ]
 
 class timed_command:
     """ Class to manage the flags for a "timed" (quick press) command
@@ -98,7 +142,7 @@ class timed_command:
         
         #If here, then the timer was active
         diff = ( self.timer + datetime.timedelta(seconds = self.timeout_s) ) - datetime.datetime.now()
-        logger.debug("The " + self.name + " time difference between the threshold and now is " + str( diff ) )
+        logger.debug("The %s time difference between the threshold and now is %s", self.name, diff )
         
         if ( self.timer + datetime.timedelta(seconds = self.timeout_s) ) > datetime.datetime.now():
             #Then activated twice within the timeout
@@ -134,17 +178,8 @@ def define_valid_peals( ):
         Returns an array of valid_peal classes, ready to be configured
     """
     valid_peals = list()
-    valid_peals.append( valid_peal( "D",  ["twx1",  "twx2",  "twx3",  "twx4",  "twx5",  "twx6",  "twx7",  "twx8",  "twx9",  "twx10", "twx11", "twx12", ] ) )
-    valid_peals.append( valid_peal( "E",  ["twx0",  "twx1",  "twx1b", "twx3",  "twx4",  "twx4b", "twx6",  "twx7",  "twx8",  "twx8b", "twx10", "twx11", ] ) )
-    valid_peals.append( valid_peal( "F#", ["twx1s", "twx1b", "twx3",  "twx3b", "twx4b", "twx6",  "twx7",  "twx7b", "twx8b", "twx10", ] ) )
-    valid_peals.append( valid_peal( "G",  ["twx1",  "twx2",  "twx3",  "twx4",  "twx5",  "twx6b", "twx7",  "twx8",  "twx9", ] ) )
-    valid_peals.append( valid_peal( "G#", ["twx1b", "twx2",  "twx3b", "twx4b", "twx6",  "twx6b", "twx7b", "twx8b", ] ) )
-    valid_peals.append( valid_peal( "A",  ["twx1",  "twx1b", "twx3",  "twx4",  "twx5",  "twx6",  "twx7",  "twx8",  ] ) )
-    valid_peals.append( valid_peal( "A#", ["twx1s", "twx1",  "twx2",  "twx3b", "twx4b", "twx5",  "twx6b", "twx7b", ] ) )
-    valid_peals.append( valid_peal( "B",  ["twx0",  "twx1s", "twx1b", "twx3",  "twx4",  "twx4b", "twx6",  "twx7",  ] ) )
-    valid_peals.append( valid_peal( "C",  ["twx1",  "twx2",  "twx3b", "twx4",  "twx5",  "twx6b", ] ) )
-    valid_peals.append( valid_peal( "C#", ["twx1s", "twx1b", "twx3",  "twx3b", "twx4b", "twx6",  ] ) )
-    valid_peals.append( valid_peal( "D",  ["twx0",  "twx1",  "twx2",  "twx3",  "twx4",  "twx5",  ] ) )
+    for key_str, file_names in valid_peal_definitions:
+        valid_peals.append( valid_peal( key_str, file_names ) )
     return valid_peals
 
 def CheckBellForMuting( bell ):
@@ -165,56 +200,6 @@ def ResetMutedBells():
     global muted_bells, __config
     muted_bells = [0]*__config.num_bells
 
-def GetKeyboardBellNumber():
-    """ Get the number of the bell that is being pressed by the keyboard
-        This uses the keyboard.is_pressed function as the scan codes for the numbers are
-        different for top row and num-pad
-        If no matching input is found, returns 0 or number in 1-12
-        This is expected when using the multi-key combinations
-    """
-    if keyboard.is_pressed("1"):
-        bell = 1
-    elif keyboard.is_pressed("2"):
-        bell = 2
-    elif keyboard.is_pressed("3"):
-        bell = 3
-    elif keyboard.is_pressed("4"):
-        bell = 4
-    elif keyboard.is_pressed("5"):
-        bell = 5
-    elif keyboard.is_pressed("6"):
-        bell = 6
-    elif keyboard.is_pressed("7"):
-        bell = 7
-    elif keyboard.is_pressed("8"):
-        bell = 8
-    elif keyboard.is_pressed("9"):
-        bell = 9
-    elif keyboard.is_pressed("0"):
-        bell = 10
-    elif keyboard.is_pressed("e") or keyboard.is_pressed("−"):
-        bell = 11
-    elif keyboard.is_pressed("t") or keyboard.is_pressed("="):
-        bell = 12
-    else:
-        bell = 0
-    return bell
-
-def GetKeyboardUpDown():
-    """ Get the up/down key that is being pressed
-        This uses the keyboard.is_pressed function as the scan codes for the numbers are
-        different for top row and num-pad
-        Returns +1 if the up arrow is pressed
-        Returns -1 if the down arrow is pressed
-        Returns 0 if neither arrow pressed
-    """
-    if keyboard.is_pressed("up arrow"):
-        return +1
-    elif keyboard.is_pressed("down arrow"):
-        return -1
-    else:
-        return 0
-
 def ApplyLoggingLevel( play_confirmation ):
     """ Set the logging level, with optional confirmation sound
     """
@@ -230,50 +215,32 @@ def ApplyLoggingLevel( play_confirmation ):
         logger.setLevel(logging.INFO)
         logger.info("Logging level set to INFO")
 
-def HandleMuting():
+def HandleMuting( bell ):
     """ Handle the case of muting a bell
-        Will attempt to get the bell number and set the flag
-        Will often fire once when the mute key is pressed, then again when the number is pressed
+        bell is the bell number (1-12) pressed with the mute key
     """
     global muted_bells
     
-    bell = GetKeyboardBellNumber()
-    
-    if not bell:
-        return
-    
     #Set the flag
     muted_bells[bell-1] = 1
     logger.info("Setting bell %d to muted", bell)
 
-def HandleUnMuting():
+def HandleUnMuting( bell ):
     """ Handle the case of un-muting a bell
-        Will attempt to get the bell number and set the flag
-        Will often fire once when the un-mute key is pressed, then again when the number is pressed
+        bell is the bell number (1-12) pressed with the un-mute key
     """
     global muted_bells
     
-    bell = GetKeyboardBellNumber()
-    
-    if not bell:
-        return
-    
     #Set the flag
     muted_bells[bell-1] = 0
     logger.info("Setting bell %d to un-muted", bell)
 
-def HandleTenor():
+def HandleTenor( bell ):
     """ Handle the case of setting the tenor bell
-        Will attempt to get the bell number and set the flag
-        Will often fire once when the tenor key is pressed, then again when the number is pressed
+        bell is the bell number (1-12) pressed with the tenor key
     """
     global bell_sounds, __config
     
-    bell = GetKeyboardBellNumber()
-    
-    if not bell:
-        return
-    
     #Set the flag
     logger.info("Setting tenor bell to %d", bell)
     bell_sounds.select_tenor( bell )
@@ -281,20 +248,14 @@ def HandleTenor():
     #Play the sound to confirm the setting
     bell_sounds.play_bell( bell )
     
-    __config.WriteConfigFile()
+    __config.RequestWrite()
 
-def HandleKey():
+def HandleKey( key_direction ):
     """ Handle the case of setting the key of the tenor bell
-        Will attempt to get the key character and set the value accordingly
-        Will often fire once when the "key" key is pressed, then again when the note is pressed
+        key_direction is +1 for the up arrow and -1 for the down arrow pressed with the "key" key
     """
     global bell_sounds, __config
     
-    key_direction = GetKeyboardUpDown()
-    if key_direction == 0:
-        #nothing to do
-        return
-    
     new_key_index = bell_sounds.get_valid_peal_index() + key_direction
     
     #Now clamp the key index between the ranges we have and set the new key index
@@ -304,7 +265,7 @@ def HandleKey():
     #Play the tenor bell sound
     bell_sounds.play_bell( bell_sounds.get_tenor() )
     
-    __config.WriteConfigFile()
+    __config.RequestWrite()
 
 def HandleReset():
     """ Will handle when the reset key has been pressed
@@ -327,7 +288,7 @@ def HandleLogging():
     __config.logging_debug = not __config.logging_debug
     
     ApplyLoggingLevel( True )
-    __config.WriteConfigFile()
+    __config.RequestWrite()
 
 def HandlePlay():
     """ Handle the toggling of the play mode
@@ -336,31 +297,46 @@ def HandlePlay():
     __config.play_mode = not __config.play_mode
     
     logger.info("Setting play mode to %s", __config.play_mode)
-    __config.WriteConfigFile()
+    __config.RequestWrite()
 
-def HandleDelayChange( faster_flag ):
+def FindPhotohead( bell ):
+    """ Find the photohead for the bell rung (1-12)
+        Returns ( photohead, the bell number the photohead sends, its default delays ), or ( None, None, None )
+        if no photohead has the bell
+    """
+    global photoheads, __config
+    #The first photohead sends every bell as itself, so the others (which say which bells they ring) are checked first
+    for idx_photohead in list( range( 1, len( photoheads ) ) ) + [ 0 ]:
+        photohead_for_bell = photoheads[ idx_photohead ]
+        photohead_bell = photohead_for_bell.get_photohead_bell( bell )
+        if photohead_bell is not None:
+            if idx_photohead == 0:
+                default_delays = __config.default_delays
+            else:
+                default_delays = __config.extra_photoheads[ idx_photohead - 1 ].default_delays
+            return ( photohead_for_bell, photohead_bell, default_delays )
+    logger.info("No photohead rings bell %d", bell)
+    return ( None, None, None )
+
+def HandleDelayChange( faster_flag, bell ):
     """ Handle the case of reducing or increasing the programmed delay for a given bell
-        Will attempt to get the bell number and change the delay
-        Will often fire once when the "faster"/"slower" key is pressed, then again when the number is pressed
         Input is    True if the bell should sounder faster, 
                     False if the bell should sounder slower
+                    and the bell number (1-12) pressed with the "faster"/"slower" key
     """    
-    bell = GetKeyboardBellNumber()
-    
-    if not bell:
+    photohead_for_bell, photohead_bell, default_delays = FindPhotohead( bell )
+    if photohead_for_bell is None:
         return
-    
-    global photohead
-    photohead.read_delays_from_photohead()
+    photohead_for_bell.read_delays_from_photohead()
     
     #Update the current delay
     if faster_flag:
-        photohead.decrease_delay( bell )
+        photohead_for_bell.decrease_delay( photohead_bell )
     else:
-        photohead.increase_delay( bell )
+        photohead_for_bell.increase_delay( photohead_bell )
     
     #Write the settings back to the device
-    photohead.write_delays_to_photohead()
+    photohead_for_bell.write_delays_to_photohead()
     
     #Write the current settings to the config?
     
@@ -368,27 +344,88 @@ def HandleDelayChange( faster_flag ):
     global bell_sounds
     bell_sounds.play_reference_bell( bell )
 
-def HandleDefaultDelay():
+def HandleDefaultDelay( bell ):
     """ Handle setting the given bell to the default value
-        Will attempt to get the bell number and change the delay
-        Will often fire once when the keys are pressed and then again when the number is pressed
+        bell is the bell number (1-12) pressed with the default delay key
     """
-    bell = GetKeyboardBellNumber()
-    
-    if not bell:
+    photohead_for_bell, photohead_bell, default_delays = FindPhotohead( bell )
+    if photohead_for_bell is None:
         return
-    
-    global photohead
-    photohead.read_delays_from_photohead()
-    photohead.set_delay( bell, __config.default_delays[bell-1] )
+    photohead_for_bell.read_delays_from_photohead()
+    photohead_for_bell.set_delay( photohead_bell, default_delays[photohead_bell-1] )
     
     #Write the settings back to the device
-    photohead.write_delays_to_photohead()
+    photohead_for_bell.write_delays_to_photohead()
     
     #Play the sound to confirm the change
     global bell_sounds
     bell_sounds.play_reference_bell( bell )
 
+def HandleCalibration():
+    """ Handle the calibration of the photohead delays
+        The first press starts collecting rounds on the bells up to the tenor
+        The next press, once enough rows have been rung, writes the corrected delays to every photohead
+        Run on the event loop, as the strikes are added to the calibration there
+    """
+    global photoheads, calibration, bell_sounds
+    
+    if not calibration.active:
+        #Load the delays now so they are ready to be corrected
+        for photohead_to_read in photoheads:
+            photohead_to_read.read_delays_from_photohead()
+        calibration.start( bell_sounds.get_tenor() )
+        bell_sounds.play_reference_bell( 1 )
+        return
+    
+    if calibration.apply( photoheads ):
+        bell_sounds.play_reference_bell( bell_sounds.get_tenor() )
+
+def HandleSaveDelays():
+    """ Save the delays currently on each photohead as its default delays in the config
+    """
+    global photoheads, __config, bell_sounds
+    
+    not_loaded = [ photohead_to_save for photohead_to_save in photoheads if not photohead_to_save.delays_loaded ]
+    if not_loaded:
+        for photohead_to_read in not_loaded:
+            logger.info("Unable to save the photohead delays, they have not been loaded yet from %s", photohead_to_read.device_name)
+            photohead_to_read.read_delays_from_photohead()
+        return
+    
+    __config.default_delays = list( photoheads[0].get_delays() )
+    for idx_photohead, photohead_config in enumerate( __config.extra_photoheads[ :len( photoheads ) - 1 ] ):
+        photohead_config.default_delays = list( photoheads[ idx_photohead + 1 ].get_delays() )
+    logger.info("Saving the photohead delays as the default delays")
+    __config.RequestWrite()
+    bell_sounds.play_reference_bell( 1 )
+
+def HandleStrike( bell, strike_time_ns, photohead_read = None ):
+    """ Handle a bell read from the photohead, playing it unless it is muted
+        strike_time_ns is the time.monotonic_ns() the bell arrived from the photohead
+        photohead_read is the photohead it was read from, None when replaying
+    """
+    global bell_sounds, latency, striking, calibration, journal, broadcast
+    
+    start_ns = time.monotonic_ns()
+    latency.record( latency_stats.SERIAL_READ, bell, start_ns - strike_time_ns )
+    if photohead_read is not None and photohead_read.latency is not None:
+        photohead_read.latency.record( latency_stats.SERIAL_READ, bell, start_ns - strike_time_ns )
+    
+    muted_bell = CheckBellForMuting( bell )
+    latency.record( latency_stats.MUTING, bell, time.monotonic_ns() - start_ns )
+    sample_index = None
+    if muted_bell:
+        sample_index = bell_sounds.play_bell( bell, strike_time_ns )
+    
+    #Journaled and analysed after the sound has been handed over, so they add nothing to the latency
+    #Muted bells are still being rung, so are included
+    if journal is not None:
+        journal.add( strike_journal.PHOTOHEAD, bell, sample_index, not muted_bell, strike_time_ns )
+    if broadcast is not None:
+        broadcast.publish( bell, strike_time_ns )
+    striking.add_strike( bell, strike_time_ns )
+    calibration.add_strike( bell, strike_time_ns )
+
 def HandleQuit( quit_pressed ):
     """ Test if first or second press and if the timer has expired
         If quit has been pressed, then input is true, otherwise
@@ -401,10 +438,14 @@ def HandleQuit( quit_pressed ):
         if shutdown_timeout.activate( ):
             #Then do the shutdown
             logger.info("Power down request completed - shutting down");
+            #Write any pending config changes before the Pi goes down
+            __config.Flush()
             os.system("/home/pi/pibells/shutdown_script.sh &")
             #Actually close the program
-            global keep_looping_flag
-            keep_looping_flag = 0
+            runtime.stop()
+        elif shutdown_timeout.active():
+            #First press, check back once the timeout has passed
+            runtime.call_later( shutdown_timeout.timeout_s + timeout_check_margin_s, HandleQuit, False )
     else:
         #Quit not pressed, just update the state of the timer
         shutdown_timeout.check()
@@ -421,31 +462,244 @@ def HandleRestartPiBells( restart_pressed ):
         if restart_timeout.activate( ):
             #Then do the restart
             logger.info("Restart request completed - restarting application");
+            #Write any pending config changes before restarting
+            __config.Flush()
             os.system("/home/pi/pibells/restart_script.sh &")
             #Actually close the program
-            global keep_looping_flag
-            keep_looping_flag = 0
+            runtime.stop()
+        elif restart_timeout.active():
+            #First press, check back once the timeout has passed
+            runtime.call_later( restart_timeout.timeout_s + timeout_check_margin_s, HandleRestartPiBells, False )
     else:
         #Quit not pressed, just update the state of the timer
         restart_timeout.check()
     
-def HandleDemo():
+def HandleLatencyStats():
+    """ Log the strike to sound latency statistics collected so far
+    """
+    global latency, bell_sounds, pb_demo
+    logger.info("Latency statistics requested")
+    latency.log_details()
+    LogPhotoheadLatencyStats()
+    if broadcast is not None:
+        broadcast.log_summary()
+    bell_sounds.dispatcher.allocator.log_steals()
+    runtime.log_stalls()
+    pb_demo.log_timing()
+
+def LogLatencyStats():
+    """ Periodically log a summary of the strike to sound latency statistics
+    """
+    global latency, runtime
+    latency.log_summary()
+    LogPhotoheadLatencyStats()
+    runtime.log_stalls()
+    runtime.call_later( latency_log_interval_s, LogLatencyStats )
+
+def LogPhotoheadLatencyStats():
+    """ Log the serial read latency of each photohead, when there is more than one
+    """
+    global photoheads
+    if len( photoheads ) > 1:
+        for photohead_to_log in photoheads:
+            photohead_to_log.latency.log_summary()
+
+def CheckConfigFile():
+    """ Periodically check the config file for edits, the check and any reload are done on the worker
+    """
+    global worker, runtime
+    worker.submit( ReloadConfigIfChanged )
+    runtime.call_later( config_check_interval_s, CheckConfigFile )
+
+def ReloadConfigIfChanged():
+    """ Reload the config file if it has been edited, and apply the changed settings
+        Run on the worker, as it reads the file and checks any changed demos
+        The demos, default delays and play mode are used from the config as they are needed, so only need reloading
+    """
+    global __config, bell_sounds, runtime
+    if not __config.CheckForChanges():
+        return
+    
+    changed = __config.ReloadConfigFile()
+    
+    if "logging_debug" in changed:
+        ApplyLoggingLevel( False )
+    if "key_index" in changed:
+        bell_sounds.select_valid_peal( __config.key_index )
+    if "tenor" in changed:
+        bell_sounds.select_tenor( __config.tenor )
+    if ( "device_name" in changed or "extra_photoheads" in changed ) and replay is None:
+        runtime.submit( ReconnectPhotoheads )
+    if "broadcast_multicast" in changed or "broadcast_websocket" in changed:
+        logger.info("The strike broadcast will change when PiBells is restarted")
+    if "status_http" in changed:
+        logger.info("The status server will change when PiBells is restarted")
+    if "strike_journal" in changed:
+        logger.info("The strike journal will be turned %s when PiBells is restarted", "on" if __config.strike_journal else "off")
+    if "audio_backend" in changed:
+        logger.info("The audio backend will change to %s when PiBells is restarted", __config.audio_backend)
+
+def ConnectPhotoheads():
+    """ Connect to the photohead on the configured device, and any more photoheads in the config,
+        and read them all on the runtime. Not connected when replaying
+    """
+    global photohead, photoheads, runtime, __config
+    
+    photohead = photohead_interface(__config.device_name)
+    photoheads = [ photohead ]
+    for photohead_config in __config.extra_photoheads:
+        photoheads.append( photohead_interface( photohead_config.device_name, photohead_config.bell_map ) )
+    
+    for photohead_to_connect in photoheads:
+        photohead_to_connect.latency = latency_stats.latency_stats( __config.num_bells, photohead_to_connect.device_name )
+        if replay is None:
+            #Could check for success, but doesn't really matter
+            photohead_to_connect.connect()
+            runtime.attach_photohead( photohead_to_connect, HandleStrike )
+
+def ReconnectPhotoheads():
+    """ Connect to the photoheads again, after their devices have changed in the config
+    """
+    global photoheads, runtime
+    logger.info("Changing the photohead devices from %s", ", ".join( photohead_to_close.device_name for photohead_to_close in photoheads ) )
+    
+    runtime.detach_photoheads()
+    for photohead_to_close in photoheads:
+        photohead_to_close.disconnect()
+    
+    ConnectPhotoheads()
+
+def StartBroadcast():
+    """ Start publishing strikes to the multicast group and WebSocket server in the config, if any
+        Called before the loop is running, so runs the loop until they have started
+    """
+    global broadcast, runtime, __config
+    if not __config.broadcast_multicast and not __config.broadcast_websocket:
+        return
+    
+    broadcast = strike_broadcast( runtime.loop )
+    try:
+        if __config.broadcast_multicast:
+            group, separator, port = __config.broadcast_multicast.rpartition(":")
+            runtime.loop.run_until_complete( broadcast.start_multicast( group, int( port ) ) )
+        if __config.broadcast_websocket:
+            host, separator, port = __config.broadcast_websocket.rpartition(":")
+            runtime.loop.run_until_complete( broadcast.start_websocket( host, int( port ) ) )
+    except OSError as e:
+        logger.error("Unable to start broadcasting strikes: " + str(e) )
+        broadcast.close()
+        broadcast = None
+        return
+    runtime.add_stop_callback( broadcast.close )
+
+def StartStatusServer():
+    """ Start serving the status and metrics over HTTP on the address in the config, if any
+    """
+    global status_server, runtime, __config
+    if not __config.status_http:
+        return
+    
+    status_server = status_http.status_http( BuildStatus, BuildMetrics )
+    host, separator, port = __config.status_http.rpartition(":")
+    try:
+        status_server.start( host, int( port ) )
+    except OSError as e:
+        logger.error("Unable to start the status server: " + str(e) )
+        status_server = None
+        return
+    runtime.add_stop_callback( status_server.stop )
+
+def BuildStatus():
+    """ Get the status served as JSON, called on the status server's refresh thread
+        Only copies simple values, so needs no locking
+    """
+    global bell_sounds, muted_bells, photoheads, __config
+    key_index = bell_sounds.valid_peal_index
+    return {
+        "key_index": key_index,
+        "key": bell_sounds.valid_peals[ key_index ].key if key_index is not None else None,
+        "tenor": bell_sounds.tenor,
+        "muted_bells": [ idx + 1 for idx, muted in enumerate( muted_bells ) if muted ],
+        "play_mode": __config.play_mode,
+        "replaying": replay is not None,
+        "photoheads": [ {
+            "device_name": photohead_status.device_name,
+            "connected": photohead_status.fileno() is not None,
+            "bell_map": photohead_status.bell_map,
+            "delays": list( photohead_status.current_delays ) if photohead_status.delays_loaded else None,
+            } for photohead_status in photoheads ],
+        }
+
+def BuildMetrics():
+    """ Get the lines of the Prometheus metrics, called on the status server's refresh thread
+        Everything is a running total kept by the thread that updates it (e.g. the stage histograms of the
+        latency stats), which is only read or copied here, so nothing is merged or walked
+    """
+    global latency, photoheads, bell_sounds, runtime, __config, logging_writer
+    strikes = latency.histograms[ latency_stats.SERIAL_READ ]
+    steals = dict( bell_sounds.dispatcher.allocator.steals )
+    lines = []
+    lines += status_http.counter_lines( "pibells_strikes_total", "Bells struck, read from the photoheads or replayed",
+        [ ( { "bell": idx + 1 }, strikes[ idx ].count ) for idx in range( 0, len( strikes ) ) ] )
+    lines += status_http.counter_lines( "pibells_photohead_dropped_bytes_total", "Bytes read from a photohead that were not a bell",
+        [ ( { "device": photohead_metrics.device_name }, photohead_metrics.unexpected_bytes ) for photohead_metrics in photoheads ] )
+    lines += status_http.counter_lines( "pibells_channel_steals_total", "Mixer channel voices stolen to play a bell",
+        [ ( { "bell": "spare" if bell is None else bell }, count ) for bell, count in sorted( steals.items(), key = lambda item: item[0] or 0 ) ] )
+    lines += status_http.counter_lines( "pibells_config_writes_total", "Times the config file has been written", [ ( None, __config.writes ) ] )
+    lines += status_http.counter_lines( "pibells_log_records_dropped_total", "Log records dropped because the logging queue was full",
+        [ ( None, logging_writer.dropped() if logging_writer is not None else 0 ) ] )
+    lines += status_http.histogram_lines( "pibells_loop_stall_seconds", "How late the event loop ran a check due every 0.1s", runtime.stalls )
+    lines += status_http.histogram_lines( "pibells_strike_latency_seconds", "Time from a bell arriving to its sound being played",
+        latency.stage_histogram( latency_stats.TOTAL ) )
+    return lines
+
+def HandleDemo( bell ):
     """ Handle the playing of a demo
+        bell is the bell number (1-12) pressed with the demo key, selecting the demo to play
     """
     global pb_demo
     global bell_sounds
     
-    bell = GetKeyboardBellNumber()
-    if not bell:
-        return
-    pb_demo.stop() #just in case it was already running
     bell_index = bell-1
-    pb_demo = pibells_demo( bell_sounds, 0.2, __config.place_notation_array[bell_index] )
+    #Restarts from rounds if it was already running
+    pb_demo.start( __config.place_notation_array[bell_index] )
     
-    pb_demo.start()
+def HandleStrikingAnalysis( bell ):
+    """ Start analysing the striking against the selected demo method, the band ringing from rounds
+        Pressing a + bell again for the same method stops the analysis and logs the summary
+    """
+    global striking, __config
     
-def KeyboardCallback( event ):
-    """ Callback for all keyboard presses
+    selected = __config.place_notation_array[bell-1]
+    if striking.active and striking.name == selected.string:
+        striking.stop()
+        return
+    
+    striking.stop() #summarise any touch already being analysed
+    striking.start( selected, bell_sounds.bell_gap_s )
+    bell_sounds.play_reference_bell( bell )
+    
+def HandleBellKey( bell ):
+    """ Handle a bell key pressed on its own, called straight from the keyboard hook
+        Plays the bell based on the selected tenor and key, and stops any demo
+    """
+    global bell_sounds, pb_demo, journal
+    strike_time_ns = time.monotonic_ns()
+    sample_index = None
+    if __config.play_mode:
+        sample_index = bell_sounds.play_bell( bell )
+    if journal is not None:
+        journal.add( strike_journal.KEYBOARD, bell, sample_index, not __config.play_mode, strike_time_ns )
+    pb_demo.stop()
+
+def HandleOtherKey():
+    """ Handle any other key, which stops any demo
+    """
+    global pb_demo
+    pb_demo.stop()
+
+def BuildKeyboardCommands():
+    """ Build the dispatch table for all keyboard presses
         Pressing a single bell value 1-9,0, e(-), t(=) will play the bell
         m + bell    will mute that bell number (always)
         u + bell    will unmute that bell number (but may not play if above the tenor)
@@ -475,66 +729,79 @@ def KeyboardCallback( event ):
         z           restart the application (quicker than the Pi)
                     this needs to be pressed twice in 3 seconds
         w + bell    start the selected demo playing until one of the normal bell keys is pressed
-        See: https://github.com/boppreh/keyboard#keyboard.on_press
+                    any other key that isn't a command, including up/down on their own, also stops it
+        i           log the strike to sound latency statistics (p50/p95/p99/max per stage and per bell)
+                    and the number of channel voices stolen from each bell
+        a + bell    analyse the striking against the demo method for that bell, rung from rounds
+                    press again to stop and log the summary for each bell
+        c           start calibrating the photohead delays, ring rounds up to the tenor for a few minutes
+                    press again to write the corrected delays to the photohead
+        v           save the delays on the photohead as the default delays in the config
+        Commands that write to the SD card or the photohead are run on the command worker,
+        the rest on the event loop. Calibrating is on the loop too, where the strikes are collected,
+        as writing its 13 bytes of delays doesn't wait for the photohead
+        See: https://github.com/boppreh/keyboard#keyboard.hook
     """
-    logger.debug( "Keyboard callback with value: %d and name %s", event.scan_code, event.name )
-
-    global pb_demo
-
-    #Handle special cases:
-    if keyboard.is_pressed("m"):
-        HandleMuting()
-    elif keyboard.is_pressed("u"):
-        HandleUnMuting()
-    elif keyboard.is_pressed("h"):
-        HandleTenor()
-    elif keyboard.is_pressed("r"):
-        HandleReset()
-    elif keyboard.is_pressed("l"):
-        HandleLogging()
-    elif keyboard.is_pressed("k"):
-        HandleKey()
-    elif keyboard.is_pressed("p"):
-        HandlePlay()
-    elif keyboard.is_pressed("d"):
-        HandleDefaultDelay()
-    elif keyboard.is_pressed("f"):
-        HandleDelayChange(True)
-    elif keyboard.is_pressed("s"):
-        HandleDelayChange(False)
-    elif keyboard.is_pressed("q"):
-        HandleQuit(True)
-    elif keyboard.is_pressed("z"):
-        HandleRestartPiBells(True)
-    elif keyboard.is_pressed("w"):
-        HandleDemo()
-    else: #Try and get the bell number
-        #Play the bell based on the selected tenor and key
-        bell = GetKeyboardBellNumber()
-        if bell and __config.play_mode:
-            global bell_sounds
-            bell_sounds.play_bell( bell )
-        pb_demo.stop()
-
-
+    global runtime, worker
+    commands = keyboard_commands( HandleBellKey, HandleOtherKey, runtime.submit, worker.submit )
+    
+    commands.add_modifier( "m", HandleMuting )
+    commands.add_modifier( "u", HandleUnMuting )
+    commands.add_modifier( "h", HandleTenor, slow = True )
+    commands.add_modifier( "k", HandleKey, slow = True )
+    commands.add_modifier( "d", HandleDefaultDelay, slow = True )
+    commands.add_modifier( "f", lambda bell: HandleDelayChange( True, bell ), slow = True )
+    commands.add_modifier( "s", lambda bell: HandleDelayChange( False, bell ), slow = True )
+    commands.add_modifier( "w", HandleDemo )
+    commands.add_modifier( "a", HandleStrikingAnalysis )
+    
+    commands.add_command( "r", HandleReset, slow = True )
+    commands.add_command( "l", HandleLogging, slow = True )
+    commands.add_command( "p", HandlePlay, slow = True )
+    commands.add_command( "q", lambda: HandleQuit( True ) )
+    commands.add_command( "z", lambda: HandleRestartPiBells( True ) )
+    commands.add_command( "i", HandleLatencyStats, slow = True )
+    commands.add_command( "c", HandleCalibration )
+    commands.add_command( "v", HandleSaveDelays, slow = True )
+    return commands
 
 #Start the logging
 def start_logging( file_name ):
     """ Start the logger, with rotating file handlers of 200kb, 5 files maximum
+        Records are queued and written to the file on a background thread, so logging (even debug logging)
+        never waits for the SD card. If the queue fills up records are dropped and the count is logged
     """
+    global logging_writer
     logger.setLevel(logging.DEBUG)
     formatter = logging.Formatter('%(asctime)s %(levelname)s:%(message)s')
     handler = logging.handlers.RotatingFileHandler(file_name, maxBytes=200000, backupCount=5) #files sizes of 200kb
     handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    logging_writer = log_writer( handler )
+    logger.addHandler( logging_writer.handler )
+    logging_writer.start()
 
-def main():
-    global __config
+def stop_logging():
+    """ Write out any queued log records and stop the background writer
+    """
+    if logging_writer is not None:
+        logging_writer.stop()
+
+def main( config_file = None, log_file = None, use_keyboard = True, replay_journal = None ):
+    """ Run PiBells until quit
+        config_file, log_file - default to pibells.ini and pibells.log alongside this file
+        use_keyboard - set False to run without the keyboard hook, e.g. from the load harness
+        replay_journal - a journal_replay to play in place of the photohead, PiBells stops when it finishes
+    """
+    global __config, replay
+    replay = replay_journal
 
     filename = inspect.getframeinfo(inspect.currentframe()).filename
     path = os.path.dirname(os.path.abspath(filename))
-    log_file = path + os.path.sep + "pibells.log"
-    __config = Configuration(path + os.path.sep + "pibells.ini")
+    if log_file is None:
+        log_file = path + os.path.sep + "pibells.log"
+    if config_file is None:
+        config_file = path + os.path.sep + "pibells.ini"
+    __config = Configuration(config_file)
     sounds_dir = path + os.path.sep + "sounds"
     
     start_logging( log_file )
@@ -542,34 +809,66 @@ def main():
     logger.info("========================================")
     logger.info("Starting Pi Bells - loading config")
     
-    global bell_sounds
-    bell_sounds = bell_sound_player()
-    bell_sounds.load_sound_files( sounds_dir, all_bell_file_names )
-    bell_sounds.load_valid_peals( define_valid_peals() )
-    
+    global bell_sounds, latency
+    latency = latency_stats.latency_stats( __config.num_bells )
     __config.ReadConfigFile()
     __config.LoadConfigFile()
     ApplyLoggingLevel( False )
     
+    bell_sounds = bell_sound_player( __config.audio_backend )
+    bell_sounds.set_latency_stats( latency )
+    __config.bell_sounds = bell_sounds
+    
+    #Load the sounds for the configured key first, the rest are loaded in the background
+    bell_sounds.load_sounds_in_background( sounds_dir, all_bell_file_names, define_valid_peals(), __config.key_index )
+    
     logger.info("Starting Pi Bells")
     
-    global photohead
-    photohead = photohead_interface(__config.device_name)
-    #Could check for success, but doesn't really matter
-    photohead.connect()
 
     bell_sounds.select_valid_peal(__config.key_index)
     bell_sounds.select_tenor( __config.num_bells )
     
-    #Setup the demo
+    #From now on all sounds are played by the dispatcher thread
+    bell_sounds.start_dispatcher()
+    
+    #Setup the event loop, the demo and keyboard commands all run on it
+    global runtime
+    runtime = pibells_runtime()
+    
+    global journal
+    #Not when replaying, so the journal being replayed isn't rotated away
+    if __config.strike_journal and replay is None:
+        journal = strike_journal.strike_journal( os.path.join( os.path.dirname( os.path.abspath( config_file ) ), "journal" ) )
+        if not journal.open():
+            journal = None
+    
     global pb_demo
     pb_demo = pibells_demo( bell_sounds, 0.2 )
+    pb_demo.journal = journal
+    
+    global striking
+    striking = striking_analysis( __config.num_bells )
+    
+    global calibration
+    calibration = delay_calibration()
     
-    #Hook to keyboard DOWN events
+    global worker
+    worker = command_worker()
+    worker.start()
+    
+    #Config changes (e.g. the tenor or key) are written in the background, at most once every few seconds
+    __config.StartBackgroundWriter()
+    
+    #Hook to keyboard DOWN and UP events (UP releases the modifiers), bells play straight from the hook
+    #and the commands are run on the event loop or the worker
     #If no keyboard attached, this errors
     #Presumably, if keyboard plugged in later this will not work...
     try:
-        keyboard.on_press( KeyboardCallback )
+        if keyboard is None or not use_keyboard:
+            logger.info("Running without the keyboard, keyboard commands will not work")
+        else:
+            commands = BuildKeyboardCommands()
+            keyboard.hook( commands.handle_event )
     except AttributeError:
         #Probably no keyboard attached
         logger.info("Unable to attached keyboard hook, keyboard probably not connected.")
@@ -583,40 +882,58 @@ def main():
     global muted_bells
     ResetMutedBells()
     
-    global shutdown_timeout
-    global restart_timeout
-    global keep_looping_flag
-    
-    while keep_looping_flag:
-        
-        #Check for user pressing quit
-        if shutdown_timeout.active():
-            quit_pressed = False
-            HandleQuit( quit_pressed )
-        
-        if restart_timeout.active():
-            restart_pressed = False
-            HandleRestartPiBells( restart_pressed )
-        
-        bell = photohead.get_bell()
-        if not bell:
-            sleep(0.01)
-            continue
-        
-        bell = CheckBellForMuting( bell )
-        if not bell:
-            continue
-        
-        bell_sounds.play_bell( bell )
+    StartBroadcast()
+    StartStatusServer()
+    runtime.start_stall_monitor()
+    
+    #Play each bell as soon as it arrives from the photoheads, or as it is replayed
+    ConnectPhotoheads()
+    if replay is not None:
+        logger.info("Replaying %.1f seconds of bells at %.2f times speed", replay.duration_s(), replay.speed)
+        replay.finished = runtime.stop
+        runtime.attach_replay( replay, HandleStrike )
+    runtime.call_later( latency_log_interval_s, LogLatencyStats )
+    runtime.call_later( config_check_interval_s, CheckConfigFile )
+    
+    runtime.run()
+    
+    pb_demo.close()
+    striking.stop()
+    worker.stop()
+    __config.StopBackgroundWriter()
+    bell_sounds.stop_dispatcher()
+    if journal is not None:
+        journal.close()
     
     logger.info("Exiting main loop and closing program");
 
 #This is the function that will run
 if __name__ == '__main__':
 
+    parser = argparse.ArgumentParser( description = "Play bell sounds from the photohead interface" )
+    parser.add_argument( "--config", default = None, help = "the config file, default pibells.ini alongside this file" )
+    parser.add_argument( "--log", default = None, help = "the log file, default pibells.log alongside this file" )
+    parser.add_argument( "--replay", nargs = "+", default = None, metavar = "JOURNAL",
+        help = "replay the bells from strike journal files (in order) in place of the photohead" )
+    parser.add_argument( "--speed", type = float, default = 1.0, help = "the speed to replay at, e.g. 2 for twice as fast" )
+    parser.add_argument( "--start", type = float, default = 0.0, help = "seconds into the journal to start replaying from" )
+    args = parser.parse_args()
+
+    replay_journal = None
+    if args.replay is not None:
+        #Only imported when replaying, as it needs NumPy
+        from pibells.core.replay import journal_replay
+        try:
+            replay_journal = journal_replay( args.replay, args.speed, args.start )
+        except ( OSError, ValueError ) as e:
+            print( "Unable to replay: " + str(e) )
+            sys.exit( 1 )
+
     try:
-        main()
+        main( args.config, args.log, True, replay_journal )
     except KeyboardInterrupt:
         logger.info("Keyboard interrupt, stopping")
     except:
         logger.exception("Error running PiBells")
+    finally:
+        stop_logging()
@@ -0,0 +1,107 @@
+# Python class for handing sounds to the pygame mixer from a single thread
+
+import queue
+import functools
+import threading
+import time
+import logging
+
+from pibells.core import latency_stats
+from pibells.audio.channel_allocator import channel_allocator
+
+class audio_dispatcher:
+    """ Class to own the pygame mixer on its own thread
+        Callers queue a sound to be played and return straight away, the thread then finds a channel and
+        plays it. As only this thread calls the mixer, the main loop, keyboard hook and demo can't race each other
+    """
+    def __init__( self, latency = None ):
+        """ Create the dispatcher, sounds are played immediately on the calling thread until it is started
+            latency - optional latency_stats to record the queueing, channel and play times
+        """
+        self.latency = latency
+
+        #Channels are reserved per bell, rather than taking any channel with find_channel
+        self.allocator = channel_allocator()
+
+        #SimpleQueue is implemented in C with no Python level locking, so queueing a sound is a single call
+        self.requests = queue.SimpleQueue()
+
+        self.thread = None
+        self.running = False
+
+        self.logger = logging.getLogger("PiBells")
+
+    def start( self ):
+        """ Start the dispatcher thread, from now on all sounds are played by it
+        """
+        self.running = True
+        self.thread = threading.Thread( target = self.run, name = "audio_dispatcher", daemon = True )
+        self.thread.start()
+
+    def stop( self ):
+        """ Stop the dispatcher thread once it has played everything already queued
+        """
+        if self.thread is None:
+            return
+        self.running = False
+        self.requests.put( None )
+        self.thread.join()
+        self.thread = None
+
+    def play( self, sound, bell = None, strike_time_ns = None ):
+        """ Play the pygame sound
+            bell - the bell number (1-12) the sound is for, used for the latency stats (None to not record)
+            strike_time_ns - the time.monotonic_ns() the bell was struck, if known
+            If the thread is running the sound is queued and this returns straight away,
+            otherwise it is played on the calling thread
+        """
+        if self.running:
+            self.requests.put( ( sound, bell, strike_time_ns, time.monotonic_ns() ) )
+        else:
+            self.play_now( sound, bell, strike_time_ns, None )
+
+    def configure_channels( self, bells, voices_per_bell ):
+        """ Reserve voices_per_bell mixer channels for each of the bells
+            If the thread is running this is done by the thread, between sounds
+        """
+        if self.running:
+            self.requests.put( functools.partial( self.allocator.configure, list( bells ), voices_per_bell ) )
+        else:
+            self.allocator.configure( bells, voices_per_bell )
+
+    def run( self ):
+        """ The thread body, play each sound as it is queued
+            Anything else on the queue (e.g. reconfiguring the channels) is called, so it also happens on this thread
+        """
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            try:
+                if callable( request ):
+                    request()
+                else:
+                    self.play_now( *request )
+            except Exception:
+                self.logger.exception("Error playing sound")
+
+    def play_now( self, sound, bell, strike_time_ns, queued_ns ):
+        """ Find a channel and play the sound on it, recording how long each step took
+        """
+        if self.latency is None or bell is None:
+            self.allocator.acquire( bell ).play( sound )
+            return
+
+        start_ns = time.monotonic_ns()
+        if queued_ns is not None:
+            self.latency.record( latency_stats.DISPATCH, bell, start_ns - queued_ns )
+
+        channel = self.allocator.acquire( bell )
+        acquired_ns = time.monotonic_ns()
+        self.latency.record( latency_stats.CHANNEL_ACQUIRE, bell, acquired_ns - start_ns )
+
+        channel.play( sound )
+        played_ns = time.monotonic_ns()
+        self.latency.record( latency_stats.PLAY, bell, played_ns - acquired_ns )
+        if strike_time_ns is not None:
+            self.latency.record( latency_stats.TOTAL, bell, played_ns - strike_time_ns )
@@ -0,0 +1,93 @@
+# Python class for allocating pygame mixer channels to bells
+
+import math
+import time
+import logging
+
+import pygame
+
+class channel_allocator:
+    """ Class to reserve a pool of mixer channels for each bell
+        When a bell is struck it plays on an idle channel from its own pool. If they are all busy, the voice of the
+        same bell that started longest ago is stolen - a bell's sound only decays, so that is also the quietest one.
+        This means fast ringing never cuts off a different bell, e.g. the tenor's hum for a stale treble tail
+        Must only be used from the thread that owns the mixer
+    """
+    def __init__( self, spare_channels = 4 ):
+        """ Create the allocator, configure must be called before it is used
+            spare_channels - channels kept for sounds that aren't a ringing bell, e.g. reference bells
+        """
+        self.spare_channels = spare_channels
+
+        self.channels = list()
+        #The time.monotonic_ns() each channel was last started, to find the oldest voice
+        self.started_ns = list()
+        #The channel indexes reserved for each bell, and those for anything else
+        self.pools = dict()
+        self.spare_pool = list()
+
+        #The number of voices stolen for each bell (None for the spare channels)
+        self.steals = dict()
+
+        self.logger = logging.getLogger("PiBells")
+
+    @staticmethod
+    def voices_needed( sample_length_s, stage, bell_gap_s ):
+        """ Work out how many voices a bell needs so its previous strikes are still sounding when it is struck again
+            sample_length_s - the length of the longest sample
+            stage - the number of bells ringing
+            bell_gap_s - the time between successive bells, i.e. the tempo
+            Each bell strikes once per row, a row taking stage bells plus half a bell for the handstroke gap on average
+        """
+        row_period_s = ( stage + 0.5 ) * bell_gap_s
+        return max( 1, math.ceil( sample_length_s / row_period_s ) )
+
+    def configure( self, bells, voices_per_bell ):
+        """ Set the number of mixer channels and reserve voices_per_bell of them for each of the bells
+            bells - the bell numbers (1-12) that will be played
+        """
+        bells = list( bells )
+        num_channels = len( bells ) * voices_per_bell + self.spare_channels
+        pygame.mixer.set_num_channels( num_channels )
+
+        self.channels = [ pygame.mixer.Channel( idx ) for idx in range( 0, num_channels ) ]
+        self.started_ns = [0]*num_channels
+
+        self.pools = dict()
+        for idx, bell in enumerate( bells ):
+            self.pools[ bell ] = list( range( idx * voices_per_bell, ( idx + 1 ) * voices_per_bell ) )
+        self.spare_pool = list( range( len( bells ) * voices_per_bell, num_channels ) )
+
+        self.logger.info("Using %d mixer channels, %d for each of %d bells and %d spare", num_channels, voices_per_bell, len( bells ), self.spare_channels )
+
+    def acquire( self, bell ):
+        """ Get the channel to play the bell on, stealing the bell's oldest voice if they are all busy
+            bell - the bell number (1-12), or None for a sound that isn't a ringing bell
+        """
+        pool = self.pools.get( bell, self.spare_pool )
+
+        oldest = pool[0]
+        for idx in pool:
+            if not self.channels[ idx ].get_busy():
+                oldest = idx
+                break
+            if self.started_ns[ idx ] < self.started_ns[ oldest ]:
+                oldest = idx
+        else:
+            #Every voice is busy, the oldest is replaced when the new sound is played on it
+            self.steals[ bell ] = self.steals.get( bell, 0 ) + 1
+
+        self.started_ns[ oldest ] = time.monotonic_ns()
+        return self.channels[ oldest ]
+
+    def log_steals( self ):
+        """ Log the number of voices stolen from each bell
+        """
+        if not self.steals:
+            self.logger.info("No channel voices have been stolen")
+            return
+        for bell, steals in sorted( self.steals.items(), key = lambda item: item[0] or 0 ):
+            if bell is None:
+                self.logger.info("Channel voices stolen from the spare channels: %d", steals )
+            else:
+                self.logger.info("Channel voices stolen from bell %d: %d", bell, steals )
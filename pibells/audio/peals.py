@@ -0,0 +1,57 @@
+# The bell sound files and the peals of bells (keys) they make up
+
+#All the bell sound files, without the `.wav` extension
+all_bell_file_names = [
+    "twx0",
+    "twx1",
+    "twx1b",
+    "twx1s",
+    "twx2",
+    "twx3",
+    "twx3b",
+    "twx4",
+    "twx4b",
+    "twx5",
+    "twx6",
+    "twx6b",
+    "twx7",
+    "twx7b",
+    "twx8",
+    "twx8b",
+    "twx9",
+    "twx10",
+    "twx11",
+    "twx12",
+    ]
+
+#The peals of bells that sound correct, as ( key, sound file names from treble to tenor )
+#In the order they can be selected, from 12 bells in D down to 6 bells in D
+valid_peal_definitions = [
+    ( "D",  ["twx1",  "twx2",  "twx3",  "twx4",  "twx5",  "twx6",  "twx7",  "twx8",  "twx9",  "twx10", "twx11", "twx12", ] ),
+    ( "E",  ["twx0",  "twx1",  "twx1b", "twx3",  "twx4",  "twx4b", "twx6",  "twx7",  "twx8",  "twx8b", "twx10", "twx11", ] ),
+    ( "F#", ["twx1s", "twx1b", "twx3",  "twx3b", "twx4b", "twx6",  "twx7",  "twx7b", "twx8b", "twx10", ] ),
+    ( "G",  ["twx1",  "twx2",  "twx3",  "twx4",  "twx5",  "twx6b", "twx7",  "twx8",  "twx9", ] ),
+    ( "G#", ["twx1b", "twx2",  "twx3b", "twx4b", "twx6",  "twx6b", "twx7b", "twx8b", ] ),
+    ( "A",  ["twx1",  "twx1b", "twx3",  "twx4",  "twx5",  "twx6",  "twx7",  "twx8",  ] ),
+    ( "A#", ["twx1s", "twx1",  "twx2",  "twx3b", "twx4b", "twx5",  "twx6b", "twx7b", ] ),
+    ( "B",  ["twx0",  "twx1s", "twx1b", "twx3",  "twx4",  "twx4b", "twx6",  "twx7",  ] ),
+    ( "C",  ["twx1",  "twx2",  "twx3b", "twx4",  "twx5",  "twx6b", ] ),
+    ( "C#", ["twx1s", "twx1b", "twx3",  "twx3b", "twx4b", "twx6",  ] ),
+    ( "D",  ["twx0",  "twx1",  "twx2",  "twx3",  "twx4",  "twx5",  ] ),
+    ]
+
+def map_bell_to_peal_index( bell, tenor, num_sounds ):
+    """ Convert the absolute bell number to the index of its sound in a peal of num_sounds, relative to the tenor
+        Returns None if the bell is beyond the tenor, or below the lightest bell of the peal
+    """
+    if bell > tenor:
+        #Then can't play this
+        return None
+    
+    offset_from_tenor = tenor - bell #this should be >= 0 based on the check above
+    bell_sound_index = num_sounds - offset_from_tenor - 1
+    
+    # prevent any bells below the current sound index from ringing
+    if bell_sound_index < 0:
+        return None
+    return bell_sound_index
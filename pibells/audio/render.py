@@ -0,0 +1,168 @@
+# Python class for rendering a touch to a WAV file offline, faster than real time
+
+import os
+import sys
+import time
+import wave
+import argparse
+import logging
+
+import numpy
+
+from pibells.configuration import Configuration
+from pibells.core.place_notation_processor import place_notation_processor
+from pibells.core.compiled_method import compile_method
+from pibells.audio.peals import all_bell_file_names, valid_peal_definitions, map_bell_to_peal_index
+
+class touch_renderer:
+    """ Class to render a whole touch straight to audio, using the bell samples and valid peal mappings
+        All the strike times are known up front, so each sample is added into one output array with NumPy
+        rather than going through the live mixer. No sound card is needed
+    """
+    def __init__( self, sounds_dir ):
+        """ Create the renderer, loading every bell sample from sounds_dir
+        """
+        self.logger = logging.getLogger("PiBells")
+
+        self.samples = dict()
+        self.sample_rate = None
+        for name in all_bell_file_names:
+            self.samples[ name ] = self.load_sample( sounds_dir + os.path.sep + name + '.wav' )
+
+    def load_sample( self, file_name ):
+        """ Load a mono, signed 16 bit `.wav` file as float32 samples
+            All the samples must have the same sample rate, which is used for the output
+        """
+        with wave.open( file_name, 'rb' ) as wav:
+            if wav.getnchannels() != 1 or wav.getsampwidth() != 2:
+                raise ValueError( file_name + " is not mono 16 bit" )
+            if self.sample_rate is None:
+                self.sample_rate = wav.getframerate()
+            elif wav.getframerate() != self.sample_rate:
+                raise ValueError( file_name + " has a different sample rate to the other sounds" )
+            frames = wav.readframes( wav.getnframes() )
+        return numpy.frombuffer( frames, dtype = '<i2' ).astype( numpy.float32 )
+
+    def touch_bells( self, place_notation_str, add_tenor, max_rows ):
+        """ Get the bells of the touch in order, -1 for the gap at each handstroke
+            Starts with the two rows of rounds and ends with the row of rounds it comes round to,
+            or after max_rows if it doesn't come round
+            Returns the list of bells and the number of bells in the method
+        """
+        pnp = place_notation_processor( place_notation_str, add_tenor )
+        pnp.reset()
+        rounds = list( range( 1, pnp.num_bells+1 ) )
+
+        bells = list()
+        rows = 0
+        came_round = False
+        while rows < max_rows:
+            changes_count = pnp.changes_count
+            bells.append( pnp.get_next_bell() )
+            if pnp.changes_count == changes_count:
+                continue
+
+            #A row has just finished
+            rows += 1
+            if came_round:
+                break
+            if pnp.changes_count > 2 and list( pnp.bells_array ) == rounds:
+                #Ring the row of rounds it has come round to, then stop
+                came_round = True
+
+        if not came_round:
+            self.logger.info("Touch did not come round within %d rows", max_rows )
+        return bells, pnp.num_bells
+
+    def render( self, bells, key_index, tenor, bell_gap_s ):
+        """ Mix the bells into a single array of float32 samples
+            bells - the bells in order, -1 for a gap
+            key_index - the valid peal (key) to use
+            tenor - the bell that is mapped to the tenor sound, as select_tenor
+            bell_gap_s - the time between successive bells
+        """
+        key_str, file_names = valid_peal_definitions[ key_index ]
+        peal_samples = [ self.samples[ name ] for name in file_names ]
+
+        gap_samples = bell_gap_s * self.sample_rate
+        longest = max( len( samples ) for samples in peal_samples )
+        out = numpy.zeros( int( len( bells ) * gap_samples ) + longest, dtype = numpy.float32 )
+
+        for idx, bell in enumerate( bells ):
+            if bell <= 0:
+                continue
+            bell_index = map_bell_to_peal_index( bell, tenor, len( peal_samples ) )
+            if bell_index is None:
+                continue
+            samples = peal_samples[ bell_index ]
+            start = int( round( idx * gap_samples ) )
+            out[ start:start + len( samples ) ] += samples
+        return out
+
+    def write_wav( self, samples, file_name ):
+        """ Write the samples to a mono 16 bit `.wav` file, scaling them down if they would clip
+        """
+        peak = numpy.max( numpy.abs( samples ) ) if len( samples ) else 0
+        if peak > 32767:
+            samples = samples * ( 32767 / peak )
+        with wave.open( file_name, 'wb' ) as wav:
+            wav.setnchannels( 1 )
+            wav.setsampwidth( 2 )
+            wav.setframerate( self.sample_rate )
+            wav.writeframes( samples.astype( '<i2' ).tobytes() )
+
+def main( argv ):
+    """ Render a touch from the command line
+    """
+    parser = argparse.ArgumentParser( description = "Render a touch to a WAV file without a sound card" )
+    parser.add_argument( "output", help = "the WAV file to write" )
+    method = parser.add_mutually_exclusive_group( required = True )
+    method.add_argument( "--notation", help = "the place notation to ring, e.g. X30X14X50X16X1270X38X14X50X16X90-12" )
+    method.add_argument( "--demo", type = int, help = "ring demo 1-12 from the config, as w + bell" )
+    parser.add_argument( "--add-tenor", action = "store_true", help = "add a covering tenor to an odd number of bells (with --notation)" )
+    parser.add_argument( "--config", default = "pibells.ini", help = "the config file to take the demo from" )
+    parser.add_argument( "--key", type = int, default = 0, help = "the key (valid peal) index, 0 is 12 bells in D" )
+    parser.add_argument( "--tenor", type = int, default = None, help = "the bell rung as the tenor, defaults to the number of bells in the method" )
+    parser.add_argument( "--tempo", type = float, default = 0.2, help = "the time between bells in seconds" )
+    parser.add_argument( "--max-rows", type = int, default = 10000, help = "stop after this many rows if it doesn't come round" )
+    parser.add_argument( "--sounds", default = "sounds", help = "the directory of bell sounds" )
+    args = parser.parse_args( argv )
+
+    logging.basicConfig( level = logging.INFO )
+
+    if args.key < 0 or args.key >= len( valid_peal_definitions ):
+        parser.error( "--key must be from 0 to %d, one of: %s" % ( len( valid_peal_definitions ) - 1,
+            ", ".join( "%d (%d bells in %s)" % ( idx, len( file_names ), key_str ) for idx, ( key_str, file_names ) in enumerate( valid_peal_definitions ) ) ) )
+
+    if args.demo is not None:
+        if args.demo < 1 or args.demo > 12:
+            parser.error( "--demo must be from 1 to 12" )
+        config = Configuration( args.config )
+        if os.path.exists( args.config ):
+            config.ReadConfigFile()
+            config.LoadConfigFile()
+        demo = config.place_notation_array[ args.demo - 1 ]
+        place_notation_str, add_tenor = demo.string, demo.add_tenor
+    else:
+        place_notation_str, add_tenor = args.notation, args.add_tenor
+
+    try:
+        num_bells = compile_method( place_notation_str, add_tenor ).num_bells
+    except ValueError as e:
+        parser.error( str(e) )
+    if args.tenor is not None and ( args.tenor < 1 or args.tenor > num_bells ):
+        parser.error( "--tenor must be from 1 to %d, the number of bells in the method" % num_bells )
+
+    start_s = time.perf_counter()
+    renderer = touch_renderer( args.sounds )
+    bells, num_bells = renderer.touch_bells( place_notation_str, add_tenor, args.max_rows )
+    tenor = args.tenor if args.tenor is not None else num_bells
+    samples = renderer.render( bells, args.key, tenor, args.tempo )
+    renderer.write_wav( samples, args.output )
+
+    print( "Rendered %s: %d bells, %.1fs of audio in %.2fs" % ( place_notation_str, len( bells ),
+        len( samples ) / renderer.sample_rate, time.perf_counter() - start_s ) )
+
+#Render with, for example: python3 -m pibells.audio.render yorkshire.wav --demo 10
+if __name__ == '__main__':
+    main( sys.argv[1:] )
@@ -0,0 +1,176 @@
+# Python class for mixing the bell sounds in software, so they can be scheduled to the exact sample
+
+import collections
+import threading
+import time
+import logging
+
+import numpy
+import pygame
+
+from pibells.core import latency_stats
+
+class software_mixer:
+    """ Class to mix the bell sounds with NumPy into fixed size blocks of audio, played as one stream through pygame
+        Sounds are scheduled with play_at, which places the start of the sound on the exact sample for the requested
+        time, so the striking is as even as the requested times, whatever the thread wake up latency
+        Sounds can only be scheduled into blocks that haven't been rendered yet, so anything asked for sooner
+        (e.g. "now") starts at the beginning of the next block
+    """
+    def __init__( self, sample_rate, block_size = 512, latency = None ):
+        """ Create the mixer for the mixer's sample rate (mono, signed 16 bit)
+            block_size - number of samples mixed at a time
+            latency - optional latency_stats to record the dispatch and total times
+        """
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.latency = latency
+
+        #Requests from any thread, appending and popping from a deque are atomic so no lock is needed
+        self.requests = collections.deque()
+
+        #Sounds currently playing, each as [ samples, start position ]
+        self.voices = list()
+        #Sample position of the next block to be rendered, and the time.monotonic_ns() that position 0 is heard
+        self.position = 0
+        self.start_ns = None
+
+        #Samples of each sound as float32, converted the first time the sound is played
+        self.sample_cache = dict()
+        self.mix_buffer = numpy.zeros( block_size, dtype = numpy.float32 )
+
+        self.channel = None
+        self.thread = None
+        self.running = False
+
+        #Number of times the output ran dry before the next block was ready
+        self.underruns = 0
+
+        self.logger = logging.getLogger("PiBells")
+
+    def block_duration_ns( self ):
+        """ Get the duration of a block in ns
+        """
+        return ( self.block_size * 1000000000 ) // self.sample_rate
+
+    def lead_time_ns( self ):
+        """ Get how far ahead a sound must be scheduled to be sure of landing on its exact sample
+            One block is playing and the next is already queued, so anything sooner goes in the block after
+        """
+        return 2 * self.block_duration_ns()
+
+    def samples_for( self, sound ):
+        """ Get the samples of a pygame sound as float32, converting and caching them the first time
+        """
+        samples = self.sample_cache.get( sound )
+        if samples is None:
+            samples = numpy.frombuffer( sound.get_raw(), dtype = numpy.int16 ).astype( numpy.float32 )
+            self.sample_cache[ sound ] = samples
+        return samples
+
+    def play_at( self, sound, time_ns = None, bell = None, strike_time_ns = None ):
+        """ Schedule the sound to start at the time.monotonic_ns() time_ns, or as soon as possible if None
+            bell - the bell number (1-12) the sound is for, used for the latency stats (None to not record)
+            strike_time_ns - the time.monotonic_ns() the bell was struck, if known
+            This is safe to call from any thread and returns straight away
+        """
+        self.requests.append( ( sound, time_ns, bell, strike_time_ns, time.monotonic_ns() ) )
+
+    def time_to_position( self, time_ns ):
+        """ Convert a time.monotonic_ns() to the sample position it will be heard at
+        """
+        return ( ( time_ns - self.start_ns ) * self.sample_rate ) // 1000000000
+
+    def take_requests( self, block_start ):
+        """ Move the requested sounds on to the voices, placed at their sample position
+        """
+        while self.requests:
+            sound, time_ns, bell, strike_time_ns, queued_ns = self.requests.popleft()
+            start = block_start
+            if time_ns is not None and self.start_ns is not None:
+                start = max( block_start, self.time_to_position( time_ns ) )
+            self.voices.append( [ self.samples_for( sound ), start ] )
+
+            if self.latency is not None and bell is not None:
+                taken_ns = time.monotonic_ns()
+                self.latency.record( latency_stats.DISPATCH, bell, taken_ns - queued_ns )
+                if strike_time_ns is not None:
+                    self.latency.record( latency_stats.TOTAL, bell, taken_ns - strike_time_ns )
+
+    def render_block( self ):
+        """ Mix the next block of audio from all the voices
+            Returns the block as signed 16 bit samples
+        """
+        block_start = self.position
+        self.take_requests( block_start )
+
+        out = self.mix_buffer
+        out.fill( 0 )
+        still_playing = list()
+        for voice in self.voices:
+            samples, start = voice
+            offset = start - block_start
+            if offset >= self.block_size:
+                #Not started yet
+                still_playing.append( voice )
+                continue
+
+            dest_start = max( 0, offset )
+            source_start = max( 0, -offset )
+            length = min( self.block_size - dest_start, len( samples ) - source_start )
+            out[ dest_start:dest_start + length ] += samples[ source_start:source_start + length ]
+
+            if source_start + length < len( samples ):
+                still_playing.append( voice )
+        self.voices = still_playing
+
+        self.position += self.block_size
+        numpy.clip( out, -32768, 32767, out = out )
+        return out.astype( numpy.int16 )
+
+    def start( self, channel_id = 0 ):
+        """ Start the thread that renders the blocks and queues them on the pygame channel
+        """
+        pygame.mixer.set_num_channels( max( pygame.mixer.get_num_channels(), channel_id + 1 ) )
+        self.channel = pygame.mixer.Channel( channel_id )
+
+        #The first block is played as soon as it is rendered
+        self.position = 0
+        self.start_ns = time.monotonic_ns()
+
+        self.running = True
+        self.thread = threading.Thread( target = self.run, name = "software_mixer", daemon = True )
+        self.thread.start()
+
+    def stop( self ):
+        """ Stop the rendering thread
+        """
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run( self ):
+        """ The thread body, keep the channel's queue topped up with the next block
+        """
+        poll_s = self.block_duration_ns() / 4e9
+        while self.running:
+            if self.channel.get_queue() is not None:
+                time.sleep( poll_s )
+                continue
+
+            try:
+                sound = pygame.mixer.Sound( buffer = self.render_block().tobytes() )
+            except Exception:
+                self.logger.exception("Error rendering audio block")
+                continue
+
+            if self.channel.get_busy():
+                self.channel.queue( sound )
+                continue
+
+            if self.position > self.block_size:
+                #Ran dry, this block starts late so move the clock on to match
+                self.underruns += 1
+                self.start_ns = time.monotonic_ns() - ( ( self.position - self.block_size ) * 1000000000 ) // self.sample_rate
+            self.channel.play( sound )
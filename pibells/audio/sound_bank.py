@@ -0,0 +1,178 @@
+# Python class for a precompiled bank of bell sounds, ready to hand to the pygame mixer without decoding
+
+import os
+import sys
+import json
+import mmap
+import struct
+import logging
+
+import pygame
+
+class sound_bank:
+    """ Class to build and load a single sound bank file holding the raw PCM of every bell sound,
+        already converted to the format the mixer is running at
+        The file is laid out as:
+            8 byte magic
+            4 byte little endian length of the index
+            JSON index of the mixer format, and the offset, length and source mtime of each sample
+            the raw PCM of each sample
+        At startup the file is memory mapped and each Sound made straight from its slice, so nothing is decoded
+        or resampled. If any WAV file changes, or the mixer format changes, the bank is rebuilt
+    """
+    magic = b"PIBANK01"
+    header_format = "<8sI"
+
+    def __init__( self, bank_file_name ):
+        """ Create the class for the given bank file, which is created when first needed
+        """
+        self.bank_file_name = bank_file_name
+
+        self.index = None
+        self.data_start = 0
+        self.bank_file = None
+        self.mapped = None
+
+        self.logger = logging.getLogger("PiBells")
+
+    def load_sounds( self, path, sound_file_names ):
+        """ Load the sounds from the bank, rebuilding it first if it is missing or out of date
+            path - the path of the `.wav` files the bank is built from
+            sound_file_names - the list of sound file names (without the `.wav` extension)
+            Returns a dictionary of file name to pygame Sound
+            The mixer must already be initialised
+        """
+        self.prepare( path, sound_file_names )
+
+        sounds = dict()
+        for name in sound_file_names:
+            sounds[ name ] = self.load_sound( name )
+        return sounds
+
+    def prepare( self, path, sound_file_names ):
+        """ Open the bank ready for load_sound, rebuilding it first if it is missing or out of date
+            The mixer must already be initialised
+        """
+        mixer_format = list( pygame.mixer.get_init() )
+        sources = self.source_details( path, sound_file_names )
+
+        if not self.open_bank() or not self.is_current( mixer_format, sources ):
+            self.close()
+            self.build( path, sound_file_names, mixer_format )
+            self.open_bank()
+
+    def load_sound( self, name ):
+        """ Make a pygame Sound for the named sample straight from the mapped bank
+        """
+        return pygame.mixer.Sound( buffer = self.sample_buffer( name ) )
+
+    def source_details( self, path, sound_file_names ):
+        """ Get the modification time and size of each source file, used to tell if the bank is out of date
+        """
+        sources = dict()
+        for name in sound_file_names:
+            details = os.stat( path + os.path.sep + name + '.wav' )
+            sources[ name ] = [ details.st_mtime_ns, details.st_size ]
+        return sources
+
+    def is_current( self, mixer_format, sources ):
+        """ Check the open bank matches the mixer format and every source file is unchanged
+        """
+        if self.index[ "format" ] != mixer_format:
+            self.logger.info("Sound bank is for mixer format %s, the mixer is %s - rebuilding", self.index[ "format" ], mixer_format )
+            return False
+
+        for name, details in sources.items():
+            sample = self.index[ "samples" ].get( name )
+            if sample is None or sample[ "source" ] != details:
+                self.logger.info("Sound bank is out of date for %s - rebuilding", name )
+                return False
+        return True
+
+    def build( self, path, sound_file_names, mixer_format ):
+        """ Decode every `.wav` file with the mixer and write the raw PCM and index to the bank file
+            The file is written to a temporary name and renamed, so a partly written bank is never loaded
+        """
+        self.logger.info("Building sound bank %s from %d sounds", self.bank_file_name, len( sound_file_names ) )
+
+        samples = dict()
+        raw_samples = list()
+        offset = 0
+        for name in sound_file_names:
+            full_file_name = path + os.path.sep + name + '.wav'
+            details = os.stat( full_file_name )
+            raw = pygame.mixer.Sound( full_file_name ).get_raw()
+            samples[ name ] = { "offset": offset, "length": len( raw ), "source": [ details.st_mtime_ns, details.st_size ] }
+            raw_samples.append( raw )
+            offset += len( raw )
+
+        index = json.dumps( { "format": mixer_format, "samples": samples } ).encode( 'UTF-8' )
+
+        temp_file_name = self.bank_file_name + ".tmp"
+        with open( temp_file_name, 'wb' ) as bank_file:
+            bank_file.write( struct.pack( self.header_format, self.magic, len( index ) ) )
+            bank_file.write( index )
+            for raw in raw_samples:
+                bank_file.write( raw )
+            bank_file.flush()
+            os.fsync( bank_file.fileno() )
+        os.replace( temp_file_name, self.bank_file_name )
+
+    def open_bank( self ):
+        """ Memory map the bank file and read its index
+            Returns True if opened, False if the file is missing or not a valid bank
+        """
+        try:
+            self.bank_file = open( self.bank_file_name, 'rb' )
+            self.mapped = mmap.mmap( self.bank_file.fileno(), 0, access = mmap.ACCESS_READ )
+
+            header_size = struct.calcsize( self.header_format )
+            magic, index_length = struct.unpack_from( self.header_format, self.mapped, 0 )
+            if magic != self.magic:
+                self.logger.info("Sound bank %s is not a valid bank", self.bank_file_name )
+                self.close()
+                return False
+
+            self.index = json.loads( self.mapped[ header_size:header_size + index_length ].decode( 'UTF-8' ) )
+            self.data_start = header_size + index_length
+        except ( OSError, ValueError, struct.error ) as e:
+            self.logger.info("Unable to open sound bank %s: %s", self.bank_file_name, str(e) )
+            self.close()
+            return False
+        return True
+
+    def sample_buffer( self, name ):
+        """ Get the raw PCM of the named sample, as a slice of the mapped file (no copy is made)
+        """
+        sample = self.index[ "samples" ][ name ]
+        start = self.data_start + sample[ "offset" ]
+        return memoryview( self.mapped )[ start:start + sample[ "length" ] ]
+
+    def close( self ):
+        """ Close the mapped file, any Sounds already made from it are unaffected
+        """
+        self.index = None
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+        if self.bank_file is not None:
+            self.bank_file.close()
+            self.bank_file = None
+
+def main( sounds_dir ):
+    """ Build (or check) the sound bank for the sounds in sounds_dir, using the same mixer format as PiBells
+    """
+    logging.basicConfig( level = logging.INFO )
+
+    #Match the mixer set up in bell_sound_player
+    pygame.mixer.pre_init(22050, -16, 1, 64)
+    pygame.mixer.init()
+
+    sound_file_names = sorted( os.path.splitext( file_name )[0] for file_name in os.listdir( sounds_dir ) if file_name.endswith( '.wav' ) )
+    bank = sound_bank( sounds_dir + os.path.sep + "sound_bank.bin" )
+    bank.load_sounds( sounds_dir, sound_file_names )
+    bank.close()
+
+#Build the sound bank ahead of time with: python3 -m pibells.audio.sound_bank [sounds directory]
+if __name__ == '__main__':
+    main( sys.argv[1] if len( sys.argv ) > 1 else "sounds" )
@@ -0,0 +1,85 @@
+# Tests for allocating mixer channels to bells, run with: python3 -m pytest pibells
+
+import os
+import unittest
+
+#No sound card is needed to reserve channels
+os.environ.setdefault( "SDL_AUDIODRIVER", "dummy" )
+
+import pygame
+
+from pibells.audio.channel_allocator import channel_allocator
+
+class fake_channel:
+    """ Class standing in for a mixer channel, busy until told otherwise
+    """
+    def __init__( self ):
+        self.busy = False
+
+    def get_busy( self ):
+        return self.busy
+
+class channel_allocator_test( unittest.TestCase ):
+    @classmethod
+    def setUpClass( cls ):
+        pygame.mixer.init()
+
+    @classmethod
+    def tearDownClass( cls ):
+        pygame.mixer.quit()
+
+    def setUp( self ):
+        #Bells 1-3 with 2 voices each, then 2 spare channels
+        self.allocator = channel_allocator( spare_channels = 2 )
+        self.allocator.configure( [ 1, 2, 3 ], 2 )
+        self.channels = [ fake_channel() for channel in self.allocator.channels ]
+        self.allocator.channels = self.channels
+
+    def acquire_index( self, bell ):
+        return self.channels.index( self.allocator.acquire( bell ) )
+
+    def set_busy( self, indexes, started_ns ):
+        for idx in indexes:
+            self.channels[ idx ].busy = True
+            self.allocator.started_ns[ idx ] = started_ns[ idx ]
+
+    def test_pools( self ):
+        self.assertEqual( len( self.channels ), 8 )
+        self.assertEqual( self.allocator.pools, { 1: [ 0, 1 ], 2: [ 2, 3 ], 3: [ 4, 5 ] } )
+        self.assertEqual( self.allocator.spare_pool, [ 6, 7 ] )
+
+    def test_idle_voice( self ):
+        self.assertEqual( self.acquire_index( 2 ), 2 )
+        self.channels[ 2 ].busy = True
+        self.assertEqual( self.acquire_index( 2 ), 3 )
+        self.assertEqual( self.allocator.steals, {} )
+
+    def test_steals_oldest_voice_of_same_bell( self ):
+        #Every channel is busy, bell 2's second voice started first
+        started_ns = [ 10, 20, 50, 40, 1, 2, 3, 4 ]
+        self.set_busy( range( 0, 8 ), started_ns )
+        self.assertEqual( self.acquire_index( 2 ), 3 )
+        self.assertEqual( self.allocator.steals, { 2: 1 } )
+        #The stolen voice is now the newest, so the other is taken next
+        self.assertEqual( self.acquire_index( 2 ), 2 )
+        self.assertEqual( self.allocator.steals, { 2: 2 } )
+        #Other bells' channels are never taken, even the older ones
+        for idx in ( 0, 1, 4, 5, 6, 7 ):
+            self.assertEqual( self.allocator.started_ns[ idx ], started_ns[ idx ] )
+
+    def test_spare_channels( self ):
+        #Sounds that aren't a ringing bell, or a bell without a pool, use the spare channels
+        self.assertEqual( self.acquire_index( None ), 6 )
+        self.assertEqual( self.acquire_index( 12 ), 6 )
+        self.set_busy( range( 0, 8 ), [ 1, 2, 3, 4, 5, 6, 9, 8 ] )
+        self.assertEqual( self.acquire_index( None ), 7 )
+        self.assertEqual( self.allocator.steals, { None: 1 } )
+
+    def test_voices_needed( self ):
+        #A 5s sample at 0.2s a bell on 12 rings for two rows (2.5s each)
+        self.assertEqual( channel_allocator.voices_needed( 5.0, 12, 0.2 ), 2 )
+        self.assertEqual( channel_allocator.voices_needed( 5.1, 12, 0.2 ), 3 )
+        self.assertEqual( channel_allocator.voices_needed( 0.1, 12, 0.2 ), 1 )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,65 @@
 import configparser
 import logging
+import os
+import threading
+import time
 
 from pibells.core.placenotation import place_notation
+from pibells.core.truth import check_place_notation
+from pibells.audio.peals import valid_peal_definitions
+
+
+class PhotoheadConfig:
+    # The settings for a photohead after the first, from a [photohead_N] section (N from 2)
+    # The bells it sends are rung as bell + bell_offset, or as given by bell_map (12 bells, 0 to ignore a bell)
+    # and default_delays are for the bells it sends
+
+    def __init__(self, device_name, bell_offset=None, bell_map=None, default_delays=None):
+        self.device_name = device_name
+        self.bell_offset = bell_offset
+        if bell_map is None:
+            offset = bell_offset or 0
+            bell_map = [bell + offset if bell + offset <= 12 else 0 for bell in range(1, 13)]
+        self.bell_map = list(bell_map)
+        self.default_delays = list(default_delays) if default_delays is not None else [1] * 12
+
+    def Key(self):
+        # The settings as a tuple, to compare snapshots
+        return (self.device_name, self.bell_offset, tuple(self.bell_map), tuple(self.default_delays))
+
+
+class ConfigSnapshot:
+    # The settings parsed from the config file in one pass, typed and checked
+    # A setting that is missing or invalid in the file is None, so the current value is kept
+    # The demos are (place notation, add tenor) tuples, not yet checked for truth
+
+    fields = ('tenor', 'key_index', 'logging_debug', 'play_mode', 'device_name', 'audio_backend',
+              'strike_journal', 'broadcast_multicast', 'broadcast_websocket', 'status_http', 'default_delays',
+              'extra_photoheads', 'demos')
+
+    def __init__(self):
+        self.tenor = None
+        self.key_index = None
+        self.logging_debug = None
+        self.play_mode = None
+        self.device_name = None
+        self.audio_backend = None
+        self.strike_journal = None
+        self.broadcast_multicast = None
+        self.broadcast_websocket = None
+        self.status_http = None
+        self.default_delays = None  # tuple of 12, each missing delay is None
+        self.extra_photoheads = None  # tuple of PhotoheadConfig.Key() for each [photohead_N] section
+        self.demos = None  # tuple of 12, each missing demo is None
+
+    def ChangedFields(self, previous):
+        # Get the names of the settings that are set here and differ from the previous snapshot
+        changed = []
+        for field in self.fields:
+            value = getattr(self, field)
+            if value is not None and value != getattr(previous, field):
+                changed.append(field)
+        return changed
 
 
 class Configuration:
@@ -13,12 +71,22 @@ class Configuration:
         self.__logger = logging.getLogger("PiBells")
 
         self.bell_sounds = None
-        self.logging_debug = False  # default to no debug logging, as this can cause problems with playing the sound
+        self.logging_debug = False  # default to no debug logging, it is written in the background but quickly fills the log files
         self.play_mode = True
+        self.audio_backend = "pygame"  # or "numpy" to mix the bells in software, "null" for no sound card
+        self.strike_journal = True  # journal every bell to the journal directory, see pibells.core.strike_journal
+        self.broadcast_multicast = ""  # group:port to multicast each strike to, e.g. 239.255.42.1:5007, empty for none
+        self.broadcast_websocket = ""  # host:port for the WebSocket server sending each strike, e.g. 0.0.0.0:8765, empty for none
+        self.status_http = ""  # host:port to serve the JSON status and Prometheus metrics on, e.g. 0.0.0.0:8080, empty for none
         self.device_name = "/dev/ttyUSB0"  # USB port based
         # self.device_name = "/dev/ttyS0"  # Wired serial port/ Rpi version with RS232 to TTL converter
         self.num_bells = 12  # this is duplicated in the photohead_interface
         self.default_delays = [1] * self.num_bells  # Store the default delays (min value of 1) - these are loaded from the config file
+        self.min_delay = 1  # the range of delays the photohead accepts, duplicated in the photohead_interface
+        self.max_delay = 250
+
+        # Any more photoheads, read together with the one on device_name, see PhotoheadConfig
+        self.extra_photoheads = []
 
         # Store the loaded place notations, set the defaults, up to 12
         self.num_place_notations = 12
@@ -37,9 +105,29 @@ class Configuration:
             place_notation("X1TX14-12", False),  # Results in Little Bob Max
         ]
 
+        # Demos that don't come round within this many rows are rejected when loading
+        self.max_demo_rows = 100000
+
         self.tenor = None
         self.key_index = 0 # 0 is 12 bells in D
 
+        # Writes requested with RequestWrite are coalesced and made at most once per interval on a background thread
+        self.write_interval_s = 5
+        self.__write_lock = threading.Lock()  # only one write of the file at a time
+        self.__writer_condition = threading.Condition()
+        self.__writer_thread = None
+        self.__write_pending = False
+        self.__last_write_time = 0
+        self.writes = 0  # the number of times the file has been written, for the status metrics
+        self.__stopping_writer = False
+
+        # The snapshot of the file as last loaded or written, and its modified time and size
+        # A change to either means the file has been edited, see CheckForChanges
+        self.__snapshot = ConfigSnapshot()
+        self.__file_stamp = None
+        # Settings edited by hand that were merged in by a write, but not yet acted on by ReloadConfigFile's caller
+        self.__unapplied_fields = []
+
     def ReadConfigFile(self):
         configsLoaded = self.__config.read(self.__config_file)
         if len(configsLoaded) != 1:
@@ -50,21 +138,78 @@ class Configuration:
             self.WriteConfigFile()
 
     def WriteConfigFile(self):
-
+        # Write the config straight away, atomically: to a temp file which is synced then renamed over the config
+        # so a power cut part way through leaves either the old or the new file, never a truncated one
+        with self.__write_lock:
+            self.__WriteConfigFileAtomic()
+
+    def __WriteConfigFileAtomic(self):
+        # The file may have been edited by hand since it was last loaded or written, and not reloaded yet
+        # Merge the edits in first, so they aren't written over, keeping the changed settings to be acted on
+        if self.__file_stamp is not None and self.__GetFileStamp() != self.__file_stamp:
+            changed = self.__ReloadConfigFileLocked()
+            if changed:
+                self.__logger.info("Config file edited before writing, keeping the edited %s", ", ".join(changed))
+            self.__unapplied_fields += [field for field in changed if field not in self.__unapplied_fields]
+
+        self.__UpdateConfigValues()
+
+        temp_file = self.__config_file + ".tmp"
         try:
-            cfgfile = open(self.__config_file, 'w')
-        except:
-            self.__logger.info("Unable to open config file for writing")
+            with open(temp_file, 'w') as cfgfile:
+                self.__config.write(cfgfile)
+                cfgfile.flush()
+                os.fsync(cfgfile.fileno())
+            os.replace(temp_file, self.__config_file)
+        except OSError:
+            self.__logger.exception("Unable to write the config file")
             return
 
+        # Sync the directory too, so the rename itself survives a power cut
+        try:
+            dir_fd = os.open(os.path.dirname(os.path.abspath(self.__config_file)), os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        except OSError:
+            pass
+
+        self.__last_write_time = time.monotonic()
+        self.writes += 1
+
+        # Our own write isn't an edit to reload
+        self.__snapshot = self.ParseConfig(self.__config)
+        self.__file_stamp = self.__GetFileStamp()
+
+    def __UpdateConfigValues(self):
         if not self.__config.has_section("settings"):
             self.__config.add_section('settings')
 
-        self.__config.set('settings', 'tenor', str(self.bell_sounds.get_tenor()))
-        self.__config.set('settings', 'key', str(self.bell_sounds.get_valid_peal_index()))
+        tenor = None
+        key_index = None
+        # The bells are used unless the setting was just edited by hand, and the bells haven't been changed to it yet
+        if self.bell_sounds is not None:
+            if 'tenor' not in self.__unapplied_fields:
+                tenor = self.bell_sounds.get_tenor()
+            if 'key_index' not in self.__unapplied_fields:
+                key_index = self.bell_sounds.get_valid_peal_index()
+        # Before the bells are set up (e.g. writing the default config) use the current settings
+        if tenor is None:
+            tenor = self.tenor if 'tenor' in self.__unapplied_fields else self.num_bells
+        if key_index is None:
+            key_index = self.key_index
+
+        self.__config.set('settings', 'tenor', str(tenor))
+        self.__config.set('settings', 'key', str(key_index))
         self.__config.set('settings', 'logging_debug', str(self.logging_debug))
         self.__config.set('settings', 'play_mode', str(self.play_mode))
         self.__config.set('settings', 'device_name', self.device_name)
+        self.__config.set('settings', 'audio_backend', self.audio_backend)
+        self.__config.set('settings', 'strike_journal', str(self.strike_journal))
+        self.__config.set('settings', 'broadcast_multicast', self.broadcast_multicast)
+        self.__config.set('settings', 'broadcast_websocket', self.broadcast_websocket)
+        self.__config.set('settings', 'status_http', self.status_http)
 
         if not self.__config.has_section("delays"):
             self.__config.add_section('delays')
@@ -82,6 +227,20 @@ class Configuration:
         self.__config.set('delays', 'bell_11', str(self.default_delays[10]))
         self.__config.set('delays', 'bell_12', str(self.default_delays[11]))
 
+        for idx_photohead, photohead_config in enumerate(self.extra_photoheads):
+            section = "photohead_" + str(idx_photohead + 2)
+            if not self.__config.has_section(section):
+                self.__config.add_section(section)
+            self.__config.set(section, 'device_name', photohead_config.device_name)
+            if photohead_config.bell_offset is not None:
+                self.__config.set(section, 'bell_offset', str(photohead_config.bell_offset))
+                self.__config.remove_option(section, 'bell_map')
+            else:
+                self.__config.set(section, 'bell_map', ",".join(str(bell) for bell in photohead_config.bell_map))
+                self.__config.remove_option(section, 'bell_offset')
+            for idx in range(0, self.num_bells):
+                self.__config.set(section, 'bell_' + str(idx + 1), str(photohead_config.default_delays[idx]))
+
         if not self.__config.has_section("demo"):
             self.__config.add_section('demo')
 
@@ -91,65 +250,250 @@ class Configuration:
             self.__config.set('demo', place_notation_name, str(self.place_notation_array[idx_place_notation].string))
             self.__config.set('demo', add_tenor_name, str(self.place_notation_array[idx_place_notation].add_tenor))
 
-        self.__config.write(cfgfile)
-        cfgfile.close()
-
+    def RequestWrite(self):
+        # Mark the config as changed, to be written by the background writer
+        # Before the writer is started the config is written straight away
+        with self.__writer_condition:
+            if self.__writer_thread is None:
+                started = False
+            else:
+                started = True
+                self.__write_pending = True
+                self.__writer_condition.notify()
+        if not started:
+            self.WriteConfigFile()
 
-    def ConfigSectionMap(self, section):
-        # From: https://wiki.python.org/moin/ConfigParserExamples
-        dict1 = {}
-        options = self.__config.options(section)
-        for option in options:
-            try:
-                dict1[option] = self.__config.get(section, option)
-                if dict1[option] == -1:
-                    pass  # DebugPrint("skip: %s" % option)
-            except:
-                # print("exception on %s!" % option)
-                dict1[option] = None
-        return dict1
+    def StartBackgroundWriter(self):
+        # Start the thread that writes the config after RequestWrite, at most once every write_interval_s
+        with self.__writer_condition:
+            self.__stopping_writer = False
+            self.__writer_thread = threading.Thread(target=self.__RunBackgroundWriter, name="config_writer", daemon=True)
+            self.__writer_thread.start()
+
+    def StopBackgroundWriter(self):
+        # Stop the background writer, writing any pending changes first
+        with self.__writer_condition:
+            thread = self.__writer_thread
+            self.__stopping_writer = True
+            self.__writer_condition.notify()
+        if thread is not None:
+            thread.join()
+        with self.__writer_condition:
+            self.__writer_thread = None
+        self.Flush()
+
+    def Flush(self):
+        # Write any pending changes now, e.g. before shutting down
+        with self.__writer_condition:
+            pending = self.__write_pending
+            self.__write_pending = False
+        if pending:
+            self.WriteConfigFile()
 
+    def __RunBackgroundWriter(self):
+        with self.__writer_condition:
+            while not self.__stopping_writer:
+                if not self.__write_pending:
+                    self.__writer_condition.wait()
+                    continue
+
+                # Wait out the rest of the interval, so repeated changes are coalesced into one write
+                wait_s = self.__last_write_time + self.write_interval_s - time.monotonic()
+                if wait_s > 0:
+                    self.__writer_condition.wait(wait_s)
+                    continue
+
+                self.__write_pending = False
+                self.__writer_condition.release()
+                try:
+                    self.WriteConfigFile()
+                except Exception:
+                    self.__logger.exception("Error writing the config file")
+                finally:
+                    self.__writer_condition.acquire()
+
+
+    def __GetFileStamp(self):
+        try:
+            stat = os.stat(self.__config_file)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def CheckForChanges(self):
+        # Check if the config file has been changed since it was last loaded or written, a stat and no reading
+        # Also true if a write merged in edits that ReloadConfigFile hasn't returned yet
+        with self.__write_lock:
+            return self.__GetFileStamp() != self.__file_stamp or len(self.__unapplied_fields) > 0
+
+    def CheckPlaceNotation(self, place_notation_str, add_tenor):
+        # Check the place notation comes round without repeating a row
+        try:
+            result = check_place_notation(place_notation_str, add_tenor, self.max_demo_rows)
+        except Exception:
+            self.__logger.exception("Unable to compile place notation %s", place_notation_str)
+            return False
 
-    def LoadConfigFile(self):
-        self.__logger.info("Loading config file")
+        self.__logger.info("Place notation %s %s", place_notation_str, result.describe())
+        return result.is_true()
 
+    def __ParseInt(self, section, name, value, min_value, max_value):
+        if value is None:
+            return None
         try:
-            tenor = self.ConfigSectionMap("settings")['tenor']
-            if tenor is not None:
-                self.tenor = int(tenor)
-                self.__logger.info("Loaded tenor as %d", tenor)
-
-            key_index = self.ConfigSectionMap("settings")['key']
-            if key_index is not None:
-                self.key_index = int(key_index)
-                self.__logger.info("Loaded key_index as %d", key_index)
-
-            logging_debug = self.ConfigSectionMap("settings")['logging_debug']
-            if logging_debug is not None:
-                if logging_debug.lower() == 'true':
-                    self.logging_debug = True
+            number = int(value)
+        except ValueError:
+            self.__logger.info("Invalid %s %s in the [%s] section of the config, keeping the current value", name, value, section)
+            return None
+        if number < min_value or number > max_value:
+            self.__logger.info("The %s %d in the [%s] section of the config is not in the range %d - %d, keeping the current value",
+                               name, number, section, min_value, max_value)
+            return None
+        return number
+
+    def __ParseBool(self, section, name, value):
+        if value is None:
+            return None
+        if value.lower() == 'true':
+            return True
+        if value.lower() == 'false':
+            return False
+        self.__logger.info("Invalid %s %s in the [%s] section of the config, keeping the current value", name, value, section)
+        return None
+
+    def __ParseAddress(self, section, name, value):
+        # A host:port, or empty for none
+        if value is None:
+            return None
+        value = value.strip()
+        if value == "":
+            return value
+        host, separator, port = value.rpartition(':')
+        if not host or self.__ParseInt(section, name + " port", port, 0, 65535) is None:
+            self.__logger.info("Invalid %s %s in the [%s] section of the config, it should be host:port", name, value, section)
+            return None
+        return value
+
+    def __ParsePhotohead(self, section, values):
+        device_name = values.get('device_name')
+        if not device_name:
+            self.__logger.info("No device_name in the [%s] section of the config, the photohead is not used", section)
+            return None
+
+        bell_offset = self.__ParseInt(section, "bell_offset", values.get('bell_offset'), 0, self.num_bells - 1)
+        bell_map = None
+        if values.get('bell_map') is not None:
+            try:
+                bell_map = [int(bell) for bell in values['bell_map'].split(",")]
+            except ValueError:
+                bell_map = []
+            if len(bell_map) > self.num_bells or any(bell < 0 or bell > self.num_bells for bell in bell_map):
+                self.__logger.info("Invalid bell_map %s in the [%s] section of the config, the photohead is not used", values['bell_map'], section)
+                return None
+            bell_map += [0] * (self.num_bells - len(bell_map))
+
+        default_delays = [
+            self.__ParseInt(section, "delay", values.get('bell_' + str(idx + 1)), self.min_delay, self.max_delay) or self.min_delay
+            for idx in range(0, self.num_bells)]
+
+        return PhotoheadConfig(device_name, bell_offset, bell_map, default_delays)
+
+    def ParseConfig(self, config):
+        # Parse the settings from a ConfigParser into a ConfigSnapshot, mapping each section once
+        snapshot = ConfigSnapshot()
+
+        settings = {}
+        if config.has_section("settings"):
+            settings = dict(config.items("settings"))
+        snapshot.tenor = self.__ParseInt("settings", "tenor", settings.get('tenor'), 1, self.num_bells)
+        snapshot.key_index = self.__ParseInt("settings", "key", settings.get('key'), 0, len(valid_peal_definitions) - 1)
+        snapshot.logging_debug = self.__ParseBool("settings", "logging_debug", settings.get('logging_debug'))
+        snapshot.play_mode = self.__ParseBool("settings", "play_mode", settings.get('play_mode'))
+        if settings.get('device_name'):
+            snapshot.device_name = settings['device_name']
+        if settings.get('audio_backend'):
+            snapshot.audio_backend = settings['audio_backend']
+        snapshot.strike_journal = self.__ParseBool("settings", "strike_journal", settings.get('strike_journal'))
+        snapshot.broadcast_multicast = self.__ParseAddress("settings", "broadcast_multicast", settings.get('broadcast_multicast'))
+        snapshot.broadcast_websocket = self.__ParseAddress("settings", "broadcast_websocket", settings.get('broadcast_websocket'))
+        snapshot.status_http = self.__ParseAddress("settings", "status_http", settings.get('status_http'))
+
+        if config.has_section("delays"):
+            delays = dict(config.items("delays"))
+            snapshot.default_delays = tuple(
+                self.__ParseInt("delays", "delay", delays.get('bell_' + str(idx + 1)),
+                               self.min_delay, self.max_delay)
+                for idx in range(0, self.num_bells))
+
+        extra_photoheads = []
+        idx_photohead = 2
+        while config.has_section("photohead_" + str(idx_photohead)):
+            photohead_config = self.__ParsePhotohead("photohead_" + str(idx_photohead), dict(config.items("photohead_" + str(idx_photohead))))
+            if photohead_config is not None:
+                extra_photoheads.append(photohead_config.Key())
+            idx_photohead += 1
+        snapshot.extra_photoheads = tuple(extra_photoheads)
+
+        if config.has_section("demo"):
+            demo_section = dict(config.items("demo"))
+            demos = []
+            for idx_place_notation in range(0, self.num_place_notations):
+                place_notation_str = demo_section.get("place_notation_" + str(idx_place_notation + 1))
+                add_tenor = self.__ParseBool("demo", "add_tenor", demo_section.get("add_tenor_" + str(idx_place_notation + 1)))
+                if place_notation_str is None or add_tenor is None:
+                    demos.append(None)
                 else:
-                    self.logging_debug = False
-                self.__logger.info("Loaded logging debug as %s", logging_debug)
+                    demos.append((place_notation_str, add_tenor))
+            snapshot.demos = tuple(demos)
 
-            play_mode = self.ConfigSectionMap("settings")['play_mode']
-            if play_mode is not None:
-                if play_mode.lower() == 'true':
-                    self.play_mode = True
-                else:
-                    self.play_mode = False
-                self.__logger.info("Loaded play mode as %s", play_mode)
+        return snapshot
+
+    def ApplySnapshot(self, snapshot, fields=ConfigSnapshot.fields):
+        # Use the given settings from the snapshot, keeping the current value of any that are missing or invalid
+        if 'tenor' in fields and snapshot.tenor is not None:
+            self.tenor = snapshot.tenor
+            self.__logger.info("Loaded tenor as %d", self.tenor)
+
+        if 'key_index' in fields and snapshot.key_index is not None:
+            self.key_index = snapshot.key_index
+            self.__logger.info("Loaded key_index as %d", self.key_index)
+
+        if 'logging_debug' in fields and snapshot.logging_debug is not None:
+            self.logging_debug = snapshot.logging_debug
+            self.__logger.info("Loaded logging debug as %s", self.logging_debug)
+
+        if 'play_mode' in fields and snapshot.play_mode is not None:
+            self.play_mode = snapshot.play_mode
+            self.__logger.info("Loaded play mode as %s", self.play_mode)
+
+        if 'device_name' in fields and snapshot.device_name is not None:
+            self.device_name = snapshot.device_name
+            self.__logger.info("Loaded device name is %s", self.device_name)
+
+        if 'audio_backend' in fields and snapshot.audio_backend is not None:
+            self.audio_backend = snapshot.audio_backend
+            self.__logger.info("Loaded audio backend as %s", self.audio_backend)
+
+        if 'strike_journal' in fields and snapshot.strike_journal is not None:
+            self.strike_journal = snapshot.strike_journal
+            self.__logger.info("Loaded strike journal as %s", self.strike_journal)
+
+        if 'broadcast_multicast' in fields and snapshot.broadcast_multicast is not None:
+            self.broadcast_multicast = snapshot.broadcast_multicast
+            self.__logger.info("Loaded broadcast multicast as %s", self.broadcast_multicast or "none")
+
+        if 'broadcast_websocket' in fields and snapshot.broadcast_websocket is not None:
+            self.broadcast_websocket = snapshot.broadcast_websocket
+            self.__logger.info("Loaded broadcast WebSocket as %s", self.broadcast_websocket or "none")
 
-            device_name = self.ConfigSectionMap("settings")['device_name']
-            if device_name is not None:
-                self.device_name = device_name
-                self.__logger.info("Loaded device name is %s", device_name)
+        if 'status_http' in fields and snapshot.status_http is not None:
+            self.status_http = snapshot.status_http
+            self.__logger.info("Loaded status HTTP as %s", self.status_http or "none")
 
-            # Load the default delays
-            for idx in range(0, 12):
-                default_delay = self.ConfigSectionMap("delays")['bell_' + str(idx + 1)]
+        if 'default_delays' in fields and snapshot.default_delays is not None:
+            for idx, default_delay in enumerate(snapshot.default_delays):
                 if default_delay is not None:
-                    self.default_delays[idx] = int(default_delay)
+                    self.default_delays[idx] = default_delay
                 else:
                     self.__logger.info("Unable to load default delay for bell %d from the config", (idx + 1))
 
@@ -160,28 +504,80 @@ class Configuration:
                 self.default_delays[4], self.default_delays[5], self.default_delays[6], self.default_delays[7],
                 self.default_delays[8], self.default_delays[9], self.default_delays[10], self.default_delays[11])
 
-            # Load the demos to play - check they are present
-            place_notation = self.ConfigSectionMap("demo")['place_notation_1']
-            if place_notation is not None:
-                # Load all the configs we have
-                # Clear the current place notations as loading new ones
-                self.place_notation = []
-
-                for idx_place_notation in range(0, self.num_place_notations):
-                    place_notation_name = "place_notation_" + str(idx_place_notation + 1)
-                    add_tenor_name = "add_tenor_" + str(idx_place_notation + 1)
-
-                    place_notation = self.ConfigSectionMap("demo")[place_notation_name]
-                    add_tenor_str = self.ConfigSectionMap("demo")[add_tenor_name]
-
-                    if place_notation is None or add_tenor_str is None:
-                        self.__logger.info("Error loading place notation at %d, this will be dropped", idx_place_notation)
-                    else:
-                        if add_tenor_str.lower() == 'true':
-                            add_tenor = True
-                        else:
-                            add_tenor = False
-                        self.place_notation_array.append(place_notation(str(place_notation), add_tenor))
+        if 'extra_photoheads' in fields and snapshot.extra_photoheads is not None:
+            self.extra_photoheads = [PhotoheadConfig(*key) for key in snapshot.extra_photoheads]
+            for photohead_config in self.extra_photoheads:
+                self.__logger.info("Loaded photohead %s ringing bells %s", photohead_config.device_name,
+                                   ",".join(str(bell) for bell in photohead_config.bell_map))
 
+        if 'demos' in fields and snapshot.demos is not None:
+            # Keep the default for any demo that can't be used, so the demos stay on the same bells
+            # Only demos that differ from the current ones are checked, as checking can take a while
+            for idx_place_notation, demo in enumerate(snapshot.demos):
+                if demo is None:
+                    self.__logger.info("Error loading place notation at %d, keeping the default", idx_place_notation + 1)
+                    continue
+
+                current = self.place_notation_array[idx_place_notation]
+                place_notation_str, add_tenor = demo
+                if place_notation_str == current.string and add_tenor == current.add_tenor:
+                    continue
+
+                if not self.CheckPlaceNotation(place_notation_str, add_tenor):
+                    self.__logger.info("Rejected place notation %d, keeping the default", idx_place_notation + 1)
+                    continue
+
+                self.place_notation_array[idx_place_notation] = place_notation(place_notation_str, add_tenor)
+
+    def LoadConfigFile(self):
+        self.__logger.info("Loading config file")
+
+        try:
+            snapshot = self.ParseConfig(self.__config)
+            self.ApplySnapshot(snapshot)
         except Exception as e:
-            self.__logger.exception("Error loading config file")
\ No newline at end of file
+            self.__logger.exception("Error loading config file")
+            return
+
+        with self.__write_lock:
+            self.__snapshot = snapshot
+            self.__file_stamp = self.__GetFileStamp()
+
+    def ReloadConfigFile(self):
+        # Read the config file again after it has been edited, using any settings that have changed
+        # Returns the names of the changed settings (see ConfigSnapshot.fields), for the caller to act on
+        # including any edits already merged in by a write
+        with self.__write_lock:
+            changed = self.__unapplied_fields
+            self.__unapplied_fields = []
+            for field in self.__ReloadConfigFileLocked():
+                if field not in changed:
+                    changed.append(field)
+            return changed
+
+    def __ReloadConfigFileLocked(self):
+        # ReloadConfigFile, with the write lock held
+        stamp = self.__GetFileStamp()
+        if stamp == self.__file_stamp:
+            return []
+        config = configparser.ConfigParser()
+        try:
+            configsLoaded = config.read(self.__config_file)
+        except configparser.Error:
+            self.__logger.exception("Unable to parse the edited config file, keeping the current settings")
+            self.__file_stamp = stamp
+            return []
+        self.__file_stamp = stamp
+        if len(configsLoaded) != 1:
+            self.__logger.info("Unable to reload the config file, keeping the current settings")
+            return []
+
+        snapshot = self.ParseConfig(config)
+        changed = snapshot.ChangedFields(self.__snapshot)
+        self.__logger.info("Config file changed, reloading %s", ", ".join(changed) if changed else "nothing")
+
+        self.ApplySnapshot(snapshot, changed)
+        # Keep the edited file, including anything we don't know about, for the next write
+        self.__config = config
+        self.__snapshot = snapshot
+        return changed
@@ -0,0 +1,58 @@
+# Python class for running slow commands on a background thread
+
+import queue
+import threading
+import logging
+
+class command_worker:
+    """ Class to run commands that write to the SD card or the photohead on their own thread
+        Commands are run one at a time in the order they were submitted, so e.g. two key changes
+        can't interleave, while the keyboard hook and the event loop carry straight on
+    """
+    def __init__( self ):
+        """ Create the worker, commands are run on the calling thread until it is started
+        """
+        self.commands = queue.SimpleQueue()
+        self.thread = None
+
+        self.logger = logging.getLogger("PiBells")
+
+    def start( self ):
+        """ Start the worker thread
+        """
+        self.thread = threading.Thread( target = self.run, name = "command_worker", daemon = True )
+        self.thread.start()
+
+    def stop( self ):
+        """ Stop the worker thread once it has run everything already submitted
+        """
+        if self.thread is None:
+            return
+        self.commands.put( None )
+        self.thread.join()
+        self.thread = None
+
+    def submit( self, function, *args ):
+        """ Run function( *args ) on the worker thread, safe to call from any thread
+        """
+        if self.thread is None:
+            self.run_command( function, args )
+            return
+        self.commands.put( ( function, args ) )
+
+    def run( self ):
+        """ The thread body, run each command as it is submitted
+        """
+        while True:
+            command = self.commands.get()
+            if command is None:
+                return
+            self.run_command( *command )
+
+    def run_command( self, function, args ):
+        """ Run the command, logging any error so one bad command doesn't stop the worker
+        """
+        try:
+            function( *args )
+        except Exception:
+            self.logger.exception("Error running command %s", function.__name__)
@@ -0,0 +1,183 @@
+# Python class for compiling place notation into permutations, so any row can be found directly
+
+import functools
+
+def get_bell_index_from_char( character ):
+    """ Convert a character to a bell index
+        Converts 1-9 to bells 1-9, and 0, E, T to 10, 11 and 12
+        The index is then 1 less than the bell number, None if the character isn't a bell
+    """
+    bell = 0 #unset
+    if character.lower() == 'e':
+        bell = 11
+    elif character.lower() == 't':
+        bell = 12
+    elif  character == '0':
+        bell = 10
+    elif character >= '1' and character <= '9':
+        bell = int( character )
+
+    if bell != 0:
+        return bell - 1
+
+    return None
+
+def map_bell_index_to_char( bell_index ):
+    """ Return the char character for the given bell index
+    """
+    if bell_index == 11:
+        return "T"
+    if bell_index == 10:
+        return "E"
+    if bell_index == 9:
+        return "0"
+    if bell_index >= 0 and bell_index <= 8:
+        return str( ( bell_index+1) )
+    return ""
+
+def parse_place_notation( place_notation_str ):
+    """ Convert the place notation string into the fixed bell indexes for each change of a lead
+        Each change is a list starting with -1 (an invalid index, so an all change isn't empty) followed
+        by the indexes of the bells that make places
+        Returns the list of changes and the number of bells, None results in rounds on 12
+    """
+    if place_notation_str is None:
+        return [ list( range( 0, 12 ) ) ], 12 #every bell stays where it is, index offset to be 0 based
+
+    max_bell_index = 0
+    curr_fixed_bells = [-1]
+    changes = []
+    for character in place_notation_str:
+        if character.lower() == 'x':
+            #All change
+            if len( curr_fixed_bells ) > 1:
+                #write the current row if there are entries (if not, may be first)
+                changes.append( list(curr_fixed_bells) )
+                curr_fixed_bells = [-1]
+            changes.append( list(curr_fixed_bells) )
+        elif character == '.':
+            #New row - store current and reset
+            changes.append( list(curr_fixed_bells) )
+            curr_fixed_bells = [-1]
+        elif character == '-':
+            #Reflect what we already have, not including the last item in the array so far
+            changes.append( list(curr_fixed_bells) )
+            curr_fixed_bells = [-1]
+            for idx in range( len(changes)-2, -1, -1 ):
+                changes.append( list(changes[idx]) )
+        else:
+            #Get the bell index (number-1), handling 0, E, T for 10, 11, 12
+            bell_index = get_bell_index_from_char( character )
+            if bell_index is None:
+                continue
+            curr_fixed_bells.append( bell_index )
+
+            if bell_index > max_bell_index:
+                max_bell_index = bell_index
+
+    #Add in the last row if populated, a trailing x has already been written
+    if len( curr_fixed_bells ) > 1:
+        changes.append( list(curr_fixed_bells) )
+
+    if not changes:
+        raise ValueError( "No changes in the place notation " + repr( place_notation_str ) )
+
+    return changes, max_bell_index + 1
+
+def compose( first, second ):
+    """ Combine two permutations into one that has the effect of applying first then second
+        A permutation is a tuple where position idx of the new row takes the bell at position permutation[idx]
+    """
+    return tuple( first[idx] for idx in second )
+
+def change_permutation( fixed_bells, num_bells ):
+    """ Get the permutation for one change: bells that make places stay, the rest swap in pairs
+    """
+    permutation = list( range( 0, num_bells ) )
+    idx = 0
+    while idx < num_bells:
+        if idx in fixed_bells or idx+1 >= num_bells or idx+1 in fixed_bells:
+            #Making a place (a lone bell at the back can only lie still)
+            idx += 1
+            continue
+        permutation[ idx ], permutation[ idx+1 ] = idx+1, idx
+        idx += 2
+    return tuple( permutation )
+
+class compiled_method:
+    """ Class to hold a place notation compiled into immutable permutations
+        Rows are counted as in place_notation_processor.changes_count: rows 0 and 1 are rounds, then the
+        changes of the lead are applied in turn from row 2
+        The lead head of every lead in the course is precomputed, so any row is one composition away
+    """
+    def __init__( self, place_notation_str = None, add_tenor = False ):
+        """ Compile the place notation string
+            add_tenor, if there are an odd number of bells, add a tenor to cover
+        """
+        self.place_notation_str = place_notation_str
+        self.add_tenor = add_tenor
+
+        changes, self.num_bells = parse_place_notation( place_notation_str )
+
+        #Check for adding a tenor to an odd number of bells
+        self.tenor_added = False
+        if add_tenor and ( self.num_bells % 2 ):
+            self.num_bells += 1
+            self.tenor_added = True
+
+        #The parsed place notation, kept for printing
+        self.place_notation_array = tuple( tuple( change ) for change in changes )
+
+        self.rounds = tuple( range( 1, self.num_bells+1 ) )
+        identity = tuple( range( 0, self.num_bells ) )
+
+        #The permutation for each change in the lead, the covering tenor is always fixed
+        cover = ( self.num_bells - 1, ) if self.tenor_added else ()
+        self.changes = tuple( change_permutation( set( change ) | set( cover ), self.num_bells ) for change in changes )
+        self.lead_length = len( self.changes )
+
+        #The permutations from the lead head to each row of the lead, and to the next lead head
+        prefixes = [ identity ]
+        for change in self.changes:
+            prefixes.append( compose( prefixes[-1], change ) )
+        self.lead_prefixes = tuple( prefixes[:-1] )
+        self.lead_end = prefixes[-1]
+
+        #The lead heads of the plain course, until the lead end brings it back round
+        lead_heads = [ identity ]
+        lead_head = compose( identity, self.lead_end )
+        while lead_head != identity:
+            lead_heads.append( lead_head )
+            lead_head = compose( lead_head, self.lead_end )
+        self.lead_heads = tuple( lead_heads )
+        self.course_end = lead_head
+        self.course_leads = len( self.lead_heads )
+        self.course_length = self.course_leads * self.lead_length
+
+    def permutation( self, row ):
+        """ Get the permutation from rounds to the row
+        """
+        if row < 2:
+            return self.lead_prefixes[0]
+        #Row 2 is the first change of the lead, so row has row - 1 changes applied
+        lead, change = divmod( ( row - 1 ) % self.course_length, self.lead_length )
+        return compose( self.lead_heads[ lead ], self.lead_prefixes[ change ] )
+
+    def row( self, row ):
+        """ Get the bells (1 to num_bells) in the row, as changes_count counts rows
+        """
+        return compose( self.rounds, self.permutation( row ) )
+
+    def next_row( self, bells, row ):
+        """ Apply the change that gives row from the bells of the row before it
+        """
+        if row < 2:
+            return bells
+        return compose( bells, self.changes[ ( row - 2 ) % self.lead_length ] )
+
+@functools.lru_cache( maxsize = 32 )
+def compile_method( place_notation_str = None, add_tenor = False ):
+    """ Get the compiled method for the place notation, only compiling it the first time it is used
+        The compiled method is immutable, so it is shared by everything ringing the same notation
+    """
+    return compiled_method( place_notation_str, add_tenor )
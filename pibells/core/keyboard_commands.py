@@ -0,0 +1,121 @@
+# Python class for turning keyboard events into commands with a dispatch table
+
+import logging
+
+#What a key does, found once per scan code
+BELL = 0        #Plays a bell, or completes a chord
+DIRECTION = 1   #Up or down, completes a chord, otherwise treated as any other key
+COMMAND = 2     #Runs a command on its own
+MODIFIER = 3    #Held down, then a bell or direction completes the chord
+OTHER = 4       #Anything else
+
+#The bell for each key name, both the top row and the num-pad give the same names
+bell_key_names = { "1": 1, "2": 2, "3": 3, "4": 4, "5": 5, "6": 6, "7": 7, "8": 8, "9": 9, "0": 10,
+    "e": 11, "-": 11, "−": 11, "t": 12, "=": 12 }
+
+direction_key_names = { "up": +1, "down": -1 }
+
+class keyboard_commands:
+    """ Class to dispatch keyboard events to actions through tables, rather than asking the keyboard
+        library which of every key is pressed
+        The first time a scan code is seen, its name is looked up to classify it and the result is kept,
+        so every later event is a single dictionary lookup. Chords (e.g. m + bell) are a small state machine:
+        pressing a modifier holds it until it is released, and a bell or direction pressed while it is held
+        runs the modifier's action with that bell or direction
+        A bell on its own calls bell_action straight away on the calling (hook) thread, as playing only queues
+        the sound. Other actions are handed to run_fast (e.g. the event loop) or run_slow (e.g. a
+        command_worker, for anything that writes to the SD card or the photohead)
+    """
+    def __init__( self, bell_action, other_action, run_fast, run_slow ):
+        """ Create the dispatcher
+            bell_action - called with the bell number (1-12) for a bell key pressed on its own
+            other_action - called for any key that isn't a bell, command or modifier, including a direction
+                           pressed without a modifier
+            run_fast, run_slow - called with ( function, *args ) to run an action
+        """
+        self.bell_action = bell_action
+        self.other_action = other_action
+        self.run_fast = run_fast
+        self.run_slow = run_slow
+
+        #Key name to ( function, slow ) for commands, and for modifiers (called with the bell or direction)
+        self.commands = dict()
+        self.modifiers = dict()
+
+        #Scan code to ( kind, value ), filled in as keys are first seen
+        self.scan_codes = dict()
+
+        #The modifier being held down, if any
+        self.held_modifier = None
+
+        self.logger = logging.getLogger("PiBells")
+
+    def add_command( self, name, function, slow = False ):
+        """ Run function() when the key is pressed
+        """
+        self.commands[ name ] = ( function, slow )
+        self.scan_codes.clear()
+
+    def add_modifier( self, name, function, slow = False ):
+        """ Run function( bell or direction ) when a bell or direction key is pressed while the key is held
+        """
+        self.modifiers[ name ] = ( function, slow )
+        self.scan_codes.clear()
+
+    def classify( self, name ):
+        """ Work out what a key does from its name
+        """
+        if name is None:
+            return ( OTHER, None )
+        name = name.lower()
+        if name in self.modifiers:
+            return ( MODIFIER, name )
+        if name in self.commands:
+            return ( COMMAND, name )
+        if name in bell_key_names:
+            return ( BELL, bell_key_names[ name ] )
+        if name in direction_key_names:
+            return ( DIRECTION, direction_key_names[ name ] )
+        return ( OTHER, None )
+
+    def run( self, action, value = None ):
+        """ Run a ( function, slow ) action
+        """
+        function, slow = action
+        runner = self.run_slow if slow else self.run_fast
+        if value is None:
+            runner( function )
+        else:
+            runner( function, value )
+
+    def handle_event( self, event ):
+        """ Handle a keyboard event (down or up), as passed to a keyboard.hook callback
+        """
+        key = self.scan_codes.get( event.scan_code )
+        if key is None:
+            key = self.classify( event.name )
+            self.scan_codes[ event.scan_code ] = key
+        kind, value = key
+
+        if event.event_type == "up":
+            if kind == MODIFIER and self.held_modifier == value:
+                self.held_modifier = None
+            return
+
+        if kind == BELL:
+            if self.held_modifier is not None:
+                self.run( self.modifiers[ self.held_modifier ], value )
+            else:
+                self.bell_action( value )
+        elif kind == DIRECTION:
+            if self.held_modifier is not None:
+                self.run( self.modifiers[ self.held_modifier ], value )
+            else:
+                self.other_action()
+        elif kind == MODIFIER:
+            #Key repeat sends more downs while it is held, which just keep it held
+            self.held_modifier = value
+        elif kind == COMMAND:
+            self.run( self.commands[ value ] )
+        else:
+            self.other_action()
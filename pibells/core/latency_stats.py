@@ -0,0 +1,134 @@
+# Python classes for measuring the latency from a bell strike to its sound being played
+
+import bisect
+import logging
+
+#The stages a strike passes through, used as the index when recording a latency
+SERIAL_READ = 0     #From the byte arriving at the serial port to the strike being handled
+MUTING = 1          #Checking if the bell is muted
+MAPPING = 2         #Mapping the bell to the selected peal (map_bell_to_selected_peal)
+DISPATCH = 3        #Waiting on the queue for the audio dispatcher thread
+CHANNEL_ACQUIRE = 4 #Finding a mixer channel to play on
+PLAY = 5            #The call to play the sound on the channel
+TOTAL = 6           #From the byte arriving to the sound being handed to the mixer
+
+stage_names = ( "serial_read", "muting", "mapping", "dispatch", "channel_acquire", "play", "total" )
+
+def build_bucket_bounds():
+    """ Build the upper bounds (in ns) of the histogram buckets
+        Four buckets per doubling from 1us up to about 2s, so each bucket is within 19% of its neighbour
+    """
+    return [ int( 1000 * 2**( idx / 4 ) ) for idx in range( 0, 85 ) ]
+
+bucket_bounds_ns = build_bucket_bounds()
+
+class latency_histogram:
+    """ Class to hold a fixed bucket histogram of latencies
+        Recording is a binary search and an increment, so it is cheap enough to leave on all the time
+    """
+    def __init__( self ):
+        """ Create an empty histogram
+            The last bucket counts everything above the largest bound
+        """
+        self.counts = [0]*( len( bucket_bounds_ns ) + 1 )
+        self.count = 0
+        self.sum_ns = 0
+        self.max_ns = 0
+
+    def record( self, latency_ns ):
+        """ Record a single latency in ns
+        """
+        self.record_bucket( bisect.bisect_left( bucket_bounds_ns, latency_ns ), latency_ns )
+
+    def record_bucket( self, bucket, latency_ns ):
+        """ Record a single latency in ns, whose bucket has already been found
+        """
+        self.counts[ bucket ] += 1
+        self.count += 1
+        self.sum_ns += latency_ns
+        if latency_ns > self.max_ns:
+            self.max_ns = latency_ns
+
+    def merge( self, other ):
+        """ Add the counts from another histogram into this one
+        """
+        for idx in range( 0, len( self.counts ) ):
+            self.counts[idx] += other.counts[idx]
+        self.count += other.count
+        self.sum_ns += other.sum_ns
+        self.max_ns = max( self.max_ns, other.max_ns )
+
+    def percentile( self, percent ):
+        """ Get the upper bound (in ns) of the bucket holding the given percentile
+            Returns 0 if nothing has been recorded
+        """
+        if self.count == 0:
+            return 0
+        target = self.count * percent / 100
+        running = 0
+        for idx in range( 0, len( self.counts ) ):
+            running += self.counts[idx]
+            if running >= target:
+                break
+        if idx >= len( bucket_bounds_ns ):
+            return self.max_ns
+        #Never report more than the largest latency actually seen
+        return min( bucket_bounds_ns[idx], self.max_ns )
+
+class latency_stats:
+    """ Class to hold the latency histograms for every stage of every bell
+    """
+    def __init__( self, num_bells, name = None ):
+        """ Create the empty histograms for each stage and bell
+            name - what the latencies are for, e.g. a photohead's device name, included when logging
+        """
+        self.num_bells = num_bells
+        self.prefix = "Latency " if name is None else "Latency (" + name + ") "
+        self.reset()
+
+        self.logger = logging.getLogger("PiBells")
+
+    def record( self, stage, bell, latency_ns ):
+        """ Record the latency for a stage (e.g. SERIAL_READ) of the given bell (1-num_bells)
+            It is added to the bell's histogram and the running histogram of the stage for all bells
+        """
+        bucket = bisect.bisect_left( bucket_bounds_ns, latency_ns )
+        self.histograms[ stage ][ bell-1 ].record_bucket( bucket, latency_ns )
+        self.stage_histograms[ stage ].record_bucket( bucket, latency_ns )
+
+    def stage_histogram( self, stage ):
+        """ Get the running histogram for the stage combining all the bells, which must not be changed
+        """
+        return self.stage_histograms[ stage ]
+
+    def reset( self ):
+        """ Clear all the recorded latencies
+        """
+        self.histograms = [ [ latency_histogram() for bell in range( 0, self.num_bells ) ] for stage in stage_names ]
+        self.stage_histograms = [ latency_histogram() for stage in stage_names ]
+
+    def format_histogram( self, histogram ):
+        """ Format the p50/p95/p99/max of a histogram in ms for logging
+        """
+        return "n=%d p50=%.2fms p95=%.2fms p99=%.2fms max=%.2fms" % ( histogram.count,
+            histogram.percentile( 50 ) / 1e6, histogram.percentile( 95 ) / 1e6,
+            histogram.percentile( 99 ) / 1e6, histogram.max_ns / 1e6 )
+
+    def log_summary( self ):
+        """ Log a line per stage for all bells together
+        """
+        for stage in range( 0, len( stage_names ) ):
+            histogram = self.stage_histogram( stage )
+            if histogram.count == 0:
+                continue
+            self.logger.info("%s%s: %s", self.prefix, stage_names[ stage ], self.format_histogram( histogram ) )
+
+    def log_details( self ):
+        """ Log the summary followed by the total strike to sound latency for each bell
+        """
+        self.log_summary()
+        for bell in range( 1, self.num_bells+1 ):
+            histogram = self.histograms[ TOTAL ][ bell-1 ]
+            if histogram.count == 0:
+                continue
+            self.logger.info("%stotal for bell %d: %s", self.prefix, bell, self.format_histogram( histogram ) )
@@ -0,0 +1,114 @@
+# Python classes for logging through a bounded queue, so writing the log file never holds up a bell
+
+import copy
+import queue
+import logging
+import logging.handlers
+
+#Message arguments of these types can't change once logged, so the message can be formatted later on the writer thread
+immutable_arg_types = ( int, float, str, bool, bytes, type( None ) )
+
+class bounded_queue_handler( logging.handlers.QueueHandler ):
+    """ Class to put log records on a bounded queue for a logging.handlers.QueueListener to write out
+        Logging only costs creating the record and a put, which never blocks: when the queue is full the
+        record is dropped and counted, and the count is logged once there is room again
+        Records whose arguments are all simple values (e.g. "Playing sound index %d") are queued as they are
+        and formatted by the writer thread. Anything else is formatted straight away, as e.g. a list of
+        delays could change before the writer gets to it
+    """
+    def __init__( self, max_records = 10000 ):
+        """ Create the handler and its queue
+            max_records - the most records waiting to be written before any more are dropped
+        """
+        super().__init__( queue.Queue( max_records ) )
+        self.dropped = 0
+        self.dropped_reported = 0
+
+    def enqueue( self, record ):
+        """ Queue the record without blocking, counting it as dropped if the queue is full
+        """
+        try:
+            if self.dropped != self.dropped_reported:
+                self.queue.put_nowait( self.make_dropped_record( record ) )
+                self.dropped_reported = self.dropped
+            self.queue.put_nowait( record )
+        except queue.Full:
+            self.dropped += 1
+
+    def flush_dropped( self ):
+        """ Queue the report of any records dropped since the last report, waiting for room, e.g. when stopping
+        """
+        if self.dropped != self.dropped_reported:
+            self.queue.put( self.make_dropped_record( logging.makeLogRecord( { "name": "PiBells" } ) ) )
+            self.dropped_reported = self.dropped
+
+    def make_dropped_record( self, record ):
+        """ Make a warning record reporting the records dropped since the last report
+        """
+        dropped_record = logging.LogRecord( record.name, logging.WARNING, __file__, 0,
+            "Logging queue full, dropped %d log messages (%d in total)",
+            ( self.dropped - self.dropped_reported, self.dropped ), None )
+        dropped_record.created = record.created
+        dropped_record.msecs = record.msecs
+        return dropped_record
+
+    def prepare( self, record ):
+        """ Prepare the record to be queued, only formatting the message now if it has to be
+            The record is copied before it is changed, as any other handlers on the logger are passed the same record
+        """
+        format_exception = bool( record.exc_info )
+        format_message = record.args and not all( type( arg ) in immutable_arg_types for arg in record.args )
+        if not format_exception and not format_message:
+            return record
+
+        record = copy.copy( record )
+        if format_exception:
+            #The traceback refers to the live stack, so turn it into text now
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException( record.exc_info )
+            record.exc_info = None
+
+        if format_message:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+class blocking_stop_listener( logging.handlers.QueueListener ):
+    """ Class to write out the queued records, which waits for room on the queue to ask the thread to stop
+    """
+    def enqueue_sentinel( self ):
+        """ Queue the marker that stops the thread, once everything before it has been written
+        """
+        self.queue.put( self._sentinel )
+
+class log_writer:
+    """ Class to write the queued log records to the log file on a background thread
+    """
+    def __init__( self, file_handler, max_records = 10000 ):
+        """ Create the queue handler, to be added to the logger, and the listener writing to file_handler
+        """
+        self.handler = bounded_queue_handler( max_records )
+        self.listener = blocking_stop_listener( self.handler.queue, file_handler, respect_handler_level = True )
+        self.file_handler = file_handler
+        self.started = False
+
+    def start( self ):
+        """ Start writing the queued records
+        """
+        self.listener.start()
+        self.started = True
+
+    def stop( self ):
+        """ Write everything still queued and stop the writer thread
+        """
+        if not self.started:
+            return
+        self.handler.flush_dropped()
+        self.listener.stop()
+        self.started = False
+        self.file_handler.flush()
+
+    def dropped( self ):
+        """ Get the number of records dropped because the queue was full
+        """
+        return self.handler.dropped
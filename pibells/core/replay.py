@@ -0,0 +1,123 @@
+# Python class for replaying the bells recorded in the strike journal with their original timing
+
+import queue
+import threading
+import time
+import logging
+
+import numpy
+
+from pibells.core import strike_journal
+
+class journal_replay:
+    """ Class to replay the bells from one or more strike journal files, in place of the photohead
+        It behaves like serial_ingest: a thread puts ( bell, monotonic_ns, None ) events on the events queue at the
+        recorded times (scaled by the speed) and calls notify, so the runtime plays them through the same
+        muting, mapping and play_bell path as bells from the tower
+        Seeking is a binary search of the record times, so starting part way into a long session is instant
+    """
+    def __init__( self, file_names, speed = 1.0, start_offset_s = 0.0, sources = ( strike_journal.PHOTOHEAD, strike_journal.KEYBOARD ) ):
+        """ Open the journal files to replay, which should be from one session, in order
+            speed - 2.0 plays twice as fast, 0.5 half as fast
+            start_offset_s - seconds into the recording to start from
+            sources - which sources to replay, by default the bells rung rather than the demos
+        """
+        self.readers = [ strike_journal.strike_journal_reader( file_name ) for file_name in file_names ]
+        self.readers = [ reader for reader in self.readers if len( reader ) > 0 ]
+        if not self.readers:
+            raise ValueError( "No bells recorded in " + ", ".join( file_names ) )
+        self.speed = speed
+        self.sources = numpy.array( sources, dtype = numpy.uint8 )
+
+        #The first time in each file, to find the file to seek into
+        self.first_times_ns = numpy.array( [ reader.times_ns[0] for reader in self.readers ] )
+        self.start_ns = int( self.first_times_ns[0] )
+        self.end_ns = int( self.readers[-1].times_ns[-1] )
+
+        self.notify = None
+        self.finished = None
+        self.events = queue.SimpleQueue()
+
+        self.thread = None
+        self.keep_playing = False
+        self.wake = threading.Event()
+
+        #Where the replay will start or has got to, as ( file index, record index )
+        self.seek( start_offset_s )
+
+        self.logger = logging.getLogger("PiBells")
+
+    def duration_s( self ):
+        """ Get the length of the recording in seconds, at the recorded speed
+        """
+        return ( self.end_ns - self.start_ns ) / 1e9
+
+    def seek( self, offset_s ):
+        """ Set the replay to start from offset_s seconds into the recording, before starting
+        """
+        target_ns = self.start_ns + int( offset_s * 1e9 )
+        file_index = max( 0, int( numpy.searchsorted( self.first_times_ns, target_ns, side = "right" ) ) - 1 )
+        record_index = int( numpy.searchsorted( self.readers[ file_index ].times_ns, target_ns ) )
+        self.position = ( file_index, record_index )
+
+    def start( self ):
+        """ Start replaying from the current position
+        """
+        self.keep_playing = True
+        self.wake.clear()
+        self.thread = threading.Thread( target = self.run, name = "journal_replay", daemon = True )
+        self.thread.start()
+
+    def stop( self ):
+        """ Stop replaying and wait for the thread to finish
+        """
+        self.keep_playing = False
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def close( self ):
+        """ Nothing to release, the journals are unmapped when the readers are freed
+        """
+        pass
+
+    def run( self ):
+        """ The thread body, queue each bell at its time relative to the first bell replayed
+        """
+        file_index, record_index = self.position
+        replay_start_ns = None
+        recording_start_ns = None
+        count = 0
+
+        while self.keep_playing and file_index < len( self.readers ):
+            reader = self.readers[ file_index ]
+            #Only the wanted sources, found for the whole file at once
+            wanted = numpy.flatnonzero( numpy.isin( reader.sources[ record_index: ], self.sources ) ) + record_index
+            times_ns = reader.times_ns
+            bells = reader.bells
+
+            for idx in wanted:
+                recorded_ns = int( times_ns[ idx ] )
+                if replay_start_ns is None:
+                    replay_start_ns = time.monotonic_ns()
+                    recording_start_ns = recorded_ns
+
+                #Absolute deadlines, so the time taken to queue each bell doesn't add up into drift
+                deadline_ns = replay_start_ns + int( ( recorded_ns - recording_start_ns ) / self.speed )
+                wait_ns = deadline_ns - time.monotonic_ns()
+                if wait_ns > 0 and self.wake.wait( wait_ns / 1e9 ):
+                    break
+
+                self.events.put( ( int( bells[ idx ] ), time.monotonic_ns(), None ) )
+                count += 1
+                if self.notify is not None:
+                    self.notify()
+                self.position = ( file_index, idx + 1 )
+
+            file_index += 1
+            record_index = 0
+
+        self.logger.info("Replayed %d bells", count)
+        if self.keep_playing and self.finished is not None:
+            self.finished()
@@ -0,0 +1,220 @@
+# Python class for the event driven runtime that drives PiBells
+
+import asyncio
+import queue
+import time
+import logging
+
+from pibells.photohead.serial_ingest import serial_ingest
+from pibells.core.latency_stats import latency_histogram
+
+class pibells_runtime:
+    """ Class to own the asyncio event loop that drives PiBells
+        The photohead serial input, keyboard commands, command timeouts and demo timing all run on this
+        one loop, so nothing polls or sleeps while waiting for the next bell
+    """
+    def __init__( self ):
+        """ Create the runtime and its event loop, ready for the photohead and commands to be attached
+        """
+        self.loop = asyncio.new_event_loop()
+
+        self.photoheads = []
+        #The descriptors watched by the loop when not using the ingest thread, by photohead
+        self.photohead_fds = dict()
+        self.strike_handler = None
+        self.ingest = None
+
+        #While a delay message is part way through arriving the reader is paused for this long between checks,
+        #otherwise the partial message keeps the descriptor readable and the loop would spin
+        self.delay_message_poll_s = 0.01
+
+        #Keep references to the running command tasks, so they aren't garbage collected part way through
+        self.command_tasks = set()
+
+        #Called on the loop once it has stopped, before it is closed, e.g. to close network connections
+        self.stop_callbacks = []
+
+        #How late the loop runs a check due every stall_check_interval_s, see start_stall_monitor
+        self.stall_check_interval_s = 0.1
+        self.stall_check_due_ns = None
+        self.stalls = latency_histogram()
+
+        self.logger = logging.getLogger("PiBells")
+
+    def attach_photohead( self, photohead, strike_handler, use_ingest_thread = True ):
+        """ Watch the photohead serial port and call strike_handler( bell, strike_time_ns, photohead ) as soon as a bell arrives
+            strike_time_ns is the time.monotonic_ns() the bell arrived
+            Can be called for more than one photohead, they are all read together and share the strike_handler
+            use_ingest_thread - read the port on a dedicated serial_ingest thread that drains whole bursts at once,
+                                otherwise read a byte at a time on the loop
+            Returns True if the photohead is being watched, False otherwise (e.g. the port failed to open)
+        """
+        self.photoheads.append( photohead )
+        self.strike_handler = strike_handler
+
+        if photohead.fileno() is None:
+            self.logger.info("Photohead (%s) not connected, no bells will be read from it", photohead.device_name)
+            return False
+
+        if use_ingest_thread:
+            #One ingest thread reads every photohead, waking the loop once per batch of bells
+            if self.ingest is None:
+                self.ingest = serial_ingest( self.wake_for_strikes )
+                self.ingest.add_photohead( photohead )
+                self.ingest.start()
+            else:
+                self.ingest.add_photohead( photohead )
+            return True
+
+        self.photohead_fds[ photohead ] = photohead.fileno()
+        self.loop.add_reader( photohead.fileno(), self.on_photohead_readable, photohead )
+        return True
+
+    def attach_replay( self, replay, strike_handler ):
+        """ Play the bells from a journal_replay in place of the photohead, calling strike_handler( bell, strike_time_ns, None )
+            for each as it is replayed. The replay is read like the ingest thread, and stopped with the loop
+        """
+        self.strike_handler = strike_handler
+        self.ingest = replay
+        replay.notify = self.wake_for_strikes
+        replay.start()
+
+    def detach_photoheads( self ):
+        """ Stop watching all the photoheads, e.g. before connecting to different devices
+            Must be called on the loop. Any bells read but not yet handled are dropped
+        """
+        if self.ingest is not None:
+            self.ingest.stop()
+            self.ingest.close()
+            self.ingest = None
+        for fd in self.photohead_fds.values():
+            self.loop.remove_reader( fd )
+        self.photohead_fds.clear()
+        self.photoheads = []
+
+    def wake_for_strikes( self ):
+        """ Called from the ingest thread when bells have been queued, wakes the loop to play them
+        """
+        self.loop.call_soon_threadsafe( self.drain_strikes )
+
+    def drain_strikes( self ):
+        """ Handle every bell waiting on the ingest queue, in the order they arrived
+        """
+        if self.ingest is None:
+            #Detached since the ingest thread woke the loop
+            return
+        events = self.ingest.events
+        while True:
+            try:
+                bell, strike_time_ns, photohead = events.get_nowait()
+            except queue.Empty:
+                return
+            self.strike_handler( bell, strike_time_ns, photohead )
+
+    def on_photohead_readable( self, photohead ):
+        """ Called by the loop when there is data waiting on the photohead serial port
+            The reader is level triggered, so if more than one byte is waiting this will be called again straight away
+        """
+        bell = photohead.get_bell()
+        strike_time_ns = time.monotonic_ns()
+
+        if photohead.awaiting_delays:
+            #Only part of the delay message has arrived, wait for the rest before reading again
+            self.loop.remove_reader( self.photohead_fds[ photohead ] )
+            self.loop.call_later( self.delay_message_poll_s, self.resume_photohead_reader, photohead )
+            return
+
+        if bell:
+            self.strike_handler( bell, strike_time_ns, photohead )
+
+    def resume_photohead_reader( self, photohead ):
+        """ Start watching the photohead serial port again after pausing for a delay message
+        """
+        if photohead not in self.photohead_fds:
+            #Detached while paused
+            return
+        self.loop.add_reader( self.photohead_fds[ photohead ], self.on_photohead_readable, photohead )
+        #Check straight away, as the message may now be complete
+        self.on_photohead_readable( photohead )
+
+    def submit( self, function, *args ):
+        """ Run function( *args ) as a task on the loop
+            This is safe to call from any thread, e.g. the keyboard hook
+        """
+        self.loop.call_soon_threadsafe( self.create_command_task, function, args )
+
+    def create_command_task( self, function, args ):
+        """ Create the task for a submitted command, must be called on the loop
+        """
+        task = self.loop.create_task( self.run_command( function, args ) )
+        self.command_tasks.add( task )
+        task.add_done_callback( self.command_tasks.discard )
+
+    async def run_command( self, function, args ):
+        """ Run the command, logging any error so one bad command doesn't stop the loop
+        """
+        try:
+            function( *args )
+        except Exception:
+            self.logger.exception("Error running command %s", function.__name__)
+
+    def call_later( self, delay_s, function, *args ):
+        """ Call function( *args ) on the loop after delay_s seconds
+            Must be called on the loop. Returns a handle which can be cancelled
+        """
+        return self.loop.call_later( delay_s, function, *args )
+
+    def start_stall_monitor( self ):
+        """ Start measuring how late the loop runs a check due every stall_check_interval_s
+            Anything holding up the loop (e.g. a slow command) also holds up the bells, and shows up in stalls
+            The lateness includes the loop's timer resolution, about 1ms
+        """
+        self.stall_check_due_ns = time.monotonic_ns() + int( self.stall_check_interval_s * 1e9 )
+        self.loop.call_later( self.stall_check_interval_s, self.check_stall )
+
+    def check_stall( self ):
+        """ Record how late this check is, and schedule the next
+        """
+        now_ns = time.monotonic_ns()
+        self.stalls.record( max( 0, now_ns - self.stall_check_due_ns ) )
+        self.stall_check_due_ns = now_ns + int( self.stall_check_interval_s * 1e9 )
+        self.loop.call_later( self.stall_check_interval_s, self.check_stall )
+
+    def log_stalls( self ):
+        """ Log how late the loop has been running the stall checks
+        """
+        if self.stalls.count == 0:
+            return
+        self.logger.info("Loop stalls: n=%d p50=%.2fms p99=%.2fms max=%.2fms", self.stalls.count,
+            self.stalls.percentile( 50 ) / 1e6, self.stalls.percentile( 99 ) / 1e6, self.stalls.max_ns / 1e6 )
+
+    def add_stop_callback( self, function ):
+        """ Call function() once the loop has stopped, while it can still be used to close things
+        """
+        self.stop_callbacks.append( function )
+
+    def run( self ):
+        """ Run the loop until stop is called
+        """
+        try:
+            self.loop.run_forever()
+        finally:
+            for function in self.stop_callbacks:
+                try:
+                    function()
+                except Exception:
+                    self.logger.exception("Error stopping %s", function.__name__)
+            #Let anything closed above finish closing
+            self.loop.run_until_complete( asyncio.sleep( 0 ) )
+            if self.ingest is not None:
+                self.ingest.stop()
+                self.ingest.close()
+                self.ingest = None
+            for fd in self.photohead_fds.values():
+                self.loop.remove_reader( fd )
+            self.loop.close()
+
+    def stop( self ):
+        """ Stop the loop, safe to call from any thread
+        """
+        self.loop.call_soon_threadsafe( self.loop.stop )
@@ -0,0 +1,154 @@
+# Python class for serving the status and metrics of a running PiBells over HTTP
+
+import json
+import threading
+import logging
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from pibells.core.latency_stats import bucket_bounds_ns
+
+#Prometheus histograms get every 4th bucket bound, i.e. one per doubling from 1us to about 2s
+prometheus_bucket_step = 4
+
+metrics_content_type = "text/plain; version=0.0.4; charset=utf-8"
+status_content_type = "application/json"
+
+def format_labels( labels ):
+    """ Format a dict of labels for a Prometheus sample, e.g. {bell="1"}
+    """
+    if not labels:
+        return ""
+    return "{" + ",".join( '%s="%s"' % ( name, str( value ).replace( "\\", "\\\\" ).replace( '"', '\\"' ) )
+        for name, value in labels.items() ) + "}"
+
+def counter_lines( name, help_text, samples ):
+    """ Get the Prometheus text lines for a counter
+        samples - a list of ( labels dict, value )
+    """
+    lines = [ "# HELP %s %s" % ( name, help_text ), "# TYPE %s counter" % name ]
+    for labels, value in samples:
+        lines.append( "%s%s %d" % ( name, format_labels( labels ), value ) )
+    return lines
+
+def histogram_lines( name, help_text, histogram ):
+    """ Get the Prometheus text lines for a running latency_histogram, in seconds
+        The histogram can be recorded into by its own thread meanwhile: its counts are copied in one go,
+        and the count taken from the copy, so the buckets always add up
+    """
+    sum_ns = histogram.sum_ns
+    counts = list( histogram.counts )
+    lines = [ "# HELP %s %s" % ( name, help_text ), "# TYPE %s histogram" % name ]
+    running = 0
+    for idx in range( 0, len( bucket_bounds_ns ) ):
+        running += counts[ idx ]
+        if idx % prometheus_bucket_step == 0:
+            lines.append( '%s_bucket{le="%g"} %d' % ( name, bucket_bounds_ns[ idx ] / 1e9, running ) )
+    running += counts[ -1 ]
+    lines.append( '%s_bucket{le="+Inf"} %d' % ( name, running ) )
+    lines.append( "%s_sum %g" % ( name, sum_ns / 1e9 ) )
+    lines.append( "%s_count %d" % ( name, running ) )
+    return lines
+
+class status_request_handler( BaseHTTPRequestHandler ):
+    """ Class to answer a request with the latest bodies from the status_http that owns the server
+    """
+    def do_GET( self ):
+        status = self.server.status
+        path = self.path.split( "?" )[0]
+        if path in ( "/", "/status" ):
+            self.send_body( status.status_body, status_content_type )
+        elif path == "/metrics":
+            self.send_body( status.metrics_body, metrics_content_type )
+        else:
+            self.send_error( 404 )
+
+    def send_body( self, body, content_type ):
+        self.send_response( 200 )
+        self.send_header( "Content-Type", content_type )
+        self.send_header( "Content-Length", str( len( body ) ) )
+        self.end_headers()
+        self.wfile.write( body )
+
+    def log_message( self, format, *args ):
+        #Every scrape would fill the log, so only when debugging
+        logging.getLogger("PiBells").debug( "Status request from %s: " + format, self.address_string(), *args )
+
+class status_http:
+    """ Class to serve the JSON status (/status) and Prometheus metrics (/metrics) of PiBells
+        Requests are answered on the server's threads from bodies built in advance, so a scrape never
+        touches the bells, the loop or the dispatcher. The bodies are rebuilt once every refresh_interval_s
+        by the refresh thread, from the running counters and histograms kept by the threads that update them
+        as the bells are rung, and the status is only encoded again when it has changed
+        The sources are called on the refresh thread, so should only read or copy those running totals
+    """
+    def __init__( self, status_source, metrics_source, refresh_interval_s = 1.0 ):
+        """ Create the server, nothing is served until start is called
+            status_source - function returning the status, a dict that can be encoded as JSON
+            metrics_source - function returning the lines of the metrics, e.g. from counter_lines
+        """
+        self.status_source = status_source
+        self.metrics_source = metrics_source
+        self.refresh_interval_s = refresh_interval_s
+
+        #Replaced whole by the refresh thread, so the request threads always see a complete body
+        self.status = None
+        self.status_body = b"{}"
+        self.metrics_body = b""
+
+        self.server = None
+        self.server_thread = None
+        self.refresh_thread = None
+        self.stopping = threading.Event()
+
+        self.logger = logging.getLogger("PiBells")
+
+    def start( self, host, port ):
+        """ Start serving on host and port
+            Returns the port listened on, useful if port is 0
+            Raises OSError if the port can't be listened on
+        """
+        self.refresh()
+        self.server = ThreadingHTTPServer( ( host, port ), status_request_handler )
+        self.server.status = self
+        port = self.server.server_address[1]
+
+        self.stopping.clear()
+        self.server_thread = threading.Thread( target = self.server.serve_forever, name = "status_http", daemon = True )
+        self.server_thread.start()
+        self.refresh_thread = threading.Thread( target = self.run_refresh, name = "status_refresh", daemon = True )
+        self.refresh_thread.start()
+        self.logger.info("Serving the status and metrics on http://%s:%d/", host, port)
+        return port
+
+    def stop( self ):
+        """ Stop serving and wait for the threads to finish
+        """
+        self.stopping.set()
+        if self.refresh_thread is not None:
+            self.refresh_thread.join()
+            self.refresh_thread = None
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server_thread.join()
+            self.server = None
+            self.server_thread = None
+
+    def run_refresh( self ):
+        """ The refresh thread body, rebuild the bodies every refresh_interval_s
+        """
+        while not self.stopping.wait( self.refresh_interval_s ):
+            self.refresh()
+
+    def refresh( self ):
+        """ Rebuild the metrics, and the status if it has changed
+        """
+        try:
+            status = self.status_source()
+            if status != self.status:
+                self.status_body = json.dumps( status ).encode()
+                self.status = status
+            self.metrics_body = ( "\n".join( self.metrics_source() ) + "\n" ).encode()
+        except Exception:
+            #Keep serving the last bodies rather than stopping the thread
+            self.logger.exception("Error refreshing the status")
@@ -0,0 +1,182 @@
+# Python class for publishing every strike to other machines, over UDP multicast and WebSockets
+
+import socket
+import struct
+import base64
+import hashlib
+import asyncio
+import time
+import logging
+
+#Each message: version, bell (1-12), sequence number (wraps at 65536, to spot lost datagrams),
+#and the time of day the bell was struck in ns since the epoch, so machines with synced clocks can line up
+message_struct = struct.Struct( "<BBHq" )
+message_version = 1
+
+#The fixed header of a WebSocket binary frame carrying one message (FIN, binary opcode, unmasked length)
+websocket_frame_header = bytes( [ 0x82, message_struct.size ] )
+websocket_guid = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+class strike_broadcast:
+    """ Class to publish each strike to network subscribers, without ever holding up the strike path
+        Each strike is packed once into a 12 byte message. With multicast it is sent as one datagram,
+        which the kernel either queues or drops, for any number of listeners. Each WebSocket subscriber
+        has its own bounded queue drained by its own task, so a slow subscriber only fills its own queue,
+        and is disconnected when it is full rather than holding up the others
+        Everything, including publish, must be called on the event loop
+    """
+    def __init__( self, loop, subscriber_queue_size = 256 ):
+        """ Create the broadcaster, nothing is sent until multicast or the WebSocket server is started
+            subscriber_queue_size - the messages a WebSocket subscriber can fall behind before it is dropped
+        """
+        self.loop = loop
+        self.subscriber_queue_size = subscriber_queue_size
+
+        #Converts the monotonic strike times to the time of day
+        self.wall_offset_ns = time.time_ns() - time.monotonic_ns()
+        self.sequence = 0
+
+        self.multicast_transport = None
+        self.multicast_address = None
+
+        self.server = None
+        #The queue of each connected WebSocket subscriber, by its writer
+        self.subscribers = dict()
+
+        #Counts of what has been sent
+        self.published = 0
+        self.subscribers_dropped = 0
+
+        self.logger = logging.getLogger("PiBells")
+
+    async def start_multicast( self, group, port, interface = "0.0.0.0", ttl = 1 ):
+        """ Start sending each strike to the multicast group and port
+            interface - the address of the interface to send from, 127.0.0.1 to stay on this machine
+            ttl - how many routers the datagrams may cross, 1 keeps them on the local network
+        """
+        sock = socket.socket( socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP )
+        sock.setsockopt( socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl )
+        sock.setsockopt( socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1 )
+        sock.setsockopt( socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton( interface ) )
+        sock.setblocking( False )
+        self.multicast_transport, protocol = await self.loop.create_datagram_endpoint( asyncio.DatagramProtocol, sock = sock )
+        self.multicast_address = ( group, port )
+        self.logger.info("Broadcasting strikes to multicast %s:%d", group, port)
+
+    async def start_websocket( self, host, port ):
+        """ Start the WebSocket server on host and port, every connection is sent each strike
+            Returns the port listened on, useful if port is 0
+        """
+        self.server = await asyncio.start_server( self.handle_websocket, host, port )
+        port = self.server.sockets[0].getsockname()[1]
+        self.logger.info("Broadcasting strikes to WebSocket subscribers on %s:%d", host, port)
+        return port
+
+    def publish( self, bell, strike_time_ns ):
+        """ Publish a strike of bell at the time.monotonic_ns() strike_time_ns, never blocks
+        """
+        message = message_struct.pack( message_version, bell, self.sequence, strike_time_ns + self.wall_offset_ns )
+        self.sequence = ( self.sequence + 1 ) & 0xFFFF
+        self.published += 1
+
+        if self.multicast_transport is not None:
+            self.multicast_transport.sendto( message, self.multicast_address )
+
+        if self.subscribers:
+            frame = websocket_frame_header + message
+            dropped = []
+            for writer, messages in self.subscribers.items():
+                try:
+                    messages.put_nowait( frame )
+                except asyncio.QueueFull:
+                    dropped.append( writer )
+            for writer in dropped:
+                #Too far behind, drop it rather than buffer without limit
+                #Removed straight away, so it is only dropped once however many strikes come before its task finishes
+                self.subscribers.pop( writer )
+                self.subscribers_dropped += 1
+                self.logger.info("Dropping WebSocket subscriber %s, it has fallen %d strikes behind",
+                    writer.get_extra_info( "peername" ), self.subscriber_queue_size )
+                writer.transport.abort()
+
+    async def handle_websocket( self, reader, writer ):
+        """ Handle a WebSocket connection: the opening handshake, then send it strikes until it goes
+        """
+        peer = writer.get_extra_info( "peername" )
+        try:
+            request = await asyncio.wait_for( reader.readuntil( b"\r\n\r\n" ), 5 )
+        except ( asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError ):
+            writer.close()
+            return
+
+        key = None
+        for line in request.split( b"\r\n" ):
+            name, separator, value = line.partition( b":" )
+            if name.strip().lower() == b"sec-websocket-key":
+                key = value.strip()
+        if key is None:
+            writer.write( b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n" )
+            writer.close()
+            return
+
+        accept = base64.b64encode( hashlib.sha1( key + websocket_guid ).digest() )
+        writer.write( b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n" )
+
+        messages = asyncio.Queue( self.subscriber_queue_size )
+        self.subscribers[ writer ] = messages
+        self.logger.info("WebSocket subscriber %s connected, %d subscribers", peer, len( self.subscribers ) )
+
+        #Anything the subscriber sends (e.g. a close or ping) is ignored, but reading spots it going
+        watch = self.loop.create_task( self.watch_websocket( reader, writer ) )
+        try:
+            while not writer.is_closing():
+                frame = await messages.get()
+                writer.write( frame )
+                #Send everything queued before waiting for the socket to drain
+                while not messages.empty():
+                    writer.write( messages.get_nowait() )
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            watch.cancel()
+            #Already removed if it was dropped for falling behind
+            self.subscribers.pop( writer, None )
+            writer.close()
+            self.logger.info("WebSocket subscriber %s disconnected, %d subscribers", peer, len( self.subscribers ) )
+
+    async def watch_websocket( self, reader, writer ):
+        """ Read and discard anything the subscriber sends, closing the connection once it disconnects
+            The writer task is woken to finish up
+        """
+        try:
+            while await reader.read( 1024 ):
+                pass
+        except ConnectionError:
+            pass
+        writer.close()
+        messages = self.subscribers.get( writer )
+        if messages is not None and not messages.full():
+            messages.put_nowait( b"" )
+
+    def close( self ):
+        """ Stop the server and multicast, and disconnect the subscribers
+        """
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        for writer, messages in list( self.subscribers.items() ):
+            writer.transport.abort()
+            #Wake its task to finish up
+            if not messages.full():
+                messages.put_nowait( b"" )
+        if self.multicast_transport is not None:
+            self.multicast_transport.close()
+            self.multicast_transport = None
+
+    def log_summary( self ):
+        """ Log how many strikes have been published, and to how many subscribers
+        """
+        self.logger.info("Broadcast %d strikes, %d WebSocket subscribers, %d dropped for falling behind",
+            self.published, len( self.subscribers ), self.subscribers_dropped )
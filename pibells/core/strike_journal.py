@@ -0,0 +1,201 @@
+# Python classes for journaling every bell struck to disk as compact binary records, and reading them back
+
+import os
+import mmap
+import glob
+import time
+import struct
+import threading
+import logging
+
+#Where a bell came from
+PHOTOHEAD = 0
+KEYBOARD = 1
+DEMO = 2
+source_names = [ "photohead", "keyboard", "demo" ]
+
+#Each record: time.monotonic_ns(), source, raw bell (1-12), index of the sample played (-1 if none), muted flag
+#Padded to 16 bytes, so the records stay aligned for the 8 byte time
+record_struct = struct.Struct( "<qBBbB4x" )
+
+def build_record_dtype():
+    """ Build the NumPy dtype matching record_struct
+        NumPy is only imported here, when reading a journal, so it isn't needed to write one
+    """
+    import numpy
+    return numpy.dtype( {
+        "names": [ "time_ns", "source", "bell", "sample_index", "muted" ],
+        "formats": [ "<i8", "u1", "u1", "i1", "u1" ],
+        "offsets": [ 0, 8, 9, 10, 11 ],
+        "itemsize": record_struct.size } )
+
+#The file header: magic, record size, time.time_ns() and time.monotonic_ns() when the file was started
+#so the monotonic times can be turned into the time of day. Padded to a whole number of records
+journal_magic = b"PBJRNL01"
+header_struct = struct.Struct( "<8sIqq4x" )
+header_size = 2 * record_struct.size
+
+journal_extension = ".pbj"
+
+class strike_journal:
+    """ Class to append every bell to a journal file, cheap enough to leave on for a whole peal
+        Each file is preallocated to file_size_bytes and memory mapped, so adding a record is a struct
+        pack into the map, with no system call or allocation. The unwritten records are zero, which is how
+        the reader finds the end, even if PiBells stopped without closing the file
+        When a file is full the next one is started, and the oldest are deleted to keep max_files
+        Records can be added from any thread
+    """
+    def __init__( self, directory, file_size_bytes = 4*1024*1024, max_files = 20 ):
+        """ Create the journal, the first file is started by open
+            directory - where the journal files are kept, created if needed
+            file_size_bytes - the size of each file, 4MB is over 260000 bells, i.e. about 12 hours on 12
+            max_files - the most files to keep, including the current one
+        """
+        self.directory = directory
+        self.records_per_file = ( file_size_bytes - header_size ) // record_struct.size
+        self.file_size_bytes = header_size + self.records_per_file * record_struct.size
+        self.max_files = max_files
+
+        self.lock = threading.Lock()
+        self.file_name = None
+        self.file = None
+        self.map = None
+        self.count = 0
+        self.files_started = 0
+
+        self.logger = logging.getLogger("PiBells")
+
+    def open( self ):
+        """ Start a new journal file
+            Returns True if it is open, False if not, in which case bells are not journaled
+        """
+        with self.lock:
+            return self.start_file()
+
+    def close( self ):
+        """ Close the current journal file
+        """
+        with self.lock:
+            self.close_file()
+
+    def add( self, source, bell, sample_index, muted, time_ns ):
+        """ Add a bell to the journal
+            source - PHOTOHEAD, KEYBOARD or DEMO
+            bell - the raw bell number (1-12)
+            sample_index - the index of the sample played for the bell, None if it wasn't played
+            muted - True if the bell was muted (or not played because play mode is off)
+            time_ns - the time.monotonic_ns() the bell was struck, or for the demo when it was due
+        """
+        if sample_index is None:
+            sample_index = -1
+        with self.lock:
+            if self.map is None:
+                return
+            if self.count >= self.records_per_file:
+                if not self.start_file():
+                    return
+            record_struct.pack_into( self.map, header_size + self.count * record_struct.size,
+                time_ns, source, bell, sample_index, 1 if muted else 0 )
+            self.count += 1
+
+    def start_file( self ):
+        """ Close any current file and start the next, must hold the lock
+        """
+        self.close_file()
+        try:
+            os.makedirs( self.directory, exist_ok = True )
+            self.file_name = os.path.join( self.directory,
+                time.strftime( "strikes_%Y%m%d_%H%M%S" ) + "_%03d" % self.files_started + journal_extension )
+            self.files_started += 1
+            self.file = open( self.file_name, "w+b" )
+            #Allocate the blocks now, so a full SD card is found here rather than part way through a peal
+            if hasattr( os, "posix_fallocate" ):
+                os.posix_fallocate( self.file.fileno(), 0, self.file_size_bytes )
+            else:
+                self.file.truncate( self.file_size_bytes )
+            self.map = mmap.mmap( self.file.fileno(), self.file_size_bytes )
+        except OSError as e:
+            self.logger.error("Unable to start the strike journal (" + str( self.file_name ) + "): " + str(e) )
+            self.close_file()
+            return False
+
+        header_struct.pack_into( self.map, 0, journal_magic, record_struct.size, time.time_ns(), time.monotonic_ns() )
+        self.count = 0
+        self.logger.info("Journaling strikes to %s", self.file_name)
+        self.remove_old_files()
+        return True
+
+    def close_file( self ):
+        """ Close the current file, if any, must hold the lock
+        """
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def remove_old_files( self ):
+        """ Delete the oldest journal files, keeping max_files
+        """
+        for file_name in journal_files( self.directory )[ :-self.max_files ]:
+            try:
+                os.remove( file_name )
+            except OSError as e:
+                self.logger.error("Unable to remove old strike journal " + file_name + ": " + str(e) )
+
+def journal_files( directory ):
+    """ Get the journal files in the directory, oldest first
+    """
+    return sorted( glob.glob( os.path.join( directory, "*" + journal_extension ) ) )
+
+class strike_journal_reader:
+    """ Class to read a journal file, memory mapped so even a long session loads straight away
+        The records are a NumPy structured array over the file, and each field (e.g. bells) is a view
+        of it, so nothing is copied until it is used
+    """
+    def __init__( self, file_name ):
+        """ Open the journal file, raising ValueError if it isn't one
+            Needs NumPy, unlike writing the journal
+        """
+        import numpy
+        self.file_name = file_name
+        with open( file_name, "rb" ) as journal_file:
+            header = journal_file.read( header_struct.size )
+        if len( header ) < header_struct.size:
+            raise ValueError( file_name + " is too short to be a strike journal" )
+        magic, record_size, self.start_time_ns, self.start_monotonic_ns = header_struct.unpack( header )
+        if magic != journal_magic or record_size != record_struct.size:
+            raise ValueError( file_name + " is not a strike journal" )
+
+        all_records = numpy.memmap( file_name, dtype = build_record_dtype(), mode = "r", offset = header_size )
+        self.records = all_records[ :self.find_count( all_records ) ]
+
+        self.times_ns = self.records[ "time_ns" ]
+        self.sources = self.records[ "source" ]
+        self.bells = self.records[ "bell" ]
+        self.sample_indexes = self.records[ "sample_index" ]
+        self.muted = self.records[ "muted" ]
+
+    def find_count( self, records ):
+        """ Find the number of records written, by a binary search for the first unwritten (all zero) record
+        """
+        times_ns = records[ "time_ns" ]
+        low = 0
+        high = len( records )
+        while low < high:
+            middle = ( low + high ) // 2
+            if times_ns[ middle ] != 0:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def __len__( self ):
+        return len( self.records )
+
+    def wall_times_s( self ):
+        """ Get the time of day of each record, in seconds since the epoch (a new array)
+        """
+        return ( self.times_ns - self.start_monotonic_ns + self.start_time_ns ) / 1e9
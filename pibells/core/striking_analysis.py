@@ -0,0 +1,264 @@
+# Python classes for analysing the striking of a band against the rows the method should produce
+
+import array
+import math
+import logging
+
+from pibells.core.compiled_method import compile_method
+
+class bell_striking:
+    """ Class to hold the running striking statistics of one bell
+        Everything is a running sum or a fixed size ring buffer, so adding a strike is constant time
+        and nothing grows during a touch
+    """
+    def __init__( self, recent_size ):
+        """ Create the statistics, keeping the last recent_size deviations
+        """
+        self.recent = array.array( 'q', [0]*recent_size )
+        self.reset()
+
+    def reset( self ):
+        """ Clear the statistics for a new touch
+        """
+        self.recent_index = 0
+        self.recent_count = 0
+        #Index 0 is handstroke, 1 is backstroke
+        self.count = [0, 0]
+        self.sum_ns = [0, 0]
+        self.sum_sq_ms = [0.0, 0.0]
+        self.max_abs_ns = 0
+        self.clashes = 0
+        self.wrong_place = 0
+        self.missed = 0
+        self.extra = 0
+
+    def add( self, deviation_ns, stroke ):
+        """ Add the deviation of a strike from its ideal time
+        """
+        self.recent[ self.recent_index ] = deviation_ns
+        self.recent_index = ( self.recent_index + 1 ) % len( self.recent )
+        self.recent_count = min( self.recent_count + 1, len( self.recent ) )
+
+        self.count[ stroke ] += 1
+        self.sum_ns[ stroke ] += deviation_ns
+        self.sum_sq_ms[ stroke ] += ( deviation_ns / 1e6 ) ** 2
+        if abs( deviation_ns ) > self.max_abs_ns:
+            self.max_abs_ns = abs( deviation_ns )
+
+    def mean_ns( self, stroke ):
+        """ Get the mean deviation for the stroke (0 handstroke, 1 backstroke), 0 if not rung
+        """
+        if self.count[ stroke ] == 0:
+            return 0
+        return self.sum_ns[ stroke ] / self.count[ stroke ]
+
+    def rms_ms( self ):
+        """ Get the root mean square deviation over both strokes in ms
+        """
+        count = self.count[0] + self.count[1]
+        if count == 0:
+            return 0.0
+        return math.sqrt( ( self.sum_sq_ms[0] + self.sum_sq_ms[1] ) / count )
+
+    def recent_rms_ms( self ):
+        """ Get the root mean square deviation of the recent strikes in ms
+        """
+        if self.recent_count == 0:
+            return 0.0
+        total = 0.0
+        for idx in range( 0, self.recent_count ):
+            total += ( self.recent[ idx ] / 1e6 ) ** 2
+        return math.sqrt( total / self.recent_count )
+
+class striking_analysis:
+    """ Class to line up the strikes from the photohead with the rows of a method
+        Each strike is compared to where it should be if the row was evenly spaced: the row's start and the
+        gap between bells are fitted from the rows already rung, with an extra gap before each handstroke.
+        A strike is matched to the bell's place in the current row, or in the next row if that is nearer
+        its expected time, so a missed or extra blow is counted against the bell rather than putting every
+        later row out of step
+        The touch is assumed to start with the same two rows of rounds as place_notation_processor
+        This is called on the event loop for every strike, so the work per strike is constant and nothing grows
+    """
+    def __init__( self, num_bells = 12, recent_size = 64, clash_fraction = 0.3, handstroke_gap = 1.0 ):
+        """ Create the analysis, it does nothing until start is called
+            recent_size, the number of recent strikes kept for each bell
+            clash_fraction, strikes closer than this fraction of the bell gap are counted as a clash
+            handstroke_gap, the extra gap before each handstroke row, in bells
+        """
+        self.clash_fraction = clash_fraction
+        self.handstroke_gap = handstroke_gap
+        self.bells = [ bell_striking( recent_size ) for bell in range( 0, num_bells ) ]
+
+        self.active = False
+        self.method = None
+
+        self.logger = logging.getLogger("PiBells")
+
+    def start( self, place_notation_object, bell_gap_s = 0.2 ):
+        """ Start analysing a touch of the method
+            bell_gap_s, the expected time between bells, until it has been measured from the rows
+        """
+        self.method = compile_method( place_notation_object.string, place_notation_object.add_tenor )
+        self.name = place_notation_object.string
+        for bell in self.bells:
+            bell.reset()
+
+        self.row = 0
+        self.expected = self.method.rounds
+        self.positions = [-1]*( len( self.bells ) + 1 )
+        self.next_positions = [-1]*( len( self.bells ) + 1 )
+        self.update_places()
+        #Whether each bell (by bell number) has struck in the current row
+        self.struck = [False]*( len( self.bells ) + 1 )
+        self.place = 0 #the number of bells struck so far in the row
+        self.highest_place = -1
+
+        self.gap_ns = int( bell_gap_s * 1e9 )
+        self.row_start_ns = None #the fitted time of the first place of the row, None until the first strike
+        self.row_worst_ns = 0
+        #Running sums for fitting the row: the strike time less its place times the gap
+        self.row_fit_sum_ns = 0
+        self.row_first_ns = 0
+        self.last_strike_ns = None
+        self.last_bell = None
+
+        self.active = True
+        self.logger.info("Analysing the striking of %s", self.name )
+
+    def stop( self ):
+        """ Stop analysing and log the summary of the touch
+        """
+        if not self.active:
+            return
+        self.active = False
+        self.log_summary()
+
+    def update_places( self ):
+        """ Update the place (0 based) of each bell in the expected row and the row after, indexed by bell number
+        """
+        self.positions, self.next_positions = self.next_positions, self.positions
+        if self.row == 0:
+            self.fill_places( self.positions, self.expected )
+        self.fill_places( self.next_positions, self.method.next_row( self.expected, self.row + 1 ) )
+
+    def fill_places( self, positions, row ):
+        """ Set the place of each bell of the row in positions
+        """
+        for place, bell in enumerate( row ):
+            if bell < len( positions ):
+                positions[ bell ] = place
+
+    def next_row_start_ns( self ):
+        """ Get the predicted start of the next row: on by the row, and the handstroke gap if it is a handstroke
+        """
+        next_start_ns = self.row_start_ns + self.method.num_bells * self.gap_ns
+        if ( self.row + 1 ) % 2 == 0:
+            next_start_ns += int( self.handstroke_gap * self.gap_ns )
+        return next_start_ns
+
+    def add_strike( self, bell, strike_time_ns ):
+        """ Add a strike of the bell (1-12) at the time.monotonic_ns() strike_time_ns
+        """
+        if not self.active or bell < 1 or bell > len( self.bells ):
+            return
+
+        stats = self.bells[ bell-1 ]
+        stroke = self.row % 2 #handstroke rows are even, as the processor's gaps
+
+        #Clashes are counted against both bells
+        if self.last_strike_ns is not None and strike_time_ns - self.last_strike_ns < self.clash_fraction * self.gap_ns:
+            stats.clashes += 1
+            self.bells[ self.last_bell-1 ].clashes += 1
+        self.last_strike_ns = strike_time_ns
+        self.last_bell = bell
+
+        place = self.positions[ bell ]
+        if place < 0:
+            #Not ringing in this method, e.g. a tenor behind rung without a cover
+            return
+
+        if self.row_start_ns is None:
+            #The first strike sets the timing
+            self.row_start_ns = strike_time_ns - place * self.gap_ns
+            self.row_first_ns = strike_time_ns
+        elif self.place > 0:
+            #A strike nearer the bell's time in the next row starts that row, leaving any bells yet to strike missed
+            next_start_ns = self.next_row_start_ns()
+            next_place = self.next_positions[ bell ]
+            current_error_ns = abs( strike_time_ns - ( self.row_start_ns + place * self.gap_ns ) )
+            next_error_ns = abs( strike_time_ns - ( next_start_ns + next_place * self.gap_ns ) )
+            if next_error_ns < current_error_ns:
+                self.next_row()
+                place = next_place
+                stroke = self.row % 2
+            elif self.struck[ bell ]:
+                #A second blow in the row
+                stats.extra += 1
+                return
+
+        #Out of place if a bell due after it has already struck
+        if place < self.highest_place:
+            stats.wrong_place += 1
+        self.highest_place = max( self.highest_place, place )
+        self.struck[ bell ] = True
+
+        deviation_ns = strike_time_ns - ( self.row_start_ns + place * self.gap_ns )
+        stats.add( deviation_ns, stroke )
+        if abs( deviation_ns ) > abs( self.row_worst_ns ):
+            self.row_worst_ns = deviation_ns
+
+        if self.place == 0:
+            self.row_first_ns = strike_time_ns
+        self.row_last_ns = strike_time_ns
+        self.row_fit_sum_ns += strike_time_ns - place * self.gap_ns
+        self.place += 1
+        if self.place >= self.method.num_bells:
+            self.next_row()
+
+    def next_row( self ):
+        """ Finish the row, fitting its timing to predict the next one, and counting any bells that didn't strike as missed
+        """
+        num_bells = self.method.num_bells
+        self.logger.debug("Row %d, worst deviation %.1fms", self.row, self.row_worst_ns / 1e6 )
+
+        complete = self.place == num_bells
+        if not complete:
+            for bell in self.expected:
+                if bell < len( self.struck ) and not self.struck[ bell ]:
+                    self.bells[ bell-1 ].missed += 1
+
+        #Measure the bell gap from a complete row, averaged over the first rows then smoothed
+        #so one poor row doesn't throw it out
+        if complete and num_bells > 1:
+            row_gap_ns = ( self.row_last_ns - self.row_first_ns ) // ( num_bells - 1 )
+            if row_gap_ns > 0:
+                rows_averaged = min( self.row + 1, 8 )
+                self.gap_ns = ( ( rows_averaged - 1 ) * self.gap_ns + row_gap_ns ) // rows_averaged
+
+        #The row's fitted start from the bells that struck, then on to the next row
+        self.row_start_ns = self.row_fit_sum_ns // self.place
+        self.row_start_ns = self.next_row_start_ns()
+
+        self.row += 1
+        self.expected = self.method.next_row( self.expected, self.row )
+        self.update_places()
+        for bell in range( 0, len( self.struck ) ):
+            self.struck[ bell ] = False
+        self.place = 0
+        self.highest_place = -1
+        self.row_worst_ns = 0
+        self.row_fit_sum_ns = 0
+
+    def log_summary( self ):
+        """ Log the striking of each bell over the touch
+        """
+        if self.method is None:
+            return
+        self.logger.info("Striking of %s over %d rows, bell gap %.1fms", self.name, self.row, self.gap_ns / 1e6 )
+        for bell_index in range( 0, self.method.num_bells ):
+            stats = self.bells[ bell_index ]
+            hand_back_ms = ( stats.mean_ns( 0 ) - stats.mean_ns( 1 ) ) / 1e6
+            self.logger.info("Bell %d: rms %.1fms (recent %.1fms), max %.1fms, handstroke - backstroke %.1fms, clashes %d, out of place %d, missed %d, extra %d",
+                bell_index + 1, stats.rms_ms(), stats.recent_rms_ms(), stats.max_abs_ns / 1e6, hand_back_ms,
+                stats.clashes, stats.wrong_place, stats.missed, stats.extra )
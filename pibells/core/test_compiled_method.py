@@ -0,0 +1,119 @@
+# Tests for the compiled place notation, run with: python3 -m pytest pibells
+
+import unittest
+
+from pibells.configuration import Configuration
+from pibells.core.compiled_method import compile_method, parse_place_notation
+from pibells.core.place_notation_processor import place_notation_processor
+
+def reference_rows( place_notation_str, add_tenor, count ):
+    """ Get the first count rows by applying one change at a time, swapping the bells that don't make places
+        as place_notation_processor did before the methods were compiled
+    """
+    changes, num_bells = parse_place_notation( place_notation_str )
+    cover = []
+    if add_tenor and num_bells % 2:
+        num_bells += 1
+        cover = [ num_bells - 1 ]
+
+    bells = list( range( 1, num_bells + 1 ) )
+    rows = [ tuple( bells ), tuple( bells ) ]
+    while len( rows ) < count:
+        fixed = changes[ ( len( rows ) - 2 ) % len( changes ) ] + cover
+        new_bells = list( bells )
+        first_swap = True
+        for idx in range( 0, num_bells ):
+            if idx in fixed:
+                continue
+            if first_swap:
+                new_bells[ idx ] = bells[ idx + 1 ]
+            else:
+                new_bells[ idx ] = bells[ idx - 1 ]
+            first_swap = not first_swap
+        bells = new_bells
+        rows.append( tuple( bells ) )
+    return rows[ :count ]
+
+def processor_rows( place_notation_str, add_tenor, count ):
+    """ Get the first count rows by stepping a place_notation_processor a bell at a time
+    """
+    processor = place_notation_processor( place_notation_str, add_tenor )
+    rows = []
+    row = []
+    while len( rows ) < count:
+        bell = processor.get_next_bell()
+        if bell == -1:
+            continue
+        row.append( bell )
+        if len( row ) == processor.num_bells:
+            rows.append( tuple( row ) )
+            row = []
+    return rows
+
+def default_demos():
+    """ Get ( place notation, add tenor ) for each of the default demos, and plain rounds
+    """
+    demos = [ ( demo.string, demo.add_tenor ) for demo in Configuration( "unused.ini" ).place_notation_array ]
+    return demos + [ ( None, False ) ]
+
+class compiled_method_test( unittest.TestCase ):
+    def test_row_matches_stepping( self ):
+        for place_notation_str, add_tenor in default_demos():
+            with self.subTest( place_notation_str = place_notation_str, add_tenor = add_tenor ):
+                method = compile_method( place_notation_str, add_tenor )
+                #Past the end of the course, so it must come round and carry on
+                count = method.course_length + 2 * method.lead_length + 3
+                expected = reference_rows( place_notation_str, add_tenor, count )
+                self.assertEqual( processor_rows( place_notation_str, add_tenor, count ), expected )
+                self.assertEqual( [ method.row( row ) for row in range( 0, count ) ], expected )
+
+                bells = method.rounds
+                for row in range( 0, count ):
+                    bells = method.next_row( bells, row )
+                    self.assertEqual( bells, expected[ row ] )
+
+    def test_seek_matches_stepping( self ):
+        for place_notation_str, add_tenor in default_demos():
+            with self.subTest( place_notation_str = place_notation_str, add_tenor = add_tenor ):
+                method = compile_method( place_notation_str, add_tenor )
+                count = method.course_length + method.lead_length + 3
+                expected = reference_rows( place_notation_str, add_tenor, count + 2 )
+                processor = place_notation_processor( place_notation_str, add_tenor )
+                for row in range( 0, count ):
+                    processor.seek( row )
+                    self.assertEqual( tuple( processor.bells_array ), expected[ row ] )
+                    #Carrying on from the seek gives the following rows
+                    following = []
+                    while len( following ) < 2 * method.num_bells:
+                        bell = processor.get_next_bell()
+                        if bell != -1:
+                            following.append( bell )
+                    self.assertEqual( tuple( following ), expected[ row ] + expected[ row + 1 ] )
+
+    def test_lead_heads( self ):
+        for place_notation_str, add_tenor in default_demos():
+            with self.subTest( place_notation_str = place_notation_str, add_tenor = add_tenor ):
+                method = compile_method( place_notation_str, add_tenor )
+                count = method.course_length + 2
+                expected = reference_rows( place_notation_str, add_tenor, count )
+                for lead, lead_head in enumerate( method.lead_heads ):
+                    #Row 1 is the first lead head, each lead after it is lead_length rows on
+                    self.assertEqual( tuple( method.rounds[ idx ] for idx in lead_head ), expected[ 1 + lead * method.lead_length ] )
+                #The plain course comes back to rounds
+                self.assertEqual( expected[ 1 + method.course_length ], method.rounds )
+
+    def test_tenor_added( self ):
+        method = compile_method( "5.1.5.1.5-125", True )
+        self.assertTrue( method.tenor_added )
+        self.assertEqual( method.num_bells, 6 )
+        for row in range( 0, method.course_length ):
+            self.assertEqual( method.row( row )[ 5 ], 6 )
+
+    def test_rounds( self ):
+        method = compile_method( None )
+        self.assertEqual( method.num_bells, 12 )
+        for row in range( 0, 30 ):
+            self.assertEqual( method.row( row ), tuple( range( 1, 13 ) ) )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+# Tests for replaying the strike journal, run with: python3 -m pytest pibells
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from pibells.core import strike_journal
+from pibells.core.replay import journal_replay
+
+#Small files so the bells go across several of them
+records_per_file = 4
+start_ns = 1000000000
+gap_ns = 100000000
+
+class journal_replay_test( unittest.TestCase ):
+    def setUp( self ):
+        self.directory = tempfile.mkdtemp( prefix = "pibells_replay_test_" )
+
+    def tearDown( self ):
+        shutil.rmtree( self.directory )
+
+    def write_journal( self, bells, sources = None ):
+        """ Journal the bells gap_ns apart, returning the journal files in order
+        """
+        journal = strike_journal.strike_journal( self.directory,
+            file_size_bytes = strike_journal.header_size + records_per_file * strike_journal.record_struct.size )
+        self.assertTrue( journal.open() )
+        for idx, bell in enumerate( bells ):
+            source = sources[ idx ] if sources is not None else strike_journal.PHOTOHEAD
+            journal.add( source, bell, 0, False, start_ns + idx * gap_ns )
+        journal.close()
+        return strike_journal.journal_files( self.directory )
+
+    def play( self, replay ):
+        """ Replay everything from the current position, returning the bells in the order they were queued
+        """
+        finished = threading.Event()
+        replay.finished = finished.set
+        replay.start()
+        self.assertTrue( finished.wait( 10 ) )
+        replay.stop()
+        bells = []
+        while not replay.events.empty():
+            bell, time_ns, photohead = replay.events.get()
+            self.assertIsNone( photohead )
+            bells.append( bell )
+        return bells
+
+    def test_files_rotate( self ):
+        files = self.write_journal( range( 1, 11 ) )
+        self.assertEqual( len( files ), 3 )
+        replay = journal_replay( files )
+        self.assertAlmostEqual( replay.duration_s(), 0.9 )
+
+    def test_seek( self ):
+        files = self.write_journal( range( 1, 11 ) )
+        replay = journal_replay( files )
+        self.assertEqual( replay.position, ( 0, 0 ) )
+
+        #Exactly on a bell starts with it, between bells starts with the next
+        replay.seek( 0.5 )
+        self.assertEqual( replay.position, ( 1, 1 ) )
+        replay.seek( 0.45 )
+        self.assertEqual( replay.position, ( 1, 1 ) )
+        #The first bell of a file is found in that file, not at the end of the one before
+        replay.seek( 0.4 )
+        self.assertEqual( replay.position, ( 1, 0 ) )
+        #Between files is the end of the one before, which plays on into the next
+        replay.seek( 0.35 )
+        self.assertEqual( replay.position, ( 0, 4 ) )
+
+        #Before the start is the start
+        replay.seek( -5 )
+        self.assertEqual( replay.position, ( 0, 0 ) )
+
+    def test_seek_and_play( self ):
+        files = self.write_journal( range( 1, 11 ) )
+        replay = journal_replay( files, speed = 100, start_offset_s = 0.35 )
+        self.assertEqual( self.play( replay ), [ 5, 6, 7, 8, 9, 10 ] )
+
+    def test_seek_past_the_end( self ):
+        files = self.write_journal( range( 1, 11 ) )
+        replay = journal_replay( files, speed = 100 )
+        replay.seek( 60 )
+        self.assertEqual( replay.position, ( 2, 2 ) )
+        self.assertEqual( self.play( replay ), [] )
+
+    def test_sources( self ):
+        sources = [ strike_journal.PHOTOHEAD, strike_journal.DEMO, strike_journal.KEYBOARD, strike_journal.DEMO ]
+        files = self.write_journal( [ 1, 2, 3, 4 ], sources )
+        #The demos aren't replayed by default
+        self.assertEqual( self.play( journal_replay( files, speed = 100 ) ), [ 1, 3 ] )
+        self.assertEqual( self.play( journal_replay( files, speed = 100, sources = ( strike_journal.DEMO, ) ) ), [ 2, 4 ] )
+
+    def test_empty_journal( self ):
+        files = self.write_journal( [] )
+        self.assertEqual( len( files ), 1 )
+        with self.assertRaises( ValueError ):
+            journal_replay( files )
+
+    def test_not_a_journal( self ):
+        file_name = os.path.join( self.directory, "not_a_journal.pbj" )
+        with open( file_name, "wb" ) as not_a_journal:
+            not_a_journal.write( b"x" * 100 )
+        with self.assertRaises( ValueError ):
+            journal_replay( [ file_name ] )
+
+if __name__ == '__main__':
+    unittest.main()
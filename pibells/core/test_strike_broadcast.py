@@ -0,0 +1,61 @@
+# Tests for publishing strikes to subscribers, run with: python3 -m pytest pibells
+
+import asyncio
+import unittest
+
+from pibells.core.strike_broadcast import strike_broadcast, message_struct, websocket_frame_header
+
+class fake_transport:
+    """ Class standing in for a subscriber's transport, counting the aborts
+    """
+    def __init__( self ):
+        self.aborts = 0
+
+    def abort( self ):
+        self.aborts += 1
+
+class fake_writer:
+    """ Class standing in for a subscriber's StreamWriter, whose task never gets to run
+    """
+    def __init__( self ):
+        self.transport = fake_transport()
+
+    def get_extra_info( self, name ):
+        return ( "127.0.0.1", 1234 )
+
+class strike_broadcast_test( unittest.TestCase ):
+    def setUp( self ):
+        self.loop = asyncio.new_event_loop()
+        self.broadcast = strike_broadcast( self.loop, subscriber_queue_size = 2 )
+
+    def tearDown( self ):
+        self.loop.close()
+
+    def test_slow_subscriber_dropped_once( self ):
+        slow = fake_writer()
+        keeping_up = fake_writer()
+        slow_messages = asyncio.Queue( 2 )
+        keeping_up_messages = asyncio.Queue( 10 )
+        self.broadcast.subscribers[ slow ] = slow_messages
+        self.broadcast.subscribers[ keeping_up ] = keeping_up_messages
+
+        #More strikes after it is full, all before its task can finish
+        for bell in range( 1, 7 ):
+            self.broadcast.publish( bell, 0 )
+
+        self.assertEqual( self.broadcast.subscribers_dropped, 1 )
+        self.assertEqual( slow.transport.aborts, 1 )
+        self.assertEqual( list( self.broadcast.subscribers ), [ keeping_up ] )
+        self.assertEqual( slow_messages.qsize(), 2 )
+
+        #The others still get every strike, in order
+        bells = []
+        while not keeping_up_messages.empty():
+            frame = keeping_up_messages.get_nowait()
+            self.assertEqual( frame[ :len( websocket_frame_header ) ], websocket_frame_header )
+            bells.append( message_struct.unpack( frame[ len( websocket_frame_header ): ] )[1] )
+        self.assertEqual( bells, [ 1, 2, 3, 4, 5, 6 ] )
+        self.assertEqual( self.broadcast.published, 6 )
+
+if __name__ == '__main__':
+    unittest.main()
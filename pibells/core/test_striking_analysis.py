@@ -0,0 +1,76 @@
+# Tests for lining up strikes with the rows of a method, run with: python3 -m pytest pibells
+
+import unittest
+
+from pibells.core.placenotation import place_notation
+from pibells.core.compiled_method import compile_method
+from pibells.core.striking_analysis import striking_analysis
+
+gap_ns = 200000000
+
+def perfect_strikes( notation, rows ):
+    """ Get ( row, place, bell, time ns ) for evenly struck rows of the method, with the handstroke gap
+    """
+    method = compile_method( notation.string, notation.add_tenor )
+    strikes = []
+    bells = method.rounds
+    time_ns = 0
+    for row in range( 0, rows ):
+        bells = method.next_row( bells, row )
+        if row > 0 and row % 2 == 0:
+            time_ns += gap_ns
+        for place, bell in enumerate( bells ):
+            strikes.append( ( row, place, bell, time_ns ) )
+            time_ns += gap_ns
+    return strikes
+
+class striking_analysis_test( unittest.TestCase ):
+    def setUp( self ):
+        self.notation = place_notation( "x16x16x16x16x16x16", False )
+
+    def analyse( self, strikes ):
+        analysis = striking_analysis( 12 )
+        analysis.start( self.notation, gap_ns / 1e9 )
+        for row, place, bell, time_ns in strikes:
+            analysis.add_strike( bell, time_ns )
+        return analysis
+
+    def assert_even( self, analysis ):
+        """ Every bell that struck was exactly on time, so nothing was put out of step
+        """
+        for stats in analysis.bells[ :6 ]:
+            self.assertEqual( stats.max_abs_ns, 0 )
+            self.assertEqual( stats.wrong_place, 0 )
+
+    def test_even_striking( self ):
+        analysis = self.analyse( perfect_strikes( self.notation, 40 ) )
+        self.assertEqual( analysis.row, 40 )
+        self.assert_even( analysis )
+        self.assertEqual( sum( stats.missed + stats.extra for stats in analysis.bells ), 0 )
+
+    def test_missed_blow( self ):
+        strikes = [ strike for strike in perfect_strikes( self.notation, 40 ) if not ( strike[0] == 5 and strike[2] == 3 ) ]
+        analysis = self.analyse( strikes )
+        self.assertEqual( analysis.row, 40 )
+        self.assertEqual( [ stats.missed for stats in analysis.bells[ :6 ] ], [ 0, 0, 1, 0, 0, 0 ] )
+        self.assert_even( analysis )
+
+    def test_missed_last_blow_of_row( self ):
+        strikes = [ strike for strike in perfect_strikes( self.notation, 40 ) if not ( strike[0] == 7 and strike[1] == 5 ) ]
+        analysis = self.analyse( strikes )
+        self.assertEqual( analysis.row, 40 )
+        self.assertEqual( sum( stats.missed for stats in analysis.bells ), 1 )
+        self.assert_even( analysis )
+
+    def test_extra_blow( self ):
+        strikes = perfect_strikes( self.notation, 40 )
+        row, place, bell, time_ns = strikes[ 32 ]
+        strikes.insert( 33, ( row, place, bell, time_ns + gap_ns // 5 ) )
+        analysis = self.analyse( strikes )
+        self.assertEqual( analysis.row, 40 )
+        self.assertEqual( analysis.bells[ bell-1 ].extra, 1 )
+        self.assertEqual( sum( stats.missed for stats in analysis.bells ), 0 )
+        self.assert_even( analysis )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+# Tests for checking methods for truth, run with: python3 -m pytest pibells
+
+import unittest
+
+from pibells.core.truth import check_place_notation
+
+class check_place_notation_test( unittest.TestCase ):
+    def test_true_method( self ):
+        #The plain course of Plain Bob Minor
+        result = check_place_notation( "x16x16x16-12" )
+        self.assertTrue( result.came_round )
+        self.assertTrue( result.is_true() )
+        self.assertFalse( result.is_extent() )
+        self.assertEqual( result.rows, 60 )
+
+    def test_extent( self ):
+        #The plain course of Plain Bob Minimus rings all 24 rows on 4
+        result = check_place_notation( "x14x14-12" )
+        self.assertTrue( result.is_true() )
+        self.assertTrue( result.is_extent() )
+
+    def test_false_touch( self ):
+        #14 twice in a row undoes itself, so the sixth row repeats the fourth (4213)
+        result = check_place_notation( "x14.12.x14.14" )
+        self.assertTrue( result.came_round )
+        self.assertFalse( result.is_true() )
+        self.assertEqual( result.first_false_row, 6 )
+        self.assertEqual( result.first_false_bells, ( 4, 2, 1, 3 ) )
+
+    def test_max_rows( self ):
+        #Comes round on the 60th row, so one fewer gives up first
+        result = check_place_notation( "x16x16x16-12", max_rows = 59 )
+        self.assertFalse( result.came_round )
+        self.assertFalse( result.is_true() )
+        self.assertEqual( result.rows, 59 )
+        self.assertEqual( result.describe(), "does not come round within 59 rows" )
+
+        self.assertTrue( check_place_notation( "x16x16x16-12", max_rows = 60 ).is_true() )
+
+    def test_tenor_added( self ):
+        #Plain Bob Doubles with a covering tenor, which must not change the truth
+        result = check_place_notation( "5.1.5.1.5-125", True )
+        self.assertTrue( result.is_true() )
+        self.assertEqual( result.rows, 40 )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# Python classes for checking the truth of the rows generated from place notation
+
+from pibells.core.compiled_method import compile_method
+
+def pack_row( bells ):
+    """ Pack a row of bells (1 to 12) into a single int, one byte per bell
+        The int is built in C from the bytes, which is far cheaper to hash and store than a list or tuple
+    """
+    return int.from_bytes( bytes( bells ), 'big' )
+
+class truth_result:
+    """ Class (structure) to hold the outcome of checking a method or touch
+    """
+    def __init__( self, num_bells ):
+        """ Create the truth_result class for the number of bells
+        """
+        self.num_bells = num_bells
+        self.rows = 0 #rows rung from the first rounds until it came round, or until it gave up
+        self.came_round = False
+        self.first_false_row = None #the row number of the first repeated row, None if true
+        self.first_false_bells = None #the bells of that row
+
+    def is_true( self ):
+        """ A touch is true if it comes round without repeating any row
+        """
+        return self.came_round and self.first_false_row is None
+
+    def is_extent( self ):
+        """ An extent rings every possible row exactly once
+        """
+        extent = 1
+        for bell in range( 2, self.num_bells+1 ):
+            extent *= bell
+        return self.is_true() and self.rows == extent
+
+    def describe( self ):
+        """ Get a description of the result to log
+        """
+        if not self.came_round:
+            return "does not come round within %d rows" % self.rows
+        if self.first_false_row is not None:
+            return "is false, row %d (%s) is repeated" % ( self.first_false_row, "".join( str( bell ) for bell in self.first_false_bells ) )
+        return "is true and comes round after %d rows%s" % ( self.rows, ", an extent" if self.is_extent() else "" )
+
+class truth_checker:
+    """ Class to check rows for truth as they are streamed in
+        Every row seen is kept as a packed int in a set, so each row costs one hash and one lookup
+    """
+    def __init__( self, num_bells ):
+        """ Create the truth_checker, starting from rounds
+        """
+        self.num_bells = num_bells
+        self.rounds = pack_row( range( 1, num_bells+1 ) )
+        self.reset()
+
+    def reset( self ):
+        """ Forget all the rows, the first row is rounds
+        """
+        self.rows_seen = { self.rounds }
+        self.result = truth_result( self.num_bells )
+
+    def add_row( self, bells ):
+        """ Add the next row
+            Returns True while more rows are wanted, False once it has come round
+        """
+        row = pack_row( bells )
+        self.result.rows += 1
+        if row == self.rounds:
+            self.result.came_round = True
+            return False
+
+        if row in self.rows_seen:
+            if self.result.first_false_row is None:
+                self.result.first_false_row = self.result.rows
+                self.result.first_false_bells = tuple( bells )
+        else:
+            self.rows_seen.add( row )
+        return True
+
+def check_place_notation( place_notation_str, add_tenor = False, max_rows = 100000 ):
+    """ Step through the rows of the compiled place notation and check them until it comes round
+        max_rows, give up (not coming round) after this many rows
+        Returns a truth_result
+    """
+    method = compile_method( place_notation_str, add_tenor )
+    checker = truth_checker( method.num_bells )
+
+    #The same changes the demos ring, from the first change after rounds
+    bells = method.rounds
+    for row in range( 2, max_rows+2 ):
+        bells = method.next_row( bells, row )
+        if not checker.add_row( bells ):
+            break
+    return checker.result
@@ -0,0 +1,141 @@
+# Python class for calibrating the photohead delays from the timing of rounds
+
+import array
+import logging
+
+class delay_calibration:
+    """ Class to work out the photohead delays that would make rounds evenly struck
+        While the band rings rounds, each complete row is fitted with a straight line (place against time),
+        and how early or late each bell is from its place on the line is averaged over the rows.
+        The corrections are then in the photohead's units of 10ms, so they can all be written in one go
+        Rows that aren't rounds (a bell missed or out of order) are skipped rather than trying to line them up
+        Everything, including start and apply, must be called on the event loop, where the strikes are added
+    """
+    def __init__( self, num_supported_bells = 12, delay_step_ms = 10 ):
+        """ Create the calibration, it does nothing until start is called
+            delay_step_ms - the time one step of a photohead delay moves the bell by
+        """
+        self.num_supported_bells = num_supported_bells
+        self.delay_step_ms = delay_step_ms
+
+        #The strike times of the row being collected, preallocated for the largest stage
+        self.row_times = array.array( 'q', [0]*num_supported_bells )
+
+        self.active = False
+        self.stage = 0
+        self.reset()
+
+        self.logger = logging.getLogger("PiBells")
+
+    def reset( self ):
+        """ Clear everything collected
+        """
+        self.place = 0
+        self.rows = 0
+        self.rows_skipped = 0
+        self.offset_sum_ns = [0]*self.num_supported_bells
+
+    def start( self, stage ):
+        """ Start collecting rounds on stage bells
+        """
+        self.stage = min( max( stage, 2 ), self.num_supported_bells )
+        self.reset()
+        self.active = True
+        self.logger.info("Calibrating the photohead delays, ring rounds on %d", self.stage )
+
+    def stop( self ):
+        """ Stop collecting
+        """
+        self.active = False
+
+    def add_strike( self, bell, strike_time_ns ):
+        """ Add a strike of the bell (1-12) at the time.monotonic_ns() strike_time_ns
+        """
+        if not self.active:
+            return
+
+        if bell != self.place + 1:
+            #Out of rounds, skip the row and wait for the treble to start the next one
+            if self.place > 0:
+                self.rows_skipped += 1
+            self.place = 0
+            if bell != 1:
+                return
+
+        self.row_times[ self.place ] = strike_time_ns
+        self.place += 1
+        if self.place == self.stage:
+            self.add_row()
+            self.place = 0
+
+    def add_row( self ):
+        """ Fit the complete row and add each bell's offset from the fitted line
+        """
+        stage = self.stage
+        times = self.row_times
+        #Least squares fit of time = start + place * gap, relative to the treble to keep the numbers small
+        first_ns = times[0]
+        mean_place = ( stage - 1 ) / 2
+        mean_time = sum( times[ idx ] - first_ns for idx in range( 0, stage ) ) / stage
+        covariance = 0.0
+        variance = 0.0
+        for place in range( 0, stage ):
+            covariance += ( place - mean_place ) * ( times[ place ] - first_ns - mean_time )
+            variance += ( place - mean_place ) ** 2
+        gap = covariance / variance
+        start = mean_time - gap * mean_place
+
+        for place in range( 0, stage ):
+            self.offset_sum_ns[ place ] += times[ place ] - first_ns - ( start + gap * place )
+        self.rows += 1
+
+    def offsets_ms( self ):
+        """ Get the average offset of each bell from even striking in ms, positive is late
+        """
+        if self.rows == 0:
+            return [0.0]*self.stage
+        return [ self.offset_sum_ns[ idx ] / self.rows / 1e6 for idx in range( 0, self.stage ) ]
+
+    def corrected_delays( self, offsets_ms, current_delays, min_delay, max_delay, bell_map = None ):
+        """ Get the delays that would correct the offsets, a late bell needs a shorter delay
+            offsets_ms - the offset of each bell rung, from offsets_ms
+            current_delays - the delays (1-250) loaded from the photohead, for all the supported bells
+            bell_map - the bell rung for each bell the photohead sends, if they differ (see photohead_interface)
+        """
+        delays = list( current_delays )
+        for idx in range( 0, len( delays ) ):
+            bell = bell_map[ idx ] if bell_map is not None else idx + 1
+            if bell < 1 or bell > len( offsets_ms ):
+                continue
+            steps = int( round( offsets_ms[ bell - 1 ] / self.delay_step_ms ) )
+            delays[ idx ] = min( max( delays[ idx ] - steps, min_delay ), max_delay )
+        return delays
+
+    def apply( self, photoheads, min_rows = 20 ):
+        """ Set the corrected delays on each photohead and write them all in one go
+            Returns True if they were written, False if there aren't enough rows or the delays aren't loaded yet
+        """
+        if self.rows < min_rows:
+            self.logger.info("Only %d rows of rounds collected for the calibration (%d skipped), %d needed", self.rows, self.rows_skipped, min_rows )
+            return False
+        not_loaded = [ photohead for photohead in photoheads if not photohead.delays_loaded ]
+        if not_loaded:
+            for photohead in not_loaded:
+                self.logger.info("Unable to apply the calibration, the delays have not been loaded from %s", photohead.device_name)
+                photohead.read_delays_from_photohead()
+            return False
+
+        #Worked out once, so the offsets logged are the ones written
+        offsets_ms = self.offsets_ms()
+        self.logger.info("Calibration from %d rows (%d skipped), offsets in ms: %s", self.rows, self.rows_skipped,
+            ", ".join( "%d. %.1f" % ( idx + 1, offset ) for idx, offset in enumerate( offsets_ms ) ) )
+
+        for photohead in photoheads:
+            delays = self.corrected_delays( offsets_ms, photohead.current_delays, photohead.min_delay, photohead.max_delay, photohead.bell_map )
+            for idx in range( 0, self.num_supported_bells ):
+                photohead.current_delays[ idx ] = delays[ idx ]
+            if not photohead.write_delays_to_photohead():
+                return False
+
+        self.stop()
+        return True
@@ -2,17 +2,57 @@
 
 import serial
 import logging
-import datetime
+import time
+
+def build_bell_lookup():
+    """ Build the 256 entry table to convert a byte read from the photohead straight to a bell number
+        1-9 for bells 1-9
+        0   for bell 10
+        E   for bell 11
+        T   for bell 12
+        Every other byte is 0
+    """
+    table = [0]*256
+    for ascii_code in range( 49, 58 ): #ASCII 1-9
+        table[ ascii_code ] = ascii_code - 49 + 1
+    table[ 48 ] = 10 #ASCII 0
+    table[ 69 ] = 11 #ASCII E
+    table[ 84 ] = 12 #ASCII T
+    return bytes( table )
+
+bell_lookup = build_bell_lookup()
+
+def build_mapped_bell_lookup( bell_map ):
+    """ Build the lookup table for a photohead whose bells are rung as other bells, e.g. the back bells
+        bell_map - the bell rung for each bell number the photohead sends (12 entries), 0 to ignore that bell
+    """
+    return bytes( bell_map[ bell - 1 ] if bell else 0 for bell in bell_lookup )
 
 class photohead_interface:
     """ Class to handle interaction with the Photohead interface
     """
-    def __init__( self, device_name ):
+    def __init__( self, device_name, bell_map = None ):
         """ Create the class with the device name
+            bell_map - optionally the bell rung for each bell number (1-12) the photohead sends, 0 to ignore
+                       that bell, e.g. [ 7, 8, 9, 10, 11, 12, 0, 0, 0, 0, 0, 0 ] for a box on the back six
+                       The delays are always for the bell numbers the photohead sends
         """
         self.device_name = device_name
         self.con = None
         
+        #The bell rung for each byte read, so mapping costs nothing extra
+        self.bell_map = None
+        self.bell_lookup = bell_lookup
+        if bell_map is not None:
+            self.bell_map = list( bell_map )
+            self.bell_lookup = build_mapped_bell_lookup( self.bell_map )
+        
+        #Bytes read that aren't a bell or part of a delay message, e.g. line noise
+        self.unexpected_bytes = 0
+        
+        #The latency_stats for the bells from this photohead, if any
+        self.latency = None
+        
         #Photohead delay information
         #These are only loaded if required
         self.num_supported_bells = 12 #This is fixed, but duplicated in the main code
@@ -21,16 +61,30 @@ class photohead_interface:
         
         #Flag to say if the request for the delays has been sent
         self.awaiting_delays = False
-        #Will store the time of the initial request, to allow it to timeout
-        self.awaiting_time = None
+        #Will store the time.monotonic_ns() of the initial request, to allow it to timeout
+        self.awaiting_time_ns = None
         self.bytes_for_delays = ( self.num_supported_bells + 1 )
         self.photohead_response_time_s = 5
         self.delay_end_marker = 255 #0xFF
         
+        #The serial_ingest reading this photohead, if any, which then sends the request for the delays
+        self.ingest = None
+        
+        #Bytes that could be the start of the delay message when reading on the ingest thread, as ( byte, monotonic_ns )
+        self.delay_bytes = []
+        
         #The range of delays is from 1-250
         self.min_delay = 1
         self.max_delay = 250
         
+        #Time for one byte to arrive at 2400 baud (start bit, 8 data bits, stop bit)
+        #Used to work out when each byte of a batch arrived
+        self.baud_rate = 2400
+        self.byte_time_ns = ( 10 * 1000000000 ) // self.baud_rate
+        
+        #The delay message is sent in one go, so a byte not followed by another within this gap doesn't start it
+        self.delay_message_gap_ns = 5 * self.byte_time_ns
+        
         self.logger = logging.getLogger("PiBells")
         
     
@@ -39,7 +93,7 @@ class photohead_interface:
             Returns True if successfully connected, False otherwise
         """
         try: 
-            self.con = serial.Serial( self.device_name , 2400, timeout=0)
+            self.con = serial.Serial( self.device_name , self.baud_rate, timeout=0)
             value  = "\n\pi_bells\n\r By David Bagley 2019\n\r"
             self.con.write(bytes(value,'UTF-8'))
         except serial.serialutil.SerialException as e:
@@ -47,7 +101,26 @@ class photohead_interface:
             self.con = None
             return False
         return True
-    
+
+    def disconnect( self ):
+        """ Close the connection to the photohead interface, if open
+        """
+        if self.con is None:
+            return
+        try:
+            self.con.close()
+        except serial.serialutil.SerialException as e:
+            self.logger.error("Error closing serial port (" + self.device_name + "): " + str(e) )
+        self.con = None
+
+    def fileno( self ):
+        """ Get the file descriptor of the serial connection, so it can be watched for input
+            Returns None if not connected
+        """
+        if self.con is None:
+            return None
+        return self.con.fileno()
+
     def ascii_code_to_bell_number( self, ascii_code ):
         """ Convert the ASCII code to a bell number
             1-9 for bells 1-9
@@ -56,19 +129,11 @@ class photohead_interface:
             T   for bell 12
             Invalid input returns 0
         """
-        if ascii_code == 48: #ASCII 0
-            bell = 10
-        elif ascii_code == 69: #ASCII E
-            bell = 11
-        elif ascii_code == 84: #ASCII T
-            bell = 12
-        #Handle the digits 1-9
-        elif ascii_code >= 49 and ascii_code <= 57:
-            bell = ascii_code - 49 + 1
-        else:
+        bell = self.bell_lookup[ ascii_code ]
+        if not bell and not bell_lookup[ ascii_code ]:
             #unexpected data - log this?
+            self.unexpected_bytes += 1
             self.logger.info("Unexpected ASCII code to convert of %d",ascii_code)
-            bell = 0
         return bell
     
     def get_bell( self ):
@@ -108,6 +173,7 @@ class photohead_interface:
     def read_delays_from_photohead( self ):
         """ Initiates the loading of the delays from the photohead box
             Delays are only loaded if they haven't already been loaded since start up
+            When read on the ingest thread the request is handed to it, so only it changes the state of the request
         """
         if self.delays_loaded:
             return
@@ -117,11 +183,127 @@ class photohead_interface:
             #Don't set the waiting to True
             return
         
+        if self.ingest is not None:
+            self.ingest.request_delays( self )
+            return
+        
+        self.send_delay_request()
+    
+    def send_delay_request( self ):
+        """ Send the request for the delays, on the thread reading the photohead
+            Not sent again while waiting for the reply, as a second reply would be read as bells
+        """
+        if self.delays_loaded or self.awaiting_delays or self.con is None:
+            return
+        
+        #Set the flag before sending the request, so the reply can't be read before it is expected
+        self.delay_bytes = []
+        self.awaiting_time_ns = time.monotonic_ns()
+        self.awaiting_delays = True
+        
         #Request the data, using the byte 0xFE
         self.con.write( bytes.fromhex("FE") )
-        self.awaiting_delays = True
-        self.awaiting_time = datetime.datetime.now()
         return
+    
+    def decode_bytes( self, data, read_time_ns ):
+        """ Decode a batch of bytes read from the serial connection by the ingest thread
+            data - the bytes read in one go
+            read_time_ns - the time.monotonic_ns() when the read returned, i.e. when the last byte arrived
+            Returns a list of (bell, monotonic_ns, photohead) events, with the time each byte is estimated to have arrived
+            Any bytes belonging to a requested delay message are used for the delays, not returned as bells
+        """
+        if self.awaiting_delays:
+            return self.collect_delay_bytes( data, read_time_ns )
+        
+        events = []
+        lookup = self.bell_lookup
+        last_idx = len( data ) - 1
+        for idx, ascii_code in enumerate( data ):
+            bell = lookup[ ascii_code ]
+            if not bell:
+                if not bell_lookup[ ascii_code ]:
+                    self.unexpected_bytes += 1
+                    self.logger.info("Unexpected ASCII code to convert of %d",ascii_code)
+                continue
+            #Earlier bytes in the batch arrived one byte time apart before the last one
+            events.append( ( bell, read_time_ns - ( last_idx - idx ) * self.byte_time_ns, self ) )
+        return events
+    
+    def decode_byte( self, ascii_code, arrival_ns, events ):
+        """ Add the bell for a byte to the events, if it is one
+        """
+        bell = self.bell_lookup[ ascii_code ]
+        if bell:
+            events.append( ( bell, arrival_ns, self ) )
+        elif not bell_lookup[ ascii_code ]:
+            self.unexpected_bytes += 1
+            self.logger.info("Unexpected ASCII code to convert of %d",ascii_code)
+    
+    def collect_delay_bytes( self, data, read_time_ns ):
+        """ Look for the requested delay message in the bytes read on the ingest thread, decoding the rest as bells
+            The message is the 12 delays then 0xFF, sent in one go, and a delay can be the same byte as a bell
+            So bytes are held while they could still be the start of the message, and decoded as bells (with the time
+            they arrived) as soon as they can't be: once 12 are held without the end marker, or when the next byte
+            doesn't follow straight on
+            Returns a list of (bell, monotonic_ns, photohead) events, as decode_bytes
+        """
+        events = []
+        last_idx = len( data ) - 1
+        for idx, ascii_code in enumerate( data ):
+            arrival_ns = read_time_ns - ( last_idx - idx ) * self.byte_time_ns
+            if not self.awaiting_delays:
+                #The message ended earlier in this batch
+                self.decode_byte( ascii_code, arrival_ns, events )
+                continue
+            
+            if self.delay_bytes and arrival_ns - self.delay_bytes[ -1 ][ 1 ] > self.delay_message_gap_ns:
+                self.release_delay_bytes( events )
+            
+            if ascii_code == self.delay_end_marker and len( self.delay_bytes ) == self.num_supported_bells:
+                self.store_photohead_delays( bytes( held_code for held_code, held_ns in self.delay_bytes ) + bytes( [ ascii_code ] ) )
+                self.delay_bytes = []
+                continue
+            
+            self.delay_bytes.append( ( ascii_code, arrival_ns ) )
+            if len( self.delay_bytes ) > self.num_supported_bells:
+                #Too many to be followed by the end marker, so the first isn't part of the message
+                self.decode_byte( *self.delay_bytes.pop( 0 ), events )
+        return events
+    
+    def release_delay_bytes( self, events ):
+        """ Decode the bytes held for the delay message as bells, as they aren't part of it
+        """
+        for ascii_code, arrival_ns in self.delay_bytes:
+            self.decode_byte( ascii_code, arrival_ns, events )
+        self.delay_bytes = []
+    
+    def check_delay_bytes( self, now_ns ):
+        """ Called by the ingest thread when it wakes, to release the held bytes once nothing has followed them,
+            and to stop waiting for a delay message that hasn't arrived in time
+            Returns a list of (bell, monotonic_ns, photohead) events for any bells released
+        """
+        events = []
+        if not self.awaiting_delays:
+            return events
+        
+        if self.delay_bytes and now_ns - self.delay_bytes[ -1 ][ 1 ] > self.delay_message_gap_ns:
+            self.release_delay_bytes( events )
+        
+        if now_ns - self.awaiting_time_ns > self.photohead_response_time_s * 1000000000:
+            self.logger.info("Timed out waiting for the photohead delays after waiting for %d seconds", self.photohead_response_time_s )
+            self.release_delay_bytes( events )
+            self.awaiting_delays = False
+        return events
+    
+    def delay_wait_ns( self, now_ns ):
+        """ Get how long the ingest thread can wait before check_delay_bytes is needed, None if it isn't
+        """
+        if not self.awaiting_delays:
+            return None
+        wait_ns = self.awaiting_time_ns + self.photohead_response_time_s * 1000000000 - now_ns
+        if self.delay_bytes:
+            wait_ns = min( wait_ns, self.delay_bytes[ -1 ][ 1 ] + self.delay_message_gap_ns - now_ns )
+        return max( wait_ns, 0 )
 
     def process_photohead_delays( self ):
         """ Once the photohead delays have been requested, the next available data should be the delays
@@ -134,15 +316,18 @@ class photohead_interface:
         
         bytes_to_read = self.con.inWaiting()
         if bytes_to_read is not self.bytes_for_delays:
-            time_diff = datetime.datetime.now() - self.awaiting_time
-            if time_diff.total_seconds() > self.photohead_response_time_s:
+            if time.monotonic_ns() - self.awaiting_time_ns > self.photohead_response_time_s * 1000000000:
                 self.logger.info("Timed out waiting for the photohead delays after waiting for %d seconds, the bytes available are %d", self.photohead_response_time_s,bytes_to_read)
                 self.awaiting_delays = False
             return
         
         #Data available so read it here
         bytes_read = self.con.read( self.bytes_for_delays )
-        
+        self.store_photohead_delays( bytes_read )
+    
+    def store_photohead_delays( self, bytes_read ):
+        """ Check and store a complete delay message read from the photohead
+        """
         #Check the last byte read was 255, indicating the end of delays
         #If not, give up as message must be corrupted with a bell sound
         if bytes_read[self.bytes_for_delays-1] is not self.delay_end_marker:
@@ -166,6 +351,15 @@ class photohead_interface:
         self.awaiting_delays = False
         return
     
+    def get_photohead_bell( self, bell ):
+        """ Get the bell number the photohead sends (1-12) for the given bell rung, None if it isn't on this photohead
+        """
+        if self.bell_map is None:
+            return bell
+        if bell in self.bell_map:
+            return self.bell_map.index( bell ) + 1
+        return None
+    
     def set_delay( self, bell_number, delay ):
         """ Set the delay for the given bell as the current one
             bell_number - the bell number (1-self.num_supported_bells (12)) to write the delay for
@@ -187,7 +381,7 @@ class photohead_interface:
     def get_delays( self ):
         """ Get the current delays in a vector
         """
-        return self.current_delays()
+        return self.current_delays
     
     def write_delays_to_photohead( self ):
         """ Write the delays stored locally to the photohead box 
@@ -0,0 +1,174 @@
+# Python class for reading the photohead serial input on a dedicated thread
+
+import os
+import queue
+import selectors
+import threading
+import time
+import logging
+
+import serial
+
+class serial_ingest:
+    """ Class to read bells from the photohead on its own thread
+        The thread blocks until the serial port has data, then drains everything waiting in a single read,
+        so a burst of strikes costs one system call. Each byte is decoded and put on the events queue as a
+        (bell, monotonic_ns, photohead) tuple for the player
+        Any number of photoheads can be read by the one thread, the selector returns every one with data
+        waiting, so a busy photohead can't starve the others
+        A request for a photohead's delays is handed to the thread, which sends it and looks for the reply, so
+        the state of the request is only ever changed by the thread
+    """
+    def __init__( self, notify = None ):
+        """ Create the class, ready for the photoheads to be added
+            notify - optional function called from the ingest thread after each batch of events is queued,
+                     e.g. to wake the event loop
+        """
+        self.notify = notify
+        self.events = queue.SimpleQueue()
+
+        #Largest read in one go, far more than can arrive between reads at 2400 baud
+        self.read_size = 4096
+
+        self.selector = selectors.DefaultSelector()
+        #Pipe used to wake the thread when it is asked to stop, or to request the delays
+        self.wake_read_fd, self.wake_write_fd = os.pipe()
+        self.selector.register( self.wake_read_fd, selectors.EVENT_READ, None )
+        #The photoheads to send the request for the delays to, from other threads
+        self.delay_requests = queue.SimpleQueue()
+
+        self.thread = None
+        self.keep_reading = False
+
+        self.logger = logging.getLogger("PiBells")
+
+    def add_photohead( self, photohead ):
+        """ Add a connected photohead_interface to be read by the thread
+            Returns True if added, False if the photohead is not connected
+        """
+        fd = photohead.fileno()
+        if fd is None:
+            return False
+        self.selector.register( fd, selectors.EVENT_READ, photohead )
+        photohead.ingest = self
+        return True
+
+    def request_delays( self, photohead ):
+        """ Ask the thread to request the delays from the photohead, from any thread
+        """
+        self.delay_requests.put( photohead )
+        os.write( self.wake_write_fd, b"\0" )
+
+    def start( self ):
+        """ Start the ingest thread
+        """
+        self.keep_reading = True
+        self.thread = threading.Thread( target = self.run, name = "serial_ingest", daemon = True )
+        self.thread.start()
+
+    def stop( self ):
+        """ Stop the ingest thread and wait for it to finish
+        """
+        self.keep_reading = False
+        os.write( self.wake_write_fd, b"\0" )
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def close( self ):
+        """ Close the selector and wake pipe, once stopped
+        """
+        for key in self.selector.get_map().values():
+            if key.data is not None:
+                key.data.ingest = None
+        self.selector.close()
+        os.close( self.wake_read_fd )
+        os.close( self.wake_write_fd )
+
+    def run( self ):
+        """ The thread body, block until data is available and then read it
+            While waiting for a delay message the wait is limited, to release held bytes and time out the request
+        """
+        while self.keep_reading:
+            for key, mask in self.selector.select( self.wait_timeout_s() ):
+                if key.data is None:
+                    #Woken to stop, or to request the delays
+                    os.read( self.wake_read_fd, 1 )
+                    self.send_delay_requests()
+                    continue
+                self.read_photohead( key.fd, key.data )
+            self.check_delay_messages()
+
+    def photoheads( self ):
+        """ Get the photoheads being read
+        """
+        return [ key.data for key in self.selector.get_map().values() if key.data is not None ]
+
+    def wait_timeout_s( self ):
+        """ Get the longest the selector can wait before a photohead needs checking for its delay message,
+            None to wait for data
+        """
+        now_ns = time.monotonic_ns()
+        wait_ns = None
+        for photohead in self.photoheads():
+            photohead_wait_ns = photohead.delay_wait_ns( now_ns )
+            if photohead_wait_ns is not None and ( wait_ns is None or photohead_wait_ns < wait_ns ):
+                wait_ns = photohead_wait_ns
+        if wait_ns is None:
+            return None
+        return wait_ns / 1e9
+
+    def send_delay_requests( self ):
+        """ Send the requests for the delays handed to the thread
+        """
+        while True:
+            try:
+                photohead = self.delay_requests.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                photohead.send_delay_request()
+            except serial.serialutil.SerialException as e:
+                self.logger.error("Unable to request the delays from photohead (" + photohead.device_name + "): " + str(e) )
+
+    def check_delay_messages( self ):
+        """ Queue any bells released by the photoheads waiting for a delay message
+        """
+        now_ns = time.monotonic_ns()
+        events = []
+        for photohead in self.photoheads():
+            events += photohead.check_delay_bytes( now_ns )
+        self.queue_events( events )
+
+    def read_photohead( self, fd, photohead ):
+        """ Read everything waiting from the photohead and queue the decoded bells
+        """
+        try:
+            data = os.read( fd, self.read_size )
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self.logger.error("Error reading from photohead (" + photohead.device_name + "), it will no longer be read: " + str(e) )
+            self.selector.unregister( fd )
+            return
+        read_time_ns = time.monotonic_ns()
+
+        if not data:
+            #End of file, e.g. the device has been unplugged
+            self.logger.error("Photohead (" + photohead.device_name + ") closed, it will no longer be read")
+            self.selector.unregister( fd )
+            return
+
+        self.queue_events( photohead.decode_bytes( data, read_time_ns ) )
+
+    def queue_events( self, events ):
+        """ Queue the decoded bells for the player and wake it
+        """
+        if not events:
+            return
+
+        for event in events:
+            self.events.put( event )
+
+        if self.notify is not None:
+            self.notify()
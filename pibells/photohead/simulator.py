@@ -0,0 +1,151 @@
+# Python class for simulating the photohead box on a pseudo-terminal, so PiBells can be run without a tower
+
+import os
+import pty
+import tty
+import random
+import select
+import threading
+import time
+import logging
+
+from pibells.core.compiled_method import compile_method
+
+#The ASCII code the photohead sends for each bell, indexed by bell number - 1
+bell_codes = b"1234567890ET"
+
+class photohead_simulator:
+    """ Class to behave like the photohead box on the other end of a pty
+        The slave end (device_name) is opened by photohead_interface exactly like the real serial port.
+        Bells are sent as their ASCII codes at the requested stage and speed, ringing rounds or a method,
+        with the handstroke gap and some random jitter. It also answers the 0xFE request for the delays and
+        stores any 13 byte delay message (12 delays and 0xFF) written to it
+    """
+    def __init__( self, stage = 8, changes_per_minute = 30, jitter_ms = 5, place_notation_str = None, add_tenor = False ):
+        """ Create the simulator and its pty
+            stage - the number of bells ringing, when ringing rounds
+            changes_per_minute - the number of rows a minute, about 30 is normal ringing
+            jitter_ms - the standard deviation of each strike from its even time
+            place_notation_str - the method to ring, or None for rounds on stage
+        """
+        self.master_fd, self.slave_fd = pty.openpty()
+        #No echo or line ending translation, the photohead sends and receives raw bytes
+        tty.setraw( self.slave_fd )
+        self.device_name = os.ttyname( self.slave_fd )
+
+        self.jitter_ms = jitter_ms
+        self.set_method( place_notation_str, add_tenor, stage )
+        self.set_rate( changes_per_minute )
+
+        #The delays held by the "box", as the real one defaults to the minimum
+        self.delays = [1]*12
+        self.delays_written = 0
+        self.received = bytearray()
+
+        #Counts of what has been sent
+        self.strikes_sent = 0
+        self.bytes_late = 0
+
+        self.thread = None
+        self.running = False
+
+        self.logger = logging.getLogger("PiBells")
+
+    def set_method( self, place_notation_str, add_tenor = False, stage = 8 ):
+        """ Set the method to ring from the next row, None for rounds on stage
+        """
+        if place_notation_str is None:
+            self.method = None
+            self.stage = stage
+            self.row = tuple( range( 1, stage+1 ) )
+        else:
+            self.method = compile_method( place_notation_str, add_tenor )
+            self.stage = self.method.num_bells
+            self.row = self.method.rounds
+        self.row_number = 0
+
+    def set_rate( self, changes_per_minute ):
+        """ Set the speed of the ringing, the gap between bells allows for the handstroke gap
+        """
+        self.changes_per_minute = changes_per_minute
+        self.bell_gap_s = 60.0 / changes_per_minute / ( self.stage + 0.5 )
+
+    def strikes_per_second( self ):
+        """ Get the average number of bells sent a second at the current speed
+        """
+        return self.changes_per_minute * self.stage / 60.0
+
+    def start( self ):
+        """ Start the thread that sends the bells and answers the requests
+        """
+        self.running = True
+        self.thread = threading.Thread( target = self.run, name = "photohead_simulator", daemon = True )
+        self.thread.start()
+
+    def stop( self ):
+        """ Stop sending and close the pty
+        """
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        os.close( self.master_fd )
+        os.close( self.slave_fd )
+
+    def run( self ):
+        """ The thread body, send each bell at its time and handle anything written by PiBells in between
+        """
+        #The even time of the next bell, and the time it is actually sent once jittered
+        even_s = time.monotonic()
+        next_s = even_s
+        place = 0
+        while self.running:
+            timeout_s = max( 0.0, next_s - time.monotonic() )
+            readable, writable, errored = select.select( [ self.master_fd ], [], [], timeout_s )
+            if readable:
+                self.handle_input( os.read( self.master_fd, 1024 ) )
+                continue
+
+            now_s = time.monotonic()
+            if now_s < next_s:
+                continue
+            if now_s - next_s > self.bell_gap_s:
+                self.bytes_late += 1
+
+            bell = self.row[ place ]
+            os.write( self.master_fd, bell_codes[ bell-1:bell ] )
+            self.strikes_sent += 1
+
+            place += 1
+            even_s += self.bell_gap_s
+            if place >= self.stage:
+                place = 0
+                self.next_row()
+                if self.row_number % 2 == 0:
+                    #Handstroke gap
+                    even_s += self.bell_gap_s
+            next_s = even_s + ( random.gauss( 0, self.jitter_ms / 1000 ) if self.jitter_ms else 0 )
+
+    def next_row( self ):
+        """ Move on to the next row of the method
+        """
+        self.row_number += 1
+        if self.method is not None:
+            self.row = self.method.next_row( self.row, self.row_number )
+
+    def handle_input( self, data ):
+        """ Handle bytes written by PiBells: 0xFE requests the delays, a delay message ends with 0xFF
+            Anything else (e.g. the banner written on connecting) is ignored
+        """
+        for byte in data:
+            if byte == 0xFE:
+                self.received = bytearray()
+                os.write( self.master_fd, bytes( self.delays ) + b"\xFF" )
+            elif byte == 0xFF:
+                if len( self.received ) >= 12:
+                    self.delays = list( self.received[-12:] )
+                    self.delays_written += 1
+                    self.logger.debug("Simulator received delays %s", self.delays )
+                self.received = bytearray()
+            else:
+                self.received.append( byte )
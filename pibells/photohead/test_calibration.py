@@ -0,0 +1,61 @@
+# Tests for calibrating the photohead delays, run with: python3 -m pytest pibells
+
+import unittest
+
+from pibells.photohead.calibration import delay_calibration
+
+gap_ns = 200000000
+
+class fake_photohead:
+    """ Class standing in for a photohead_interface with its delays loaded, keeping the delays written
+    """
+    def __init__( self, bell_map = None ):
+        self.device_name = "fake"
+        self.bell_map = bell_map
+        self.delays_loaded = True
+        self.current_delays = [ 10 ]*12
+        self.min_delay = 1
+        self.max_delay = 250
+        self.written = []
+
+    def write_delays_to_photohead( self ):
+        self.written.append( list( self.current_delays ) )
+        return True
+
+class delay_calibration_test( unittest.TestCase ):
+    def ring_rounds( self, calibration, rows, late_ns ):
+        """ Ring rows of rounds on 6, with each bell late by late_ns[ bell - 1 ]
+        """
+        time_ns = 0
+        for row in range( 0, rows ):
+            for bell in range( 1, 7 ):
+                calibration.add_strike( bell, time_ns + late_ns[ bell - 1 ] )
+                time_ns += gap_ns
+
+    def test_apply( self ):
+        calibration = delay_calibration()
+        calibration.start( 6 )
+        #The 3rd and 4th 30ms late, so the fitted line is 10ms later than the rest
+        self.ring_rounds( calibration, 20, [ 0, 0, 30000000, 30000000, 0, 0 ] )
+        for offset_ms, expected_ms in zip( calibration.offsets_ms(), [ -10, -10, 20, 20, -10, -10 ] ):
+            self.assertAlmostEqual( offset_ms, expected_ms )
+
+        photohead = fake_photohead()
+        back_photohead = fake_photohead( [ 0, 0, 0, 3, 4, 0, 0, 0, 0, 0, 0, 0 ] )
+        self.assertTrue( calibration.apply( [ photohead, back_photohead ] ) )
+        self.assertFalse( calibration.active )
+        self.assertEqual( photohead.written, [ [ 11, 11, 8, 8, 11, 11 ] + [ 10 ]*6 ] )
+        #Its 4th and 5th ring the 3rd and 4th, the rest aren't rung
+        self.assertEqual( back_photohead.written, [ [ 10, 10, 10, 8, 8 ] + [ 10 ]*7 ] )
+
+    def test_not_enough_rows( self ):
+        calibration = delay_calibration()
+        calibration.start( 6 )
+        self.ring_rounds( calibration, 19, [0]*6 )
+        photohead = fake_photohead()
+        self.assertFalse( calibration.apply( [ photohead ] ) )
+        self.assertTrue( calibration.active )
+        self.assertEqual( photohead.written, [] )
+
+if __name__ == '__main__':
+    unittest.main()
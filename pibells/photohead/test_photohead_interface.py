@@ -0,0 +1,115 @@
+# Tests for reading bells and the delay message from the photohead, run with: python3 -m pytest pibells
+
+import time
+import unittest
+
+from pibells.photohead.photohead_interface import photohead_interface
+from pibells.photohead.serial_ingest import serial_ingest
+from pibells.photohead.simulator import photohead_simulator
+
+#Delays that are also the codes for bells 5, 10 and 12, so could be mistaken for them
+delays = [ 53, 2, 3, 48, 5, 6, 7, 8, 9, 10, 84, 12 ]
+delay_message = bytes( delays ) + b"\xFF"
+
+class fake_connection:
+    """ Class standing in for the serial connection, keeping what is written
+    """
+    def __init__( self ):
+        self.written = bytearray()
+
+    def write( self, data ):
+        self.written += data
+
+class collect_delay_bytes_test( unittest.TestCase ):
+    def setUp( self ):
+        self.photohead = photohead_interface( "unused" )
+        self.photohead.con = fake_connection()
+        self.photohead.send_delay_request()
+        self.start_ns = self.photohead.awaiting_time_ns
+        self.byte_time_ns = self.photohead.byte_time_ns
+
+    def bells( self, events ):
+        return [ bell for bell, strike_time_ns, photohead in events ]
+
+    def test_request_sent_once( self ):
+        self.photohead.send_delay_request()
+        self.assertEqual( bytes( self.photohead.con.written ), b"\xFE" )
+        self.assertTrue( self.photohead.awaiting_delays )
+
+    def test_message_after_strikes( self ):
+        #Two strikes, then the message, all read in one go
+        events = self.photohead.decode_bytes( b"12" + delay_message, self.start_ns )
+        self.assertEqual( self.bells( events ), [ 1, 2 ] )
+        self.assertTrue( self.photohead.delays_loaded )
+        self.assertFalse( self.photohead.awaiting_delays )
+        self.assertEqual( self.photohead.get_delays(), delays )
+        self.assertEqual( self.photohead.unexpected_bytes, 0 )
+
+    def test_message_split_across_reads( self ):
+        events = self.photohead.decode_bytes( b"3" + delay_message[ :5 ], self.start_ns )
+        events += self.photohead.decode_bytes( delay_message[ 5: ] + b"4", self.start_ns + 9 * self.byte_time_ns )
+        self.assertEqual( self.bells( events ), [ 3, 4 ] )
+        self.assertEqual( self.photohead.get_delays(), delays )
+
+    def test_strikes_released_when_nothing_follows( self ):
+        #A strike while waiting is held, as it could be the first delay, but not lost
+        self.assertEqual( self.photohead.decode_bytes( b"5", self.start_ns ), [] )
+        self.assertEqual( self.photohead.check_delay_bytes( self.start_ns + self.byte_time_ns ), [] )
+        events = self.photohead.check_delay_bytes( self.start_ns + 6 * self.byte_time_ns )
+        self.assertEqual( events, [ ( 5, self.start_ns, self.photohead ) ] )
+
+        #Or released by the next strike, which doesn't follow straight on
+        events = self.photohead.decode_bytes( b"6", self.start_ns + 100000000 )
+        events += self.photohead.decode_bytes( b"7", self.start_ns + 200000000 )
+        self.assertEqual( self.bells( events ), [ 6 ] )
+        self.assertTrue( self.photohead.awaiting_delays )
+
+    def test_strikes_more_than_message( self ):
+        #Strikes straight after each other, too many to be the message
+        events = self.photohead.decode_bytes( b"123456789" + b"0ET1", self.start_ns )
+        self.assertEqual( self.bells( events ), [ 1 ] )
+        events = self.photohead.check_delay_bytes( self.start_ns + 6 * self.byte_time_ns )
+        self.assertEqual( self.bells( events ), [ 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 1 ] )
+
+    def test_timeout( self ):
+        #The photohead never answers, the wait is limited and then the request given up
+        self.assertEqual( self.photohead.delay_wait_ns( self.start_ns ), 5 * 1000000000 )
+        self.photohead.check_delay_bytes( self.start_ns + 6 * 1000000000 )
+        self.assertFalse( self.photohead.awaiting_delays )
+        self.assertFalse( self.photohead.delays_loaded )
+        self.assertIsNone( self.photohead.delay_wait_ns( self.start_ns ) )
+
+class serial_ingest_delays_test( unittest.TestCase ):
+    def test_read_delays_while_ringing( self ):
+        simulator = photohead_simulator( stage = 12, changes_per_minute = 60, jitter_ms = 0 )
+        simulator.delays = list( delays )
+        photohead = photohead_interface( simulator.device_name )
+        ingest = serial_ingest()
+        simulator.start()
+        try:
+            self.assertTrue( photohead.connect() )
+            ingest.add_photohead( photohead )
+            ingest.start()
+            time.sleep( 0.2 )
+            #From another thread to the ingest thread, as the keyboard commands do
+            photohead.read_delays_from_photohead()
+            end_s = time.monotonic() + 2
+            while not photohead.delays_loaded and time.monotonic() < end_s:
+                time.sleep( 0.01 )
+            self.assertTrue( photohead.delays_loaded )
+            self.assertEqual( photohead.get_delays(), delays )
+
+            #Every bell sent was read, none were taken for the message
+            sent = simulator.strikes_sent
+            time.sleep( 0.2 )
+            self.assertGreaterEqual( ingest.events.qsize(), sent )
+            self.assertEqual( photohead.unexpected_bytes, 0 )
+        finally:
+            ingest.stop()
+            ingest.close()
+            photohead.disconnect()
+            simulator.stop()
+        self.assertIsNone( photohead.ingest )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+# Tests for reading and writing the config file, run with: python3 -m pytest pibells
+
+import configparser
+import os
+import shutil
+import tempfile
+import unittest
+
+from pibells.configuration import Configuration
+
+
+class FakeBellSounds:
+    # Stands in for the bell_sound_player, with the tenor and key last selected
+
+    def __init__(self, tenor, key_index):
+        self.tenor = tenor
+        self.key_index = key_index
+
+    def get_tenor(self):
+        return self.tenor
+
+    def get_valid_peal_index(self):
+        return self.key_index
+
+
+class ConfigurationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="pibells_config_test_")
+        self.config_file = os.path.join(self.directory, "pibells.ini")
+        self.config = Configuration(self.config_file)
+        self.config.ReadConfigFile()
+        self.config.LoadConfigFile()
+
+    def tearDown(self):
+        self.config.StopBackgroundWriter()
+        shutil.rmtree(self.directory)
+
+    def ReadSettings(self):
+        config = configparser.ConfigParser()
+        config.read(self.config_file)
+        return dict(config.items("settings"))
+
+    def EditSetting(self, name, value):
+        # Edit the file by hand, as a text editor would
+        config = configparser.ConfigParser()
+        config.read(self.config_file)
+        config.set("settings", name, value)
+        with open(self.config_file, 'w') as cfgfile:
+            config.write(cfgfile)
+
+    def StartPendingWrite(self):
+        # Request a write that the background writer holds back until the interval is up
+        self.config.write_interval_s = 60
+        self.config.WriteConfigFile()
+        self.config.StartBackgroundWriter()
+        self.config.RequestWrite()
+
+    def test_write_keeps_hand_edit(self):
+        self.StartPendingWrite()
+        self.EditSetting("logging_debug", "True")
+        # Changed in memory, e.g. by a key, before the edit has been reloaded
+        self.config.play_mode = False
+        self.config.Flush()
+
+        settings = self.ReadSettings()
+        self.assertEqual(settings['logging_debug'], "True")
+        self.assertEqual(settings['play_mode'], "False")
+        self.assertTrue(self.config.logging_debug)
+
+        # The edit is still handed to the reload, to be acted on
+        self.assertTrue(self.config.CheckForChanges())
+        self.assertEqual(self.config.ReloadConfigFile(), ['logging_debug'])
+        self.assertFalse(self.config.CheckForChanges())
+
+    def test_write_keeps_hand_edited_tenor(self):
+        self.config.bell_sounds = FakeBellSounds(12, 0)
+        self.StartPendingWrite()
+        self.EditSetting("tenor", "8")
+        self.config.Flush()
+
+        # Not taken from the bells, which haven't been changed to the edited tenor yet
+        self.assertEqual(self.ReadSettings()['tenor'], "8")
+        self.assertEqual(self.config.ReloadConfigFile(), ['tenor'])
+        self.assertEqual(self.config.tenor, 8)
+
+    def test_own_write_is_not_a_change(self):
+        self.config.WriteConfigFile()
+        self.assertFalse(self.config.CheckForChanges())
+        self.EditSetting("play_mode", "False")
+        self.assertTrue(self.config.CheckForChanges())
+        self.assertEqual(self.config.ReloadConfigFile(), ['play_mode'])
+        self.assertFalse(self.config.play_mode)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,57 +2,154 @@
 # - playing methods without needing an input
 
 import threading
+import time
+import logging
+
 from pibells.core.place_notation_processor import place_notation_processor
 from pibells.core.placenotation import place_notation
+from pibells.core.latency_stats import latency_histogram
+from pibells.core import strike_journal
 
 
 class pibells_demo:
     """ Class to play different methods without needing the serial interface
         This is intended for demonstrations
+        The bells are timed by one long lived thread against absolute deadlines on the monotonic clock,
+        so the time taken to play each bell doesn't add up into drift
     """
-    def __init__( self, bell_sounds, delay_between_bells_s, place_notation_object = place_notation() ):
+    def __init__( self, bell_sounds, delay_between_bells_s, place_notation_object = place_notation(), handstroke_gap = 1.0 ):
         """ Create the pibells_demo class and prepare for use
             bell_sounds, reference to the bell sounds object for playing the sounds
             delay_between_bells_s, the delay between bells ringing
             place_notation, the place notation (method definition) class to play, or None
+            handstroke_gap, the extra gap before each handstroke row, in bells
         """
         self.bell_sounds = bell_sounds
         self.delay_between_bells_s = delay_between_bells_s
-        self.place_notation = place_notation_object
-        
+        self.handstroke_gap = handstroke_gap
+
+        self.set_place_notation( place_notation_object )
+
+        #All the state shared with the thread is protected by the condition, which also wakes the thread
+        self.condition = threading.Condition()
         self.keep_playing = False
-        
-        self.timer = None
-        
+        self.closing = False
+        self.thread = None
+
+        #The time.monotonic_ns() the next bell should be heard at
+        self.next_deadline_ns = 0
+
+        #How late the thread woke for each bell, and how often it fell so far behind it started again
+        self.scheduling_error = latency_histogram()
+        self.resyncs = 0
+
+        #The strike_journal to record each bell played in, if any
+        self.journal = None
+
+        self.logger = logging.getLogger("PiBells")
+
+    def set_place_notation( self, place_notation_object ):
+        """ Set the method to be played, used from the next start
+        """
+        self.place_notation = place_notation_object
         self.pnp = place_notation_processor( self.place_notation.string, self.place_notation.add_tenor )
-    
-    def start( self ):
-        """ Start the demonstration
-        """
-        self.pnp.reset()
-        self.keep_playing = True
-        
-        self.play()
-    
-    def play( self ):
-        """ Play the next bell in the sequence
-        """
-        #Get the next bell to play
-        bell = self.pnp.get_next_bell()
-        
-        self.bell_sounds.play_bell( bell )
-        
-        if self.keep_playing:
-            self.timer = threading.Timer( self.delay_between_bells_s, self.play )
-            self.timer.start()
-            pass
-    
+
+    def start( self, place_notation_object = None ):
+        """ Start the demonstration from rounds, optionally changing the method first
+            The thread is created the first time and then reused
+        """
+        with self.condition:
+            if place_notation_object is not None:
+                self.set_place_notation( place_notation_object )
+            self.pnp.reset()
+
+            #Give the bell sounds time to schedule the first bell
+            self.next_deadline_ns = time.monotonic_ns() + self.bell_sounds.get_scheduling_lead_ns()
+            self.keep_playing = True
+
+            if self.thread is None:
+                self.thread = threading.Thread( target = self.run, name = "pibells_demo", daemon = True )
+                self.thread.start()
+            self.condition.notify()
+
     def stop( self ):
-        """ Stop the playing
+        """ Stop the playing, the thread waits to be started again
         """
-        self.keep_playing = False
-        if self.timer is not None:
-            self.timer.cancel()
-        
-        
-        
\ No newline at end of file
+        with self.condition:
+            if self.keep_playing:
+                self.keep_playing = False
+                self.condition.notify()
+                self.log_timing()
+
+    def close( self ):
+        """ Stop the playing and end the thread
+        """
+        with self.condition:
+            self.keep_playing = False
+            self.closing = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def set_tempo( self, delay_between_bells_s ):
+        """ Change the delay between bells, this takes effect from the bell after the next one
+        """
+        with self.condition:
+            self.delay_between_bells_s = delay_between_bells_s
+            self.condition.notify()
+
+    def run( self ):
+        """ The thread body, play each bell at its deadline then move the deadline on
+        """
+        with self.condition:
+            while not self.closing:
+                if not self.keep_playing:
+                    self.condition.wait()
+                    continue
+
+                #Wake early enough for the bell sounds to schedule the bell for its deadline
+                wake_ns = self.next_deadline_ns - self.bell_sounds.get_scheduling_lead_ns()
+                now_ns = time.monotonic_ns()
+                if now_ns < wake_ns:
+                    #Woken early (or by a change), go back round in case it was stopped
+                    self.condition.wait( ( wake_ns - now_ns ) / 1e9 )
+                    continue
+
+                try:
+                    self.play_next( now_ns - wake_ns )
+                except Exception:
+                    self.logger.exception("Error playing demo bell")
+
+    def play_next( self, late_ns ):
+        """ Play the next bell in the sequence, which is due at next_deadline_ns
+            late_ns, how late the thread woke for it
+        """
+        gap_ns = int( self.delay_between_bells_s * 1e9 )
+
+        if late_ns > gap_ns:
+            #Too far behind to catch up (e.g. the Pi was busy), start the timing again from now
+            self.resyncs += 1
+            self.next_deadline_ns += late_ns
+            late_ns = 0
+
+        #Get the next bell to play, the handstroke gap is a pause rather than a bell
+        bell = self.pnp.get_next_bell()
+        if bell < 0:
+            self.next_deadline_ns += int( self.handstroke_gap * gap_ns )
+            return
+
+        self.scheduling_error.record( late_ns )
+        sample_index = self.bell_sounds.play_bell_at( bell, self.next_deadline_ns )
+        if self.journal is not None:
+            self.journal.add( strike_journal.DEMO, bell, sample_index, False, self.next_deadline_ns )
+        self.next_deadline_ns += gap_ns
+
+    def log_timing( self ):
+        """ Log how accurately the bells have been scheduled
+        """
+        error = self.scheduling_error
+        if error.count == 0:
+            return
+        self.logger.info("Demo scheduling error over %d bells: p50 %.3fms p99 %.3fms max %.3fms, restarted the timing %d times",
+            error.count, error.percentile( 50 ) / 1e6, error.percentile( 99 ) / 1e6, error.max_ns / 1e6, self.resyncs )
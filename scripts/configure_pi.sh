@@ -37,7 +37,7 @@ sudo apt-get -y install python-dev libsdl-image1.2-dev libsdl-mixer1.2-dev libsd
 
 ## Python packages
 printf "%b\n" "\${BOLD}\${BLUE}Installing python packages\${NO_COLOUR}" | tee -a \${LOG_FILE}
-sudo pip3 install pygame keyboard configparser pyserial >> \${LOG_FILE}
+sudo pip3 install pygame keyboard configparser pyserial numpy >> \${LOG_FILE}
 
 ## Setup VSFTPd
 printf "%b\n" "\${BOLD}\${BLUE}Configuring VSFTPd\${NO_COLOUR}" | tee -a \${LOG_FILE}